@@ -1,45 +1,287 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Dict, Optional
 import asyncpg
 from bot.config import config
+from bot.db.pool_limiter import AdaptiveLimit
+from bot.utils.periodic import PeriodicTask
+from bot.utils.metrics import Histogram, QueryStats
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the replica itself is unreachable, as opposed to a bad query
+REPLICA_FAILURES = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.exceptions.CannotConnectNowError
+)
+
+class Route:
+    """Query methods bound to the primary or, for stale-tolerant reads, the replica"""
+
+    def __init__(self, readonly: bool):
+        self.readonly = readonly
+
+    async def fetch(self, query, *args):
+        return await Database.call('fetch', query, args, self.readonly)
+
+    async def fetchrow(self, query, *args):
+        return await Database.call('fetchrow', query, args, self.readonly)
+
+    async def fetchval(self, query, *args):
+        return await Database.call('fetchval', query, args, self.readonly)
+
+    async def execute(self, query, *args):
+        if self.readonly:
+            raise ValueError("execute is not routed to the read replica")
+        return await Database.call('execute', query, args)
 
 class Database:
     _pool = None
+    _replica_pool = None
+    _replica_lock: Optional[asyncio.Lock] = None
+    _replica_down_until = 0.0
+    _limiter: Optional[AdaptiveLimit] = None
+    _tuner: Optional[PeriodicTask] = None
+    _waiting = 0
+
+    # Hot statements declared once by name; the name keys their metrics and
+    # asyncpg's per-connection statement cache keeps them prepared
+    _queries: Dict[str, str] = {}
+    _stats: Dict[str, QueryStats] = defaultdict(QueryStats)
+    _acquire_wait = Histogram()
+    # Waits since the last tuner run, so adjustments react to current load
+    _recent_wait = Histogram()
+
+    @classmethod
+    def register(cls, name: str, query: str) -> str:
+        """Declare a named query; pass the returned name instead of the SQL"""
+        cls._queries[name] = query
+        return name
+
+    @classmethod
+    def read(cls) -> Route:
+        """Route for reads that tolerate replication lag; falls back to the primary"""
+        return _READ
+
+    @classmethod
+    def write(cls) -> Route:
+        """Route for writes and reads that must see the latest commit"""
+        return _WRITE
 
     @classmethod
     async def get_pool(cls):
         if cls._pool is None:
-            cls._pool = await asyncpg.create_pool(
-                dsn=config.database_url,
-                min_size=5,
-                max_size=20
-            )
+            cls._pool = await cls._create_pool(config.database_url)
+            low = config.db_pool_min_size if config.db_pool_adaptive else config.db_pool_max_size
+            cls._limiter = AdaptiveLimit(low, config.db_pool_max_size, config.db_pool_target_wait_ms)
         return cls._pool
 
+    @classmethod
+    async def get_replica_pool(cls) -> Optional[asyncpg.Pool]:
+        """Replica pool, or None when unconfigured or recently unreachable"""
+        if not config.database_replica_url or time.monotonic() < cls._replica_down_until:
+            return None
+        if cls._replica_pool is None:
+            if cls._replica_lock is None:
+                cls._replica_lock = asyncio.Lock()
+            # Concurrent first reads share one pool instead of each creating one
+            async with cls._replica_lock:
+                if cls._replica_pool is None:
+                    if time.monotonic() < cls._replica_down_until:
+                        return None
+                    try:
+                        cls._replica_pool = await cls._create_pool(config.database_replica_url)
+                    except REPLICA_FAILURES as e:
+                        cls._mark_replica_down(e)
+                        return None
+        return cls._replica_pool
+
+    @classmethod
+    async def _create_pool(cls, dsn: str):
+        return await asyncpg.create_pool(
+            dsn=dsn,
+            min_size=config.db_pool_min_size,
+            max_size=config.db_pool_max_size,
+            max_inactive_connection_lifetime=config.db_pool_max_idle_lifetime,
+            command_timeout=config.db_command_timeout,
+            # Room for every registered query plus the ad-hoc ones
+            statement_cache_size=max(100, 2 * len(cls._queries))
+        )
+
+    @classmethod
+    def _mark_replica_down(cls, error: Exception):
+        cls._replica_down_until = time.monotonic() + config.replica_retry_after
+        logger.warning(f"Read replica unavailable, using primary for {config.replica_retry_after}s: {error}")
+
     @classmethod
     async def close(cls):
         if cls._pool:
             await cls._pool.close()
             cls._pool = None
+            cls._limiter = None
+        if cls._replica_pool:
+            await cls._replica_pool.close()
+            cls._replica_pool = None
+
+    @classmethod
+    @asynccontextmanager
+    async def acquire(cls, pool=None):
+        """Acquire a pooled connection, recording how long the wait took"""
+        pool = pool or await cls.get_pool()
+        limiter = cls._limiter if pool is cls._pool else None
+        async with AsyncExitStack() as stack:
+            start = time.perf_counter()
+            cls._waiting += 1
+            try:
+                if limiter:
+                    await stack.enter_async_context(limiter)
+                conn = await stack.enter_async_context(pool.acquire())
+            finally:
+                cls._waiting -= 1
+            wait_ms = (time.perf_counter() - start) * 1000
+            cls._acquire_wait.observe(wait_ms)
+            cls._recent_wait.observe(wait_ms)
+            yield conn
 
+    @classmethod
+    def pool_gauges(cls) -> Dict[str, int]:
+        """Current size, in-use, idle and waiting counts for the primary pool"""
+        if cls._pool is None:
+            return {}
+        size = cls._pool.get_size()
+        idle = cls._pool.get_idle_size()
+        return {
+            'size': size,
+            'in_use': size - idle,
+            'idle': idle,
+            'waiting': cls._waiting,
+            'limit': cls._limiter.limit if cls._limiter else size
+        }
+
+    @classmethod
+    async def tune_pool(cls):
+        """Move the checkout limit based on wait times since the last run"""
+        recent, cls._recent_wait = cls._recent_wait, Histogram()
+        if cls._limiter:
+            await cls._limiter.adjust(recent.percentile(95), cls._waiting)
+
+    @classmethod
+    def start_pool_tuner(cls):
+        if not config.db_pool_adaptive:
+            return
+        cls._tuner = PeriodicTask("db-pool-tuner", config.db_pool_adjust_interval, cls.tune_pool)
+        cls._tuner.start()
+
+    @classmethod
+    async def stop_pool_tuner(cls):
+        if cls._tuner:
+            await cls._tuner.stop()
+            cls._tuner = None
+
+    @classmethod
+    async def run(cls, conn, method: str, query: str, *args):
+        """Run fetch/fetchrow/fetchval/execute/executemany on `conn` with timing.
+
+        `query` is either a registered name, which runs its SQL and is
+        timed under that name, or raw SQL, counted under 'unregistered'.
+        """
+        name = query if query in cls._queries else 'unregistered'
+        sql = cls._queries.get(query, query)
+        stats = cls._stats[name]
+        start = time.perf_counter()
+        try:
+            # Passing SQL, not a PreparedStatement: asyncpg invalidates those
+            # when the connection goes back to the pool, while its statement
+            # cache keeps the server-side statement across checkouts and
+            # re-prepares it after schema changes
+            result = await getattr(conn, method)(sql, *args)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.latency_ms.observe((time.perf_counter() - start) * 1000)
+
+        stats.rows += cls._row_count(method, result)
+        return result
+
+    @staticmethod
+    def _row_count(method: str, result) -> int:
+        if method == 'fetch':
+            return len(result)
+        if method == 'fetchrow':
+            return 1 if result is not None else 0
+        if method == 'execute' and result:
+            # Status like "UPDATE 3" or "INSERT 0 1"
+            last = result.rsplit(' ', 1)[-1]
+            return int(last) if last.isdigit() else 0
+        return 0
+
+    @classmethod
+    def stats(cls) -> Dict:
+        """Per-query latency (ms), row and error counts plus pool wait times"""
+        return {
+            'queries': {name: stats.summary() for name, stats in cls._stats.items()},
+            'acquire_wait_ms': cls._acquire_wait.summary(),
+            'pool': cls.pool_gauges()
+        }
+
+    @classmethod
+    async def log_stats(cls):
+        """Log the queries that used the most database time"""
+        top = sorted(cls._stats.items(), key=lambda item: item[1].latency_ms.total, reverse=True)
+        for name, stats in top[:10]:
+            summary = stats.summary()
+            logger.info(
+                f"query {name}: {summary['count']} calls, {summary['total_ms']:.0f}ms total, "
+                f"p50 {summary['p50']}ms, p99 {summary['p99']}ms, {summary['rows']} rows, "
+                f"{summary['errors']} errors"
+            )
+        wait = cls._acquire_wait.summary()
+        logger.info(f"pool acquire wait: p50 {wait['p50']}ms, p99 {wait['p99']}ms over {wait['count']} acquires")
+        gauges = cls.pool_gauges()
+        if gauges:
+            logger.info(
+                f"pool: {gauges['in_use']} in use, {gauges['idle']} idle, {gauges['waiting']} waiting, "
+                f"size {gauges['size']}, limit {gauges['limit']}"
+            )
+
+    @classmethod
+    async def call(cls, method: str, query: str, args=(), readonly: bool = False):
+        """Run one query on a pooled connection, on the replica if `readonly` allows"""
+        if readonly:
+            replica = await cls.get_replica_pool()
+            if replica is not None:
+                try:
+                    async with cls.acquire(replica) as conn:
+                        return await cls.run(conn, method, query, *args)
+                except REPLICA_FAILURES as e:
+                    cls._mark_replica_down(e)
+
+        async with cls.acquire() as conn:
+            return await cls.run(conn, method, query, *args)
+
+    # Shorthands for the primary, kept for existing callers
     @classmethod
     async def execute(cls, query, *args):
-        pool = await cls.get_pool()
-        async with pool.acquire() as conn:
-            return await conn.execute(query, *args)
+        return await cls.call('execute', query, args)
 
     @classmethod
     async def fetch(cls, query, *args):
-        pool = await cls.get_pool()
-        async with pool.acquire() as conn:
-            return await conn.fetch(query, *args)
+        return await cls.call('fetch', query, args)
 
     @classmethod
     async def fetchrow(cls, query, *args):
-        pool = await cls.get_pool()
-        async with pool.acquire() as conn:
-            return await conn.fetchrow(query, *args)
+        return await cls.call('fetchrow', query, args)
 
     @classmethod
     async def fetchval(cls, query, *args):
-        pool = await cls.get_pool()
-        async with pool.acquire() as conn:
-            return await conn.fetchval(query, *args) 
\ No newline at end of file
+        return await cls.call('fetchval', query, args)
+
+_READ = Route(readonly=True)
+_WRITE = Route(readonly=False)
@@ -0,0 +1,123 @@
+"""Apply pending SQL migrations in order.
+
+    python -m bot.db.migrate                 # apply everything pending
+    python -m bot.db.migrate --status        # list applied and pending files
+    python -m bot.db.migrate --baseline 001  # record 001 as applied without running it
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, List, Tuple
+import asyncpg
+from bot.config import config
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / "migrations"
+
+# Held for the whole run so two deploys never migrate at once
+MIGRATION_LOCK_ID = 7_307_001
+
+class MigrationRunner:
+    """Tracks applied migrations in schema_migrations and applies the rest"""
+
+    def __init__(self, conn: asyncpg.Connection, directory: Path = MIGRATIONS_DIR):
+        self.conn = conn
+        self.directory = directory
+
+    @staticmethod
+    def version_of(path: Path) -> str:
+        return path.name.split("_", 1)[0]
+
+    def files(self) -> List[Tuple[str, Path]]:
+        return sorted((self.version_of(path), path) for path in self.directory.glob("*.sql"))
+
+    @staticmethod
+    def checksum(path: Path) -> str:
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+
+    async def ensure_table(self):
+        await self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+
+    async def applied(self) -> Dict[str, str]:
+        rows = await self.conn.fetch("SELECT version, checksum FROM schema_migrations")
+        return {row['version']: row['checksum'] for row in rows}
+
+    async def pending(self) -> List[Tuple[str, Path]]:
+        applied = await self.applied()
+        for version, path in self.files():
+            if version in applied and applied[version] != self.checksum(path):
+                logger.warning(f"Migration {path.name} changed after it was applied")
+        return [(version, path) for version, path in self.files() if version not in applied]
+
+    async def _record(self, version: str, path: Path):
+        await self.conn.execute(
+            "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+            version, path.name, self.checksum(path)
+        )
+
+    async def migrate(self) -> int:
+        """Apply each pending migration in its own transaction; returns how many ran"""
+        count = 0
+        for version, path in await self.pending():
+            logger.info(f"Applying {path.name}")
+            async with self.conn.transaction():
+                await self.conn.execute(path.read_text())
+                await self._record(version, path)
+            count += 1
+        return count
+
+    async def baseline(self, upto: str) -> int:
+        """Mark migrations up to `upto` as applied, for databases migrated by hand"""
+        count = 0
+        for version, path in await self.pending():
+            if version > upto:
+                break
+            await self._record(version, path)
+            count += 1
+        return count
+
+async def run(args):
+    conn = await asyncpg.connect(config.database_url)
+    try:
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+        try:
+            runner = MigrationRunner(conn)
+            await runner.ensure_table()
+
+            if args.status:
+                applied = await runner.applied()
+                for version, path in runner.files():
+                    state = "applied" if version in applied else "pending"
+                    print(f"{state:8} {path.name}")
+            elif args.baseline:
+                count = await runner.baseline(args.baseline)
+                logger.info(f"Recorded {count} migrations as applied")
+            else:
+                count = await runner.migrate()
+                logger.info(f"Applied {count} migrations" if count else "Database is up to date")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+    finally:
+        await conn.close()
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Apply pending SQL migrations")
+    parser.add_argument("--status", action="store_true", help="list applied and pending migrations")
+    parser.add_argument("--baseline", metavar="VERSION", help="record migrations up to VERSION as applied")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import logging
+from datetime import date, datetime, timezone
+from typing import Optional
+from bot.config import config
+from bot.db.connection import Database
+from bot.utils.periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+class TapPartitions:
+    """Keeps monthly taps partitions created ahead of time and detaches expired ones"""
+    _task: Optional[PeriodicTask] = None
+
+    @staticmethod
+    def _add_months(day: date, months: int) -> date:
+        month = day.month - 1 + months
+        return date(day.year + month // 12, month % 12 + 1, 1)
+
+    @classmethod
+    async def maintain(cls):
+        today = datetime.now(timezone.utc).date()
+        created = await Database.fetchval(
+            "SELECT create_taps_partitions($1, $2)",
+            today, cls._add_months(today, config.taps_partitions_ahead)
+        )
+        if created:
+            logger.info(f"Created {created} taps partitions")
+
+        if config.taps_retention_months:
+            cutoff = cls._add_months(today, -config.taps_retention_months)
+            detached = await Database.fetch("SELECT detach_taps_partitions($1) AS name", cutoff)
+            for row in detached:
+                logger.info(f"Detached taps partition {row['name']}")
+
+    @classmethod
+    def start(cls):
+        cls._task = PeriodicTask("taps-partitions", config.partition_maintenance_interval, cls.maintain)
+        # Run right away so a long shutdown never leaves inserts without a partition
+        cls._task.start(run_now=True)
+
+    @classmethod
+    async def stop(cls):
+        if cls._task:
+            await cls._task.stop()
+            cls._task = None
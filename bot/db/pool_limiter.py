@@ -0,0 +1,47 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class AdaptiveLimit:
+    """Caps concurrent pool checkouts at a limit that moves between two bounds.
+
+    asyncpg cannot resize a live pool, so the pool is created at the upper
+    bound and this limit decides how many connections may be checked out.
+    Connections above the limit sit idle and are closed by the pool's
+    max_inactive_connection_lifetime.
+    """
+
+    def __init__(self, low: int, high: int, target_wait_ms: float):
+        self.low = low
+        self.high = high
+        self.target_wait_ms = target_wait_ms
+        self.limit = low
+        self.in_use = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_use < self.limit)
+            self.in_use += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.in_use -= 1
+            self._cond.notify()
+
+    async def adjust(self, p95_wait_ms: float, waiting: int):
+        """Grow when callers queue longer than the target, shrink when mostly idle"""
+        old = self.limit
+        if p95_wait_ms > self.target_wait_ms or waiting:
+            # Grow quickly under a tap storm
+            self.limit = min(self.high, self.limit + max(1, self.limit // 4))
+        elif p95_wait_ms < self.target_wait_ms / 4 and self.in_use <= self.limit // 2:
+            # Give connections back one at a time
+            self.limit = max(self.low, self.limit - 1)
+
+        if self.limit != old:
+            logger.info(f"Pool limit {old} -> {self.limit} (p95 wait {p95_wait_ms}ms, {waiting} waiting)")
+            async with self._cond:
+                self._cond.notify_all()
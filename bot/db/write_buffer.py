@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+from bot.config import config
+from bot.db.connection import Database
+from bot.utils.periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BALANCES = Database.register(
+    "tap_flush_balances",
+    """
+    UPDATE users 
+    SET balance = balance + $1,
+        lifetime_earned = lifetime_earned + $1
+    WHERE user_id = $2
+    """
+)
+
+KNOWN_USERS = Database.register(
+    "tap_flush_known_users",
+    "SELECT COALESCE(array_agg(user_id), '{}') FROM users WHERE user_id = ANY($1::bigint[])"
+)
+
+UPSERT_HOURLY_ROLLUP = Database.register(
+    "tap_rollup_hourly",
+    """
+    INSERT INTO tap_rollups_hourly (user_id, hour, taps, amount)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (user_id, hour) DO UPDATE
+    SET taps = tap_rollups_hourly.taps + EXCLUDED.taps,
+        amount = tap_rollups_hourly.amount + EXCLUDED.amount
+    """
+)
+
+UPSERT_DAILY_ROLLUP = Database.register(
+    "tap_rollup_daily",
+    """
+    INSERT INTO tap_rollups_daily (user_id, day, taps, amount)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (user_id, day) DO UPDATE
+    SET taps = tap_rollups_daily.taps + EXCLUDED.taps,
+        amount = tap_rollups_daily.amount + EXCLUDED.amount
+    """
+)
+
+class TapWriteBuffer:
+    """Accumulates tap rewards in memory and writes them to Postgres in batches.
+
+    Balance deltas are summed per user and tap rows are kept per user, so a
+    flush costs one executemany plus one COPY no matter how many taps arrived
+    since the previous flush. The same transaction folds the records into the
+    hourly and daily rollups and users.lifetime_earned.
+
+    A failed flush puts its batch back and retries with exponential backoff.
+    Once `tap_buffer_max_pending` taps are waiting, full() tells the tap
+    handler to turn new taps away until Postgres catches up.
+    """
+    _deltas: Dict[int, Decimal] = defaultdict(Decimal)
+    _taps: Dict[int, List[Tuple[Decimal, datetime]]] = defaultdict(list)
+    _size = 0
+    _lock: Optional[asyncio.Lock] = None
+    _flusher: Optional[PeriodicTask] = None
+    _pending_flush: Optional[asyncio.Task] = None
+    # Outage state: when flushing started failing and when to try again
+    _failing_since: Optional[float] = None
+    _retry_at = 0.0
+    _backoff = 0.0
+    MAX_BACKOFF = 60.0
+
+    @classmethod
+    def start(cls):
+        cls._flusher = PeriodicTask("tap-flush", config.tap_flush_interval, cls.flush)
+        cls._flusher.start()
+
+    @classmethod
+    async def stop(cls):
+        """Stop the periodic flusher and write out everything still buffered"""
+        if cls._flusher:
+            # A flush cancelled mid-write puts its batch back before exiting
+            await cls._flusher.stop()
+            cls._flusher = None
+        if cls._pending_flush:
+            await cls._pending_flush
+            cls._pending_flush = None
+        if not await cls.flush(force=True):
+            logger.error(f"Shutting down with {cls._size} taps that could not be written")
+
+    @classmethod
+    def add_tap(cls, user_id: int, amount: float):
+        amount = Decimal(str(amount))
+        cls._deltas[user_id] += amount
+        cls._taps[user_id].append((amount, datetime.now(timezone.utc).replace(tzinfo=None)))
+        cls._size += 1
+
+        # Flush early instead of waiting out the interval during a tap storm
+        if (
+            cls._size >= config.tap_buffer_max_size
+            and not cls._flush_scheduled()
+            and time.monotonic() >= cls._retry_at
+        ):
+            cls._pending_flush = asyncio.create_task(cls.flush())
+
+    @classmethod
+    def full(cls) -> bool:
+        """Whether new taps should be refused until buffered ones are written"""
+        return cls._size >= config.tap_buffer_max_pending
+
+    @classmethod
+    def size(cls) -> int:
+        return cls._size
+
+    @classmethod
+    def pending_balance(cls, user_id: int) -> Decimal:
+        """Balance change for a user that has not reached Postgres yet"""
+        return cls._deltas.get(user_id, Decimal(0))
+
+    @classmethod
+    async def flush(cls, force: bool = False) -> bool:
+        """Write everything buffered; False if the batch had to be put back.
+
+        Skipped while backing off after a failure unless `force` is set.
+        """
+        async with cls._get_lock():
+            if not cls._size:
+                return True
+            if not force and time.monotonic() < cls._retry_at:
+                return False
+
+            # Swap the buffers out before awaiting so new taps go to fresh ones
+            deltas, cls._deltas = cls._deltas, defaultdict(Decimal)
+            taps, cls._taps = cls._taps, defaultdict(list)
+            size, cls._size = cls._size, 0
+
+            try:
+                await cls._write(deltas, taps)
+            except BaseException as e:
+                # Includes cancellation at shutdown, which must not lose the batch
+                cls._requeue(deltas, taps, size)
+                if isinstance(e, Exception):
+                    cls._record_failure(e)
+                    return False
+                raise
+
+            cls._record_success(size)
+            return True
+
+    @classmethod
+    async def flush_user(cls, user_id: int):
+        """Write one user's pending taps now, e.g. before spending their balance"""
+        # Taking the lock also waits out a flush that already swapped this user's taps
+        async with cls._get_lock():
+            if user_id not in cls._deltas:
+                return
+            deltas = {user_id: cls._deltas.pop(user_id)}
+            taps = {user_id: cls._taps.pop(user_id, [])}
+            size = len(taps[user_id])
+            cls._size -= size
+
+            try:
+                await cls._write(deltas, taps)
+            except BaseException:
+                cls._requeue(deltas, taps, size)
+                raise
+
+    @classmethod
+    def _requeue(cls, deltas: Dict[int, Decimal], taps: Dict[int, List[Tuple[Decimal, datetime]]], size: int):
+        for user_id, amount in deltas.items():
+            cls._deltas[user_id] += amount
+        for user_id, user_taps in taps.items():
+            # Older taps go first so created_at order is kept
+            cls._taps[user_id][:0] = user_taps
+        cls._size += size
+
+    @classmethod
+    def _record_failure(cls, error: Exception):
+        now = time.monotonic()
+        cls._backoff = min(cls.MAX_BACKOFF, cls._backoff * 2 or config.tap_flush_interval)
+        cls._retry_at = now + cls._backoff
+        if cls._failing_since is None:
+            # Log the outage once, not on every retry
+            cls._failing_since = now
+            logger.error(f"Tap flush failed, keeping {cls._size} taps buffered and retrying: {error}")
+
+    @classmethod
+    def _record_success(cls, size: int):
+        if cls._failing_since is not None:
+            logger.info(
+                f"Tap flush recovered after {time.monotonic() - cls._failing_since:.0f}s, "
+                f"wrote {size} buffered taps"
+            )
+        cls._failing_since = None
+        cls._retry_at = 0.0
+        cls._backoff = 0.0
+
+    @classmethod
+    async def _write(cls, deltas: Dict[int, Decimal], taps: Dict[int, List[Tuple[Decimal, datetime]]]):
+        async with Database.acquire() as conn:
+            async with conn.transaction():
+                # taps and the rollups reference users, so one tap from an
+                # unregistered user would fail the whole COPY; leave those out
+                known = set(await Database.run(conn, 'fetchval', KNOWN_USERS, sorted(deltas)))
+                unknown = deltas.keys() - known
+                if unknown:
+                    logger.warning(
+                        f"Discarding taps from {len(unknown)} users with no users row: {sorted(unknown)[:10]}"
+                    )
+                    deltas = {user_id: amount for user_id, amount in deltas.items() if user_id in known}
+
+                records = [
+                    (user_id, amount, created_at)
+                    for user_id in sorted(deltas)
+                    for amount, created_at in taps.get(user_id, ())
+                ]
+                hourly, daily = cls._rollups(records)
+
+                # Rows are sorted so concurrent flushes lock them in the same order
+                await Database.run(
+                    conn,
+                    'executemany',
+                    FLUSH_BALANCES,
+                    [(amount, user_id) for user_id, amount in sorted(deltas.items())]
+                )
+                await conn.copy_records_to_table(
+                    "taps",
+                    records=records,
+                    columns=["user_id", "amount", "created_at"]
+                )
+                await Database.run(conn, 'executemany', UPSERT_HOURLY_ROLLUP, hourly)
+                await Database.run(conn, 'executemany', UPSERT_DAILY_ROLLUP, daily)
+
+    @staticmethod
+    def _rollups(records: List[Tuple[int, Decimal, datetime]]) -> Tuple[List[Tuple], List[Tuple]]:
+        """Aggregate tap records into sorted (user_id, bucket, taps, amount) rows"""
+        hours: Dict[Tuple[int, datetime], List] = defaultdict(lambda: [0, Decimal(0)])
+        for user_id, amount, created_at in records:
+            bucket = hours[(user_id, created_at.replace(minute=0, second=0, microsecond=0))]
+            bucket[0] += 1
+            bucket[1] += amount
+
+        days: Dict[Tuple[int, date], List] = defaultdict(lambda: [0, Decimal(0)])
+        for (user_id, hour), (taps, amount) in hours.items():
+            bucket = days[(user_id, hour.date())]
+            bucket[0] += taps
+            bucket[1] += amount
+
+        hourly = [(user_id, hour, taps, amount) for (user_id, hour), (taps, amount) in sorted(hours.items())]
+        daily = [(user_id, day, taps, amount) for (user_id, day), (taps, amount) in sorted(days.items())]
+        return hourly, daily
+
+    @classmethod
+    def _get_lock(cls) -> asyncio.Lock:
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        return cls._lock
+
+    @classmethod
+    def _flush_scheduled(cls) -> bool:
+        return cls._pending_flush is not None and not cls._pending_flush.done()
@@ -1,51 +1,41 @@
-import time
+from datetime import datetime, timezone
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from bot.db.connection import Database
-from bot.utils.redis_manager import RedisManager
-from bot.config import config
+from bot.utils.rate_limiter import RateLimiter
+from bot.services.daily_service import DailyService
 
 async def daily_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
-    # Get user's last daily claim
-    last_claim = await RedisManager.get_last_daily_claim(user.id)
-    current_time = time.time()
+    decision = await RateLimiter.hit("daily", user.id)
+    if not decision.allowed:
+        await update.message.reply_text(
+            f"⏳ Too many requests. Try again in {decision.retry_after:.0f} seconds."
+        )
+        return
     
-    if last_claim:
-        time_since_last_claim = current_time - last_claim
-        hours_remaining = 24 - (time_since_last_claim / 3600)
-        
-        if hours_remaining > 0:
-            await update.message.reply_text(
-                f"⏳ You can claim your daily reward in {hours_remaining:.1f} hours."
-            )
-            return
+    # Eligibility, streak and balance credit are decided in one statement
+    claim = await DailyService.claim_daily(user.id)
     
-    # Process daily claim
-    async with Database.get_pool().acquire() as conn:
-        async with conn.transaction():
-            # Add reward to user's balance
-            await conn.execute(
-                """
-                UPDATE users 
-                SET balance = balance + $1
-                WHERE user_id = $2
-                """,
-                config.daily_reward, user.id
-            )
-            
-            # Log daily claim
-            await conn.execute(
-                """
-                INSERT INTO daily_claims (user_id, amount)
-                VALUES ($1, $2)
-                """,
-                user.id, config.daily_reward
-            )
+    if claim.status == "no_user":
+        await update.message.reply_text(
+            "⚠️ You haven't started playing yet! Use /start to begin."
+        )
+        return
     
-    # Update last claim time
-    await RedisManager.set_last_daily_claim(user.id, current_time)
+    if claim.status == "in_progress":
+        await update.message.reply_text(
+            "⏳ Your daily reward is already being claimed. Try again in a few seconds."
+        )
+        return
+    
+    if claim.status == "already_claimed":
+        wait = DailyService.next_claim_time() - datetime.now(timezone.utc)
+        await update.message.reply_text(
+            f"⏳ You can claim your daily reward in {wait.total_seconds() / 3600:.1f} hours.\n"
+            f"🔥 Current streak: {claim.streak} days"
+        )
+        return
     
     # Create success message
     keyboard = [
@@ -62,8 +52,9 @@ async def daily_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     message = (
         f"🎁 Daily Reward Claimed!\n\n"
-        f"💰 +{config.daily_reward:.2f} AUG added to your balance.\n\n"
-        "Come back tomorrow for another reward!"
+        f"💰 +{claim.amount:.2f} AUG added to your balance.\n"
+        f"🔥 Streak: {claim.streak} days\n\n"
+        "Come back tomorrow to keep your streak going!"
     )
     
-    await update.message.reply_text(message, reply_markup=reply_markup) 
\ No newline at end of file
+    await update.message.reply_text(message, reply_markup=reply_markup)
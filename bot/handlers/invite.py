@@ -1,37 +1,48 @@
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from bot.db.connection import Database
+from bot.services.user_service import UserService
 from bot.config import config
 
-async def invite_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    
+REFERRAL_STATS = Database.register(
+    "referral_stats",
+    """
+    SELECT referrals as total_referrals, referral_earnings as total_earned
+    FROM users
+    WHERE user_id = $1
+    """
+)
+
+REFERRALS_PAGE_SIZE = 10
+CURSOR_EPOCH = datetime(1970, 1, 1)
+
+def _encode_cursor(cursor: Tuple[datetime, int]) -> str:
+    """Pack a (created_at, user_id) cursor into callback data (64 bytes max)"""
+    created_at, user_id = cursor
+    micros = (created_at - CURSOR_EPOCH) // timedelta(microseconds=1)
+    return f"refs_{micros:x}_{user_id:x}"
+
+def _decode_cursor(data: str) -> Optional[Tuple[datetime, int]]:
+    try:
+        micros, user_id = data[5:].split("_")
+        return CURSOR_EPOCH + timedelta(microseconds=int(micros, 16)), int(user_id, 16)
+    except ValueError:
+        return None
+
+async def _invite_text(user_id: int, bot_username: str) -> Optional[str]:
     # Get user's referral stats
-    referral_stats = await Database.fetchrow(
-        """
-        SELECT 
-            COUNT(DISTINCT r.referred_id) as total_referrals,
-            COALESCE(SUM(u.balance), 0) as total_earned
-        FROM users u
-        LEFT JOIN referrals r ON r.referrer_id = u.user_id
-        WHERE u.user_id = $1
-        GROUP BY u.user_id
-        """,
-        user.id
-    )
+    referral_stats = await Database.read().fetchrow(REFERRAL_STATS, user_id)
     
     if not referral_stats:
-        await update.message.reply_text(
-            "⚠️ You haven't started playing yet! Use /start to begin."
-        )
-        return
+        return None
     
     # Generate referral link
-    bot_username = context.bot.username
-    referral_link = f"https://t.me/{bot_username}?start=ref_{user.id}"
+    referral_link = f"https://t.me/{bot_username}?start=ref_{user_id}"
     
     # Create invite message
-    invite_text = (
+    return (
         f"👥 Invite Friends\n\n"
         f"📊 Your Referral Stats:\n"
         f"• Total Referrals: {referral_stats['total_referrals']}\n"
@@ -41,9 +52,12 @@ async def invite_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"{referral_link}\n\n"
         "Share this link with your friends to earn bonuses when they join!"
     )
-    
-    # Create keyboard
+
+def _invite_keyboard() -> InlineKeyboardMarkup:
     keyboard = [
+        [
+            InlineKeyboardButton("👥 View Referrals", callback_data="view_referrals")
+        ],
         [
             InlineKeyboardButton("🎯 Tap", callback_data="tap"),
             InlineKeyboardButton("👤 Profile", callback_data="profile")
@@ -53,24 +67,68 @@ async def invite_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             InlineKeyboardButton("🏆 Leaderboard", callback_data="leaderboard")
         ]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return InlineKeyboardMarkup(keyboard)
+
+async def invite_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
     
-    await update.message.reply_text(invite_text, reply_markup=reply_markup)
+    invite_text = await _invite_text(user.id, context.bot.username)
+    if not invite_text:
+        await update.message.reply_text(
+            "⚠️ You haven't started playing yet! Use /start to begin."
+        )
+        return
+    
+    await update.message.reply_text(invite_text, reply_markup=_invite_keyboard())
 
 async def invite_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle invite button callback"""
     query = update.callback_query
     await query.answer()
     
-    # Reuse invite logic
-    update.effective_message = query.message
-    await invite_command(update, context)
+    invite_text = await _invite_text(query.from_user.id, context.bot.username)
+    if not invite_text:
+        await query.edit_message_text(
+            "⚠️ You haven't started playing yet! Use /start to begin."
+        )
+        return
+    
+    await query.edit_message_text(invite_text, reply_markup=_invite_keyboard())
 
 async def back_to_invite_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle back to invite button callback"""
+    await invite_callback(update, context)
+
+async def view_referrals_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show one page of the user's referrals; the cursor rides in the callback data"""
     query = update.callback_query
     await query.answer()
     
-    # Reuse invite logic
-    update.effective_message = query.message
-    await invite_command(update, context) 
\ No newline at end of file
+    cursor = _decode_cursor(query.data) if query.data.startswith("refs_") else None
+    referrals, next_cursor = await UserService.get_referrals_page(
+        query.from_user.id, cursor, REFERRALS_PAGE_SIZE
+    )
+    
+    if referrals:
+        referrals_text = "👥 Your Referrals:\n\n"
+        for referral in referrals:
+            name = referral['username'] or referral['first_name']
+            referrals_text += f"• {name} (joined {referral['created_at']:%Y-%m-%d})\n"
+    elif cursor:
+        referrals_text = "👥 No more referrals."
+    else:
+        referrals_text = "👥 You haven't invited anyone yet. Share your link to get started!"
+    
+    # Create keyboard
+    navigation = []
+    if cursor:
+        navigation.append(InlineKeyboardButton("⏮ First Page", callback_data="view_referrals"))
+    if next_cursor:
+        navigation.append(InlineKeyboardButton("Next ▶", callback_data=_encode_cursor(next_cursor)))
+    
+    keyboard = []
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="back_to_invite")])
+    
+    await query.edit_message_text(referrals_text, reply_markup=InlineKeyboardMarkup(keyboard))
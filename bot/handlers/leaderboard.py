@@ -1,49 +1,24 @@
+import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from bot.db.connection import Database
-from bot.utils.redis_manager import RedisManager
+from bot.services.leaderboard_service import LeaderboardService
 
-async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    
-    # Get top players by balance
-    top_balance = await Database.fetch(
-        """
-        SELECT u.user_id, u.username, u.first_name, u.balance
-        FROM users u
-        ORDER BY u.balance DESC
-        LIMIT 10
-        """
-    )
-    
-    # Get top players by referrals
-    top_referrals = await Database.fetch(
-        """
-        SELECT u.user_id, u.username, u.first_name, COUNT(r.referred_id) as referral_count
-        FROM users u
-        LEFT JOIN referrals r ON r.referrer_id = u.user_id
-        GROUP BY u.user_id
-        ORDER BY referral_count DESC
-        LIMIT 10
-        """
-    )
-    
-    # Create leaderboard message
-    leaderboard_text = "🏆 Leaderboard\n\n"
-    
-    # Balance rankings
-    leaderboard_text += "💰 Top Players by Balance:\n"
-    for i, player in enumerate(top_balance, 1):
-        name = player['username'] or player['first_name']
-        leaderboard_text += f"{i}. {name}: {player['balance']:.2f} AUG\n"
-    
-    leaderboard_text += "\n👥 Top Players by Referrals:\n"
-    for i, player in enumerate(top_referrals, 1):
-        name = player['username'] or player['first_name']
-        leaderboard_text += f"{i}. {name}: {player['referral_count']} referrals\n"
-    
-    # Create keyboard
+WINDOW_TITLES = {
+    'daily': "📅 Today's Top Tappers",
+    'weekly': "📆 This Week's Top Tappers",
+    'season': "🏁 This Season's Top Tappers"
+}
+
+def _leaderboard_keyboard() -> InlineKeyboardMarkup:
     keyboard = [
+        [
+            InlineKeyboardButton("🏆 All Time", callback_data="lb_all"),
+            InlineKeyboardButton("📅 Today", callback_data="lb_daily")
+        ],
+        [
+            InlineKeyboardButton("📆 Week", callback_data="lb_weekly"),
+            InlineKeyboardButton("🏁 Season", callback_data="lb_season")
+        ],
         [
             InlineKeyboardButton("🎯 Tap", callback_data="tap"),
             InlineKeyboardButton("👤 Profile", callback_data="profile")
@@ -53,15 +28,58 @@ async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             InlineKeyboardButton("👥 Invite Friends", callback_data="invite")
         ]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return InlineKeyboardMarkup(keyboard)
+
+async def _all_time_text(user_id: int) -> str:
+    # Serve the pre-rendered snapshot plus the caller's own rank
+    leaderboard_text, (balance_rank, referral_rank) = await asyncio.gather(
+        LeaderboardService.get_snapshot(),
+        LeaderboardService.get_user_ranks(user_id)
+    )
+    
+    if balance_rank:
+        leaderboard_text += f"\n📍 Your Rank: #{balance_rank} by balance"
+        if referral_rank:
+            leaderboard_text += f", #{referral_rank} by referrals"
+        leaderboard_text += "\n"
+    
+    return leaderboard_text
+
+async def _window_text(window: str, user_id: int) -> str:
+    top_players, rank = await asyncio.gather(
+        LeaderboardService.get_window_top(window, 10),
+        LeaderboardService.get_window_rank(window, user_id)
+    )
+    
+    leaderboard_text = f"{WINDOW_TITLES[window]}:\n"
+    if not top_players:
+        leaderboard_text += "No taps yet. Be the first!\n"
+    for i, player in enumerate(top_players, 1):
+        name = player['username'] or player['first_name']
+        leaderboard_text += f"{i}. {name}: {player['earned']:.2f} AUG\n"
+    
+    if rank:
+        leaderboard_text += f"\n📍 Your Rank: #{rank}\n"
+    
+    return leaderboard_text
+
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
     
-    await update.message.reply_text(leaderboard_text, reply_markup=reply_markup)
+    leaderboard_text = await _all_time_text(user.id)
+    await update.message.reply_text(leaderboard_text, reply_markup=_leaderboard_keyboard())
 
 async def leaderboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle leaderboard button callback"""
+    """Handle leaderboard window callbacks"""
     query = update.callback_query
     await query.answer()
     
-    # Reuse leaderboard logic
-    update.effective_message = query.message
-    await leaderboard_command(update, context) 
\ No newline at end of file
+    user = query.from_user
+    window = query.data[3:]
+    
+    if window in LeaderboardService.WINDOWS:
+        leaderboard_text = await _window_text(window, user.id)
+    else:
+        leaderboard_text = await _all_time_text(user.id)
+    
+    await query.edit_message_text(leaderboard_text, reply_markup=_leaderboard_keyboard())
@@ -1,52 +1,51 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from bot.db.connection import Database
+from bot.db.write_buffer import TapWriteBuffer
+from bot.services.upgrade_service import UpgradeService
+from bot.utils.rate_limiter import RateLimiter
 from bot.config import config
 
-async def shop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
+USER_BALANCE = Database.register(
+    "user_balance",
+    "SELECT balance FROM users WHERE user_id = $1"
+)
+
+async def _shop_view(user_id: int, readonly: bool = True):
+    """Render the shop for a user; returns (text, markup) or None if unregistered.
+
+    Browsing reads from the replica; pass readonly=False right after a
+    purchase so the new level and balance are visible.
+    """
+    route = Database.read() if readonly else Database.write()
     
     # Get user's balance
-    user_data = await Database.fetchrow(
-        "SELECT balance FROM users WHERE user_id = $1",
-        user.id
-    )
+    user_data = await route.fetchrow(USER_BALANCE, user_id)
     
     if not user_data:
-        await update.message.reply_text(
-            "⚠️ You haven't started playing yet! Use /start to begin."
-        )
-        return
+        return None
     
-    # Get available upgrades
-    upgrades = await Database.fetch(
-        """
-        SELECT u.*, COALESCE(uu.level, 0) as current_level
-        FROM upgrades u
-        LEFT JOIN user_upgrades uu ON uu.upgrade_id = u.id AND uu.user_id = $1
-        ORDER BY u.id
-        """,
-        user.id
-    )
+    # Get upgrades with the user's levels and precomputed prices
+    upgrades = await UpgradeService.get_upgrade_info(user_id, readonly)
+    
+    # Include taps that are still waiting to be flushed
+    balance = user_data['balance'] + TapWriteBuffer.pending_balance(user_id)
     
     # Create shop message
     shop_text = (
         f"🏪 Shop\n\n"
-        f"💰 Your Balance: {user_data['balance']:.2f} AUG\n\n"
+        f"💰 Your Balance: {balance:.2f} AUG\n\n"
         "Available Upgrades:\n"
     )
     
     keyboard = []
     for upgrade in upgrades:
-        # Calculate cost for next level
+        # Cost for next level
         current_level = upgrade['current_level']
-        if current_level >= upgrade['max_level']:
+        if not upgrade['can_upgrade']:
             cost_text = "MAX LEVEL"
-            callback_data = "max_level"
         else:
-            cost = upgrade['base_cost'] * (upgrade['cost_multiplier'] ** current_level)
-            cost_text = f"{cost:.2f} AUG"
-            callback_data = f"buy_{upgrade['id']}"
+            cost_text = f"{upgrade['next_cost']:.2f} AUG"
         
         # Format effect text
         effect = f"+{upgrade['effect_value']:.1f}"
@@ -60,11 +59,11 @@ async def shop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"  Cost: {cost_text}\n\n"
         )
         
-        if current_level < upgrade['max_level']:
+        if upgrade['can_upgrade']:
             keyboard.append([
                 InlineKeyboardButton(
                     f"Buy {upgrade['name']} - {cost_text}",
-                    callback_data=callback_data
+                    callback_data=f"buy_{upgrade['id']}"
                 )
             ])
     
@@ -74,92 +73,78 @@ async def shop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         InlineKeyboardButton("👤 Profile", callback_data="profile")
     ])
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return shop_text, InlineKeyboardMarkup(keyboard)
+
+async def shop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    
+    decision = await RateLimiter.hit("shop", user.id)
+    if not decision.allowed:
+        await update.message.reply_text(
+            f"⏳ Too many requests. Try again in {decision.retry_after:.0f} seconds."
+        )
+        return
+    
+    view = await _shop_view(user.id)
+    if not view:
+        await update.message.reply_text(
+            "⚠️ You haven't started playing yet! Use /start to begin."
+        )
+        return
+    
+    shop_text, reply_markup = view
     await update.message.reply_text(shop_text, reply_markup=reply_markup)
 
 async def shop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle shop purchase callbacks"""
     query = update.callback_query
-    await query.answer()
     
     if not query.data.startswith("buy_"):
+        await query.answer()
         return
     
     user = query.from_user
+    decision = await RateLimiter.hit("shop", user.id)
+    if not decision.allowed:
+        await query.answer(f"⏳ Too many requests. Try again in {decision.retry_after:.0f} seconds.")
+        return
+    await query.answer()
+    
     upgrade_id = int(query.data[4:])
     
-    # Get upgrade info
-    upgrade = await Database.fetchrow(
-        """
-        SELECT u.*, COALESCE(uu.level, 0) as current_level
-        FROM upgrades u
-        LEFT JOIN user_upgrades uu ON uu.upgrade_id = u.id AND uu.user_id = $1
-        WHERE u.id = $2
-        """,
-        user.id, upgrade_id
-    )
+    # Check, debit and level up in a single round trip
+    result = await UpgradeService.purchase_upgrade(user.id, upgrade_id)
     
-    if not upgrade:
+    if result.status in ("not_found", "no_user"):
         await query.edit_message_text(
             "⚠️ This upgrade is no longer available.",
             reply_markup=query.message.reply_markup
         )
         return
     
-    # Check if max level
-    if upgrade['current_level'] >= upgrade['max_level']:
+    if result.status == "max_level":
         await query.edit_message_text(
             "⚠️ You've reached the maximum level for this upgrade!",
             reply_markup=query.message.reply_markup
         )
         return
     
-    # Calculate cost
-    cost = upgrade['base_cost'] * (upgrade['cost_multiplier'] ** upgrade['current_level'])
-    
-    # Check if user can afford it
-    user_data = await Database.fetchrow(
-        "SELECT balance FROM users WHERE user_id = $1",
-        user.id
-    )
-    
-    if user_data['balance'] < cost:
+    if result.status == "insufficient_funds":
         await query.edit_message_text(
             "⚠️ You don't have enough AUG to buy this upgrade!",
             reply_markup=query.message.reply_markup
         )
         return
     
-    # Process purchase
-    async with Database.get_pool().acquire() as conn:
-        async with conn.transaction():
-            # Deduct cost
-            await conn.execute(
-                """
-                UPDATE users 
-                SET balance = balance - $1
-                WHERE user_id = $2
-                """,
-                cost, user.id
-            )
-            
-            # Add or update upgrade
-            await conn.execute(
-                """
-                INSERT INTO user_upgrades (user_id, upgrade_id, level)
-                VALUES ($1, $2, 1)
-                ON CONFLICT (user_id, upgrade_id) 
-                DO UPDATE SET level = user_upgrades.level + 1
-                """,
-                user.id, upgrade_id
-            )
-    
     # Show success message
     await query.edit_message_text(
-        f"✅ Successfully purchased {upgrade['name']} (Level {upgrade['current_level'] + 1})!\n"
-        f"💰 Spent: {cost:.2f} AUG",
+        f"✅ Successfully purchased {result.name} (Level {result.level})!\n"
+        f"💰 Spent: {result.cost:.2f} AUG",
         reply_markup=query.message.reply_markup
     )
     
-    # Refresh shop
-    await shop_command(update, context) 
\ No newline at end of file
+    # Refresh shop from the primary so the purchase shows up
+    view = await _shop_view(user.id, readonly=False)
+    if view:
+        shop_text, reply_markup = view
+        await query.message.reply_text(shop_text, reply_markup=reply_markup) 
\ No newline at end of file
@@ -1,13 +1,24 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from bot.db.connection import Database
+from bot.utils.rate_limiter import RateLimiter
 from bot.utils.redis_manager import RedisManager
+from bot.utils.energy import EnergyState
+from bot.services.user_service import UserService
 from bot.config import config
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     args = context.args
     
+    # /start hits Postgres, so throttle it before anything else
+    decision = await RateLimiter.hit("start", user.id)
+    if not decision.allowed:
+        await update.message.reply_text(
+            f"⏳ Too many requests. Try again in {decision.retry_after:.0f} seconds."
+        )
+        return
+    
     # Check if user exists
     user_data = await Database.fetchrow(
         "SELECT * FROM users WHERE user_id = $1",
@@ -25,28 +36,19 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         # Set initial energy in Redis
-        await RedisManager.set_user_energy(user.id, config.max_energy)
+        await RedisManager.set_energy_state(
+            user.id,
+            EnergyState.full(config.max_energy, config.energy_regen_rate)
+        )
         
         # Handle referral if present
         if args and args[0].startswith('ref_'):
             try:
                 referrer_id = int(args[0][4:])
                 if referrer_id != user.id:  # Prevent self-referral
-                    await Database.execute(
-                        """
-                        INSERT INTO referrals (referrer_id, referred_id)
-                        VALUES ($1, $2)
-                        """,
-                        referrer_id, user.id
-                    )
-                    # Add referral bonus to referrer
-                    await Database.execute(
-                        """
-                        UPDATE users 
-                        SET balance = balance + $1
-                        WHERE user_id = $2
-                        """,
-                        config.referral_bonus, referrer_id
+                    # Record referral, update counters and pay the bonus in one statement
+                    await UserService.process_referral(
+                        referrer_id, user.id, config.referral_bonus
                     )
             except (ValueError, IndexError):
                 pass  # Invalid referral code, ignore
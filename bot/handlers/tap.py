@@ -1,85 +1,69 @@
 import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from bot.db.connection import Database
+from bot.db.write_buffer import TapWriteBuffer
+from bot.utils.rate_limit import RateDecision
+from bot.utils.rate_limiter import RateLimiter
 from bot.utils.redis_manager import RedisManager
+from bot.services.upgrade_service import UpgradeService
+from bot.services.user_service import UserService
+from bot.services.leaderboard_service import LeaderboardService
 from bot.config import config
 
 async def tap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
-    # Get user's current energy
-    energy = await RedisManager.get_user_energy(user.id)
-    if energy is None:
-        energy = config.max_energy
-        await RedisManager.set_user_energy(user.id, energy)
+    # Already told to slow down; drop repeats without touching Redis
+    if RateLimiter.blocked_for("tap", user.id):
+        return
     
-    # Check if user has energy
-    if energy <= 0:
-        await update.message.reply_text(
-            "⚠️ You're out of energy! Wait for it to regenerate or buy upgrades in the shop."
+    # Postgres is behind; refuse before spending energy rather than lose the tap
+    if TapWriteBuffer.full():
+        await update.effective_message.reply_text("⏳ Taps are paused for a moment. Try again shortly.")
+        return
+    
+    # Buffered taps reference users, and /start is where the row (and any
+    # referral) gets created
+    if not await UserService.is_registered(user.id):
+        await update.effective_message.reply_text(
+            "⚠️ You haven't started playing yet! Use /start to begin."
         )
         return
     
-    # Check rate limiting
-    last_tap = await RedisManager.get_last_tap_time(user.id)
+    # Get user's cached upgrade effects
+    effects = await UpgradeService.get_effects(user.id)
+    
+    # Check energy and the tap rate limit, and spend the tap atomically
     current_time = time.time()
-    if last_tap and current_time - last_tap < config.tap_cooldown:
-        await update.message.reply_text(
-            f"⏳ Please wait {config.tap_cooldown} seconds between taps."
+    verdict = await RedisManager.admit_tap(
+        user.id,
+        effects.max_energy,
+        effects.energy_regen,
+        RateLimiter.limit_for("tap"),
+        current_time
+    )
+    
+    if verdict.status == "no_energy":
+        await update.effective_message.reply_text(
+            "⚠️ You're out of energy! Wait for it to regenerate or buy upgrades in the shop."
         )
         return
     
-    # Check taps per minute limit
-    taps_this_minute = await RedisManager.increment_tap_count(user.id)
-    if taps_this_minute > config.max_taps_per_minute:
-        await update.message.reply_text(
-            "⚠️ You're tapping too fast! Please slow down."
+    if verdict.status == "rate_limited":
+        RateLimiter.remember("tap", user.id, RateDecision(False, verdict.retry_after))
+        await update.effective_message.reply_text(
+            f"⚠️ You're tapping too fast! Try again in {verdict.retry_after:.1f} seconds."
         )
         return
     
-    # Get user's tap multiplier from upgrades
-    tap_multiplier = await Database.fetchval(
-        """
-        SELECT COALESCE(SUM(effect_value), 1.0)
-        FROM user_upgrades uu
-        JOIN upgrades u ON u.id = uu.upgrade_id
-        WHERE uu.user_id = $1 AND u.effect_type = 'tap_multiplier'
-        """,
-        user.id
-    )
-    
     # Calculate reward
-    reward = config.base_tap_reward * tap_multiplier
-    
-    # Update user's balance and energy
-    await Database.execute(
-        """
-        UPDATE users 
-        SET balance = balance + $1
-        WHERE user_id = $2
-        """,
-        reward, user.id
-    )
+    reward = config.base_tap_reward * effects.tap_multiplier
     
-    # Decrease energy
-    new_energy = energy - 1
-    await RedisManager.set_user_energy(user.id, new_energy)
-    
-    # Update last tap time
-    await RedisManager.set_last_tap_time(user.id, current_time)
-    
-    # Log tap for analytics
-    await Database.execute(
-        """
-        INSERT INTO taps (user_id, amount)
-        VALUES ($1, $2)
-        """,
-        user.id, reward
-    )
+    # Queue balance update and tap log for the next batched flush
+    TapWriteBuffer.add_tap(user.id, reward)
     
     # Update leaderboard
-    await RedisManager.update_leaderboard(user.id, reward)
+    await LeaderboardService.record_tap(user.id, reward)
     
     # Create response message
     keyboard = [
@@ -92,17 +76,16 @@ async def tap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     message = (
         f"💰 +{reward:.2f} AUG\n"
-        f"⚡ Energy: {new_energy}/{config.max_energy}\n\n"
+        f"⚡ Energy: {verdict.energy}/{effects.max_energy}\n\n"
         "Keep tapping to earn more!"
     )
     
-    await update.message.reply_text(message, reply_markup=reply_markup)
+    await update.effective_message.reply_text(message, reply_markup=reply_markup)
 
 async def tap_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle tap button callback"""
     query = update.callback_query
     await query.answer()
     
-    # Reuse tap logic
-    update.effective_message = query.message
+    # Reuse tap logic; it replies through effective_message, the button's message here
     await tap_command(update, context) 
\ No newline at end of file
@@ -1,13 +1,26 @@
 import asyncio
+import hmac
+import json
 import logging
+import signal
+from telegram import Update
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler
 )
 from bot.config import config
 from bot.db.connection import Database
+from bot.db.partitions import TapPartitions
+from bot.db.write_buffer import TapWriteBuffer
 from bot.utils.redis_manager import RedisManager
+from bot.services.leaderboard_service import LeaderboardService
+from bot.services.upgrade_catalog import UpgradeCatalog
+from bot.utils.http_server import HttpServer, json_response
+from bot.utils.periodic import PeriodicTask
+from bot.utils.two_tier_cache import TwoTierCache
+from bot.utils.user_lanes import UserLaneProcessor
 
 # Import handlers
 from bot.handlers.start import start_command
@@ -15,7 +28,7 @@ from bot.handlers.tap import tap_command, tap_callback
 from bot.handlers.profile import profile_command
 from bot.handlers.shop import shop_command, shop_callback
 from bot.handlers.leaderboard import leaderboard_command, leaderboard_callback
-from bot.handlers.invite import invite_command, invite_callback, back_to_invite_callback
+from bot.handlers.invite import invite_command, invite_callback, back_to_invite_callback, view_referrals_callback
 from bot.handlers.daily import daily_command
 
 # Configure logging
@@ -25,15 +38,72 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# The loop only keeps weak references to tasks, so fire-and-forget ones live here
+_background_tasks = set()
+
+def run_in_background(func):
+    task = asyncio.create_task(func())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
 async def main():
+    if config.bot_mode not in ("polling", "webhook"):
+        raise ValueError(f"Unknown BOT_MODE: {config.bot_mode}")
+    if config.bot_mode == "webhook" and not config.webhook_url:
+        raise ValueError("BOT_MODE=webhook needs WEBHOOK_URL")
+    if config.bot_mode == "webhook" and not config.webhook_secret:
+        # Without it anyone who finds the endpoint can post updates as any user
+        raise ValueError("BOT_MODE=webhook needs WEBHOOK_SECRET")
+    
     # Initialize database
     await Database.get_pool()
     
+    # Load the static upgrade catalog; `kill -HUP` reloads it
+    await UpgradeCatalog.load()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGHUP, run_in_background, UpgradeCatalog.reload_everywhere)
+    
     # Initialize Redis
     await RedisManager.get_redis()
     
+    # Grow or shrink the pool's checkout limit with load
+    Database.start_pool_tuner()
+    
+    # Drop local cache entries and reload the catalog when another process says so
+    TwoTierCache.start_listener()
+    UpgradeCatalog.start_listener()
+    
+    # Updates run concurrently across users and in order for each user
+    lanes = UserLaneProcessor(
+        config.update_concurrency, config.user_lane_max_depth, config.user_lane_tap_depth
+    )
+    
+    # Periodically log which queries dominate database time, cache hit rates and user lanes
+    async def log_stats():
+        await Database.log_stats()
+        await TwoTierCache.log_stats()
+        logger.info(f"user lanes: {lanes.stats()}")
+    
+    db_stats = PeriodicTask("db-stats", config.db_stats_log_interval, log_stats)
+    if config.db_stats_log_interval:
+        db_stats.start()
+    
+    # Make sure upcoming months have taps partitions
+    TapPartitions.start()
+    
+    # Start batched tap writes
+    TapWriteBuffer.start()
+    
+    # Keep the Redis leaderboards in sync with Postgres
+    LeaderboardService.start_reconciler()
+    LeaderboardService.start_snapshotter()
+    
     # Create bot application
-    application = ApplicationBuilder().token(config.bot_token).build()
+    builder = ApplicationBuilder().token(config.bot_token).concurrent_updates(lanes)
+    if config.bot_mode == "webhook":
+        # Updates arrive through our HTTP server, so there is nothing to poll
+        builder = builder.updater(None)
+    application = builder.build()
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -48,22 +118,97 @@ async def main():
     application.add_handler(CallbackQueryHandler(tap_callback, pattern="^tap$"))
     application.add_handler(CallbackQueryHandler(shop_callback, pattern="^buy_"))
     application.add_handler(CallbackQueryHandler(leaderboard_callback, pattern="^lb_"))
-    application.add_handler(CallbackQueryHandler(invite_callback, pattern="^view_referrals$"))
+    application.add_handler(CallbackQueryHandler(invite_callback, pattern="^invite$"))
+    application.add_handler(CallbackQueryHandler(view_referrals_callback, pattern="^(view_referrals$|refs_)"))
     application.add_handler(CallbackQueryHandler(back_to_invite_callback, pattern="^back_to_invite$"))
     
-    # Start the bot
-    await application.initialize()
-    await application.start()
-    await application.run_polling()
+    # Health checks are served in both modes; the webhook route only in webhook mode
+    server = HttpServer(config.http_host, config.http_port)
+    server.route("/healthz", health_route(application))
+    if config.bot_mode == "webhook":
+        server.route(config.webhook_path, webhook_route(application))
+    
+    # SIGINT/SIGTERM end the run; shutdown happens below, inside this loop
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    try:
+        async with application:
+            await application.start()
+            try:
+                await server.start()
+                if config.bot_mode == "webhook":
+                    await application.bot.set_webhook(
+                        config.webhook_url.rstrip("/") + config.webhook_path,
+                        secret_token=config.webhook_secret,
+                        max_connections=config.webhook_max_connections,
+                        allowed_updates=Update.ALL_TYPES
+                    )
+                    logger.info(f"Receiving updates by webhook on {config.webhook_path}")
+                else:
+                    await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                    logger.info("Receiving updates by polling")
+                
+                await stop_event.wait()
+                logger.info("Shutting down")
+            finally:
+                # Stop taking new updates, then let the ones in flight finish
+                await server.stop()
+                if application.updater and application.updater.running:
+                    await application.updater.stop()
+                await application.stop()
+    finally:
+        await server.stop()
+        await db_stats.stop()
+        await TwoTierCache.stop_listener()
+        await UpgradeCatalog.stop_listener()
+        await Database.stop_pool_tuner()
+        await LeaderboardService.stop_snapshotter()
+        await LeaderboardService.stop_reconciler()
+        # Write out any buffered taps before the pool goes away
+        await TapWriteBuffer.stop()
+        await TapPartitions.stop()
+        await Database.close()
+        await RedisManager.close()
+
+def webhook_route(application: Application):
+    """Hands Telegram's webhook POSTs to the application's update queue"""
+    async def handle(method, headers, body):
+        if method != "POST":
+            return 405, b"", "text/plain"
+        if not config.webhook_secret or not hmac.compare_digest(
+            headers.get("x-telegram-bot-api-secret-token", "").encode(), config.webhook_secret.encode()
+        ):
+            return 401, b"", "text/plain"
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                return 400, b"", "text/plain"
+            update = Update.de_json(data, application.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400, b"", "text/plain"
+        # Acknowledge right away; handlers run on the application's own tasks
+        await application.update_queue.put(update)
+        return 200, b"", "text/plain"
+    return handle
+
+def health_route(application: Application):
+    """Liveness plus the numbers worth alerting on"""
+    async def handle(method, headers, body):
+        status = 200 if application.running else 503
+        return json_response(status, {
+            'status': "ok" if status == 200 else "stopped",
+            'mode': config.bot_mode,
+            'update_queue': application.update_queue.qsize(),
+            'user_lanes': application.update_processor.stats(),
+            'db_pool': Database.pool_gauges()
+        })
+    return handle
 
 if __name__ == '__main__':
     try:
         asyncio.run(main())
-    except KeyboardInterrupt:
-        logger.info("Bot stopped by user")
     except Exception as e:
         logger.error(f"Bot stopped due to error: {e}")
-    finally:
-        # Cleanup
-        asyncio.run(Database.close())
-        asyncio.run(RedisManager.close()) 
\ No newline at end of file
+        raise
@@ -1,109 +1,135 @@
-from datetime import datetime, timedelta
-from typing import Optional, Tuple
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from typing import Optional
+import asyncpg
 from ..db.connection import Database
 from ..utils.redis_manager import RedisManager
+from .leaderboard_service import LeaderboardService
+from ..config import config
+
+# Decides eligibility, advances or resets the streak, credits the streak
+# bonus and logs the claim in one statement. The WHERE clause is re-checked
+# under the row lock, so concurrent claims for the same day pay once, and the
+# unique (user_id, claim_day) index rolls the whole statement back should
+# last_claim_day ever disagree with the log. The outer SELECT reads users as
+# of before the update, which tells an unknown user (no row) apart from one
+# who already claimed today (no claim).
+#
+# $1 user_id, $2 today (UTC), $3 base reward, $4 max streak bonus days, $5 bonus per day
+CLAIM_DAILY = Database.register(
+    "claim_daily",
+    """
+    WITH claim AS (
+        UPDATE users
+        SET daily_streak = CASE WHEN last_claim_day = $2::date - 1 THEN daily_streak + 1 ELSE 1 END,
+            balance = balance + $3::numeric * (
+                1 + LEAST(CASE WHEN last_claim_day = $2::date - 1 THEN daily_streak ELSE 0 END, $4) * $5::numeric
+            ),
+            last_claim_day = $2
+        WHERE user_id = $1
+          AND (last_claim_day IS NULL OR last_claim_day < $2)
+        RETURNING daily_streak,
+                  balance,
+                  $3::numeric * (1 + LEAST(daily_streak - 1, $4) * $5::numeric) AS amount
+    ), logged AS (
+        INSERT INTO daily_claims (user_id, claim_day, amount)
+        SELECT $1, $2, amount FROM claim
+    )
+    SELECT c.daily_streak, c.amount, c.balance, u.daily_streak AS current_streak
+    FROM users u
+    LEFT JOIN claim c ON true
+    WHERE u.user_id = $1
+    """
+)
+
+# Current streak, reported when the claim log already has today's claim
+DAILY_STREAK = Database.register(
+    "daily_streak",
+    "SELECT daily_streak FROM users WHERE user_id = $1"
+)
+
+@dataclass(frozen=True)
+class DailyClaim:
+    """Outcome of a claim: ok, already_claimed, in_progress or no_user"""
+    status: str
+    amount: Decimal = Decimal(0)
+    streak: int = 0
+    balance: Optional[Decimal] = None
+
+    @property
+    def success(self) -> bool:
+        return self.status == 'ok'
 
 class DailyService:
-    BONUS_AMOUNT = 50  # Base daily bonus amount
-    STREAK_MULTIPLIER = 0.1  # 10% increase per day in streak
-    MAX_STREAK = 7  # Maximum streak days
+    STREAK_MULTIPLIER = Decimal("0.1")  # 10% increase per day in streak
+    MAX_STREAK = 7  # Days of streak that still add to the bonus
+    PENDING_MARKER_TTL = 30  # seconds a crashed claim can block retries
 
     @staticmethod
-    async def can_claim_daily(user_id: int) -> Tuple[bool, Optional[datetime]]:
-        """Check if user can claim daily bonus and return last claim time if exists"""
-        last_claim = await Database.fetchval(
-            """
-            SELECT claimed_at 
-            FROM daily_claims 
-            WHERE user_id = $1 
-            ORDER BY claimed_at DESC 
-            LIMIT 1
-            """,
-            user_id
-        )
-
-        if not last_claim:
-            return True, None
-
-        # Check if 24 hours have passed
-        next_claim = last_claim + timedelta(days=1)
-        can_claim = datetime.now() >= next_claim
-
-        return can_claim, last_claim
+    def today() -> date:
+        return datetime.now(timezone.utc).date()
 
     @staticmethod
-    async def get_streak(user_id: int) -> int:
-        """Get user's current streak"""
-        claims = await Database.fetch(
-            """
-            SELECT claimed_at 
-            FROM daily_claims 
-            WHERE user_id = $1 
-            ORDER BY claimed_at DESC 
-            LIMIT $2
-            """,
-            user_id, DailyService.MAX_STREAK
-        )
-
-        if not claims:
-            return 0
-
-        streak = 1
-        for i in range(len(claims) - 1):
-            current = claims[i]['claimed_at']
-            previous = claims[i + 1]['claimed_at']
-            
-            # Check if claims are on consecutive days
-            if (current - previous).days == 1:
-                streak += 1
-            else:
-                break
-
-        return streak
+    def next_claim_time() -> datetime:
+        """Claims reset at midnight UTC"""
+        return datetime.combine(DailyService.today() + timedelta(days=1), time(), tzinfo=timezone.utc)
 
     @staticmethod
-    async def claim_daily(user_id: int) -> Tuple[bool, int]:
-        """Claim daily bonus and return (success, amount)"""
-        can_claim, _ = await DailyService.can_claim_daily(user_id)
-        if not can_claim:
-            return False, 0
-
-        # Get current streak
-        streak = await DailyService.get_streak(user_id)
-        
-        # Calculate bonus amount
-        multiplier = 1 + (streak * DailyService.STREAK_MULTIPLIER)
-        amount = int(DailyService.BONUS_AMOUNT * multiplier)
-
-        # Start transaction
-        async with Database.get_pool().acquire() as conn:
-            async with conn.transaction():
-                # Record claim
-                await conn.execute(
-                    """
-                    INSERT INTO daily_claims (user_id)
-                    VALUES ($1)
-                    """,
-                    user_id
-                )
-
-                # Update user balance
-                await conn.execute(
-                    """
-                    UPDATE users 
-                    SET balance = balance + $1
-                    WHERE user_id = $2
-                    """,
-                    amount, user_id
+    async def claim_daily(user_id: int) -> DailyClaim:
+        """Claim today's bonus; the streak continues if yesterday was claimed.
+
+        A per-day Redis marker turns repeat attempts away before Postgres.
+        Postgres stays the authority: when the marker is missing, e.g. after
+        a Redis flush, the claim statement decides and the marker is rebuilt
+        from its answer.
+        """
+        today = DailyService.today()
+        marker = await RedisManager.begin_daily_claim(user_id, today, DailyService.PENDING_MARKER_TTL)
+        if marker == "pending":
+            # Another claim for today is in flight and may still fail
+            return DailyClaim(status='in_progress')
+        if marker is not None:
+            return DailyClaim(status='already_claimed', streak=int(marker.split(":")[1]))
+
+        try:
+            row = await Database.fetchrow(
+                CLAIM_DAILY,
+                user_id,
+                today,
+                Decimal(str(config.daily_reward)),
+                DailyService.MAX_STREAK,
+                DailyService.STREAK_MULTIPLIER
+            )
+        except asyncpg.UniqueViolationError:
+            # The claim log already has today even though last_claim_day lagged
+            streak = await Database.fetchval(DAILY_STREAK, user_id)
+            claim = DailyClaim(status='already_claimed', streak=streak or 0)
+        except Exception:
+            # Let the user retry instead of waiting out the pending marker
+            await RedisManager.abort_daily_claim(user_id, today)
+            raise
+        else:
+            if row is None:
+                await RedisManager.abort_daily_claim(user_id, today)
+                return DailyClaim(status='no_user')
+            if row['amount'] is None:
+                claim = DailyClaim(status='already_claimed', streak=row['current_streak'])
+            else:
+                claim = DailyClaim(
+                    status='ok',
+                    amount=row['amount'],
+                    streak=row['daily_streak'],
+                    balance=row['balance']
                 )
 
-        return True, amount
+        # Reject further attempts in Redis until the day rolls over
+        ttl = int((DailyService.next_claim_time() - datetime.now(timezone.utc)).total_seconds()) + 1
+        await RedisManager.finish_daily_claim(user_id, today, claim.streak, ttl)
 
-    @staticmethod
-    async def get_next_claim_time(user_id: int) -> Optional[datetime]:
-        """Get time until next daily claim is available"""
-        can_claim, last_claim = await DailyService.can_claim_daily(user_id)
-        if can_claim:
-            return None
+        if not claim.success:
+            return claim
 
-        return last_claim + timedelta(days=1) 
\ No newline at end of file
+        await RedisManager.invalidate_profile(user_id)
+        await LeaderboardService.record_balance_change(user_id, claim.amount)
+        return claim
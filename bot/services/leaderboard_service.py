@@ -1,98 +1,424 @@
-from typing import List, Dict
+import asyncio
+import logging
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Dict, Optional, Tuple
+from aioredis.exceptions import LockError
 from ..db.connection import Database
-from ..utils.redis_manager import RedisManager
+from ..db.write_buffer import TapWriteBuffer
+from ..utils.cache_namespace import CacheNamespace
+from ..utils.periodic import PeriodicTask
+from ..utils.redis_manager import RedisManager, BALANCE_LEADERBOARD, REFERRAL_LEADERBOARD
+from ..utils.two_tier_cache import TwoTierCache
+from ..config import config
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_NAMES = Database.register(
+    "leaderboard_names",
+    """
+    SELECT user_id, username, first_name
+    FROM users
+    WHERE user_id = ANY($1::bigint[])
+    """
+)
 
 class LeaderboardService:
-    CACHE_TTL = 300  # 5 minutes
+    """Rankings served from Redis sorted sets.
+
+    The sorted sets are updated incrementally on every balance or referral
+    change and periodically reconciled against Postgres, which stays the
+    source of truth.
+    """
+    RECONCILE_BATCH_SIZE = 5000
+    # Seconds after a tap during which reconcile will not lower that user's score
+    RECENT_TAP_GRACE = max(30, 5 * config.tap_flush_interval)
+    SNAPSHOT_NAME = "leaderboard"
+    SNAPSHOT_LOCK_TIMEOUT = 30  # seconds
+    SNAPSHOT_WAIT = 2.0  # seconds to wait on another process's refresh
+    SNAPSHOT_STALE_TTL = 3600  # seconds a stale snapshot may still be served
+
+    SNAPSHOT_LOCAL_TTL = 5  # seconds each process reuses the snapshot without asking Redis
+
+    # Rendered leaderboard caches; invalidate_cache() drops them all at once
+    cache = CacheNamespace("leaderboard", SNAPSHOT_STALE_TTL)
+    snapshot_l1 = TwoTierCache("leaderboard_snapshot", max_size=1, ttl=SNAPSHOT_LOCAL_TTL)
+
+    # Windowed leaderboards: taps land in daily buckets, weeks are unions of
+    # days and seasons are unions of weeks.
+    WINDOWS = ('daily', 'weekly', 'season')
+    # Day buckets and completed weeks outlive the longest season built from
+    # them, so a week nobody viewed can still be built when the season is
+    DAY_BUCKET_TTL = (config.season_weeks + 2) * 7 * 86400
+    WINDOW_CACHE_TTL = 60  # seconds an in-progress week or season union is reused
+
+    _reconciler: Optional[PeriodicTask] = None
+    _snapshotter: Optional[PeriodicTask] = None
+    _snapshot_refresh: Optional[asyncio.Task] = None
 
     @staticmethod
     async def get_top_users(limit: int = 10) -> List[Dict]:
-        # Try to get from cache first
-        cache_key = f"leaderboard:top_users:{limit}"
-        cached = await RedisManager.get(cache_key)
-        if cached:
-            return eval(cached)  # Safe as we control the data
-
-        # Get from database
-        users = await Database.fetch(
-            """
-            SELECT user_id, username, balance, referrals
-            FROM users
-            ORDER BY balance DESC
-            LIMIT $1
-            """,
-            limit
-        )
+        entries = await RedisManager.get_leaderboard(BALANCE_LEADERBOARD, 0, limit - 1)
+        return await LeaderboardService._with_names(entries, 'balance')
 
-        result = [dict(user) for user in users]
-        
-        # Cache the result
-        await RedisManager.set(cache_key, str(result), LeaderboardService.CACHE_TTL)
-        
+    @staticmethod
+    async def get_top_referrers(limit: int = 10) -> List[Dict]:
+        entries = await RedisManager.get_leaderboard(REFERRAL_LEADERBOARD, 0, limit - 1)
+        result = await LeaderboardService._with_names(entries, 'referrals')
+        for user in result:
+            user['referrals'] = int(user['referrals'])
         return result
 
     @staticmethod
-    async def get_top_referrers(limit: int = 10) -> List[Dict]:
-        # Try to get from cache first
-        cache_key = f"leaderboard:top_referrers:{limit}"
-        cached = await RedisManager.get(cache_key)
-        if cached:
-            return eval(cached)  # Safe as we control the data
-
-        # Get from database
-        users = await Database.fetch(
-            """
-            SELECT user_id, username, referrals
-            FROM users
-            WHERE referrals > 0
-            ORDER BY referrals DESC
-            LIMIT $1
-            """,
-            limit
+    async def get_snapshot() -> str:
+        """Pre-rendered top-10 text, refreshed by at most one caller at a time"""
+        return await LeaderboardService.snapshot_l1.get(
+            LeaderboardService.SNAPSHOT_NAME, LeaderboardService._get_shared_snapshot
         )
 
-        result = [dict(user) for user in users]
-        
-        # Cache the result
-        await RedisManager.set(cache_key, str(result), LeaderboardService.CACHE_TTL)
-        
-        return result
+    @staticmethod
+    async def _get_shared_snapshot() -> str:
+        text, fresh = await LeaderboardService._read_snapshot()
+        if fresh:
+            return text
+
+        refresh = LeaderboardService._refresh_in_flight()
+        if text is not None:
+            # Serve the stale copy while the refresh runs in the background
+            return text
+        return await asyncio.shield(refresh)
 
     @staticmethod
-    async def get_user_rank(user_id: int) -> int:
-        rank = await Database.fetchval(
-            """
-            SELECT COUNT(*) + 1
-            FROM users
-            WHERE balance > (
-                SELECT balance
-                FROM users
-                WHERE user_id = $1
+    async def refresh_snapshot() -> Optional[str]:
+        """Re-render the snapshot unless another process is already doing it"""
+        lock = await RedisManager.lock(
+            f"{LeaderboardService.SNAPSHOT_NAME}-snapshot",
+            LeaderboardService.SNAPSHOT_LOCK_TIMEOUT
+        )
+        if not await lock.acquire(blocking=False):
+            return None
+
+        try:
+            text = LeaderboardService._render_snapshot(
+                await LeaderboardService.get_top_users(10),
+                await LeaderboardService.get_top_referrers(10)
             )
-            """,
-            user_id
+            # The copy is served as fresh for the snapshot TTL and as stale afterwards
+            name = LeaderboardService.SNAPSHOT_NAME
+            await LeaderboardService.cache.set_many([
+                (name, text, None),
+                (f"{name}:fresh", "1", config.leaderboard_snapshot_ttl)
+            ])
+            return text
+        finally:
+            try:
+                await lock.release()
+            except LockError:
+                pass  # Lock expired while rendering
+
+    @staticmethod
+    def start_snapshotter():
+        # Refresh ahead of expiry so readers almost always find a fresh copy
+        LeaderboardService._snapshotter = PeriodicTask(
+            "leaderboard-snapshot",
+            max(1, config.leaderboard_snapshot_ttl // 2),
+            LeaderboardService.refresh_snapshot
+        )
+        LeaderboardService._snapshotter.start(run_now=True)
+
+    @staticmethod
+    async def stop_snapshotter():
+        if LeaderboardService._snapshotter:
+            await LeaderboardService._snapshotter.stop()
+            LeaderboardService._snapshotter = None
+
+    @staticmethod
+    async def get_user_ranks(user_id: int) -> Tuple[int, int]:
+        """Return (balance rank, referral rank), 0 when unranked"""
+        ranks = await RedisManager.get_leaderboard_ranks(
+            user_id, [BALANCE_LEADERBOARD, REFERRAL_LEADERBOARD]
         )
-        return rank or 0
+        return tuple(rank + 1 if rank is not None else 0 for rank in ranks)
+
+    @staticmethod
+    async def get_user_rank(user_id: int) -> int:
+        rank = await RedisManager.get_leaderboard_rank(user_id, BALANCE_LEADERBOARD)
+        return rank + 1 if rank is not None else 0
 
     @staticmethod
     async def get_user_referral_rank(user_id: int) -> int:
-        rank = await Database.fetchval(
-            """
-            SELECT COUNT(*) + 1
-            FROM users
-            WHERE referrals > (
-                SELECT referrals
-                FROM users
-                WHERE user_id = $1
-            )
-            """,
-            user_id
+        rank = await RedisManager.get_leaderboard_rank(user_id, REFERRAL_LEADERBOARD)
+        return rank + 1 if rank is not None else 0
+
+    @staticmethod
+    async def record_balance_change(user_id: int, amount: float):
+        """Apply a balance change to the ranking index"""
+        await RedisManager.incr_leaderboard(user_id, amount, BALANCE_LEADERBOARD)
+
+    @staticmethod
+    async def record_tap(user_id: int, amount: float):
+        """Apply a tap reward to the all-time index and today's bucket"""
+        await RedisManager.record_tap_score(
+            user_id,
+            amount,
+            LeaderboardService._day_key(LeaderboardService._today()),
+            LeaderboardService.DAY_BUCKET_TTL
         )
-        return rank or 0
+
+    @staticmethod
+    async def get_window_top(window: str, limit: int = 10) -> List[Dict]:
+        """Top earners from taps in the current day, week or season"""
+        key = await LeaderboardService._window_key(window)
+        entries = await RedisManager.get_leaderboard(key, 0, limit - 1)
+        return await LeaderboardService._with_names(entries, 'earned')
+
+    @staticmethod
+    async def get_window_rank(window: str, user_id: int) -> int:
+        key = await LeaderboardService._window_key(window)
+        rank = await RedisManager.get_leaderboard_rank(user_id, key)
+        return rank + 1 if rank is not None else 0
+
+    @staticmethod
+    async def record_referral(referrer_id: int):
+        """Count a new referral in the ranking index"""
+        await RedisManager.incr_leaderboard(referrer_id, 1, REFERRAL_LEADERBOARD)
+
+    @staticmethod
+    async def reconcile():
+        """Correct drift in both sorted sets against Postgres"""
+        # Push this process's buffered taps first so balances are current
+        if not await TapWriteBuffer.flush(force=True):
+            logger.warning("Skipping leaderboard reconcile while taps cannot be written")
+            return
+
+        corrected = await LeaderboardService._correct(
+            BALANCE_LEADERBOARD,
+            LeaderboardService._scan("SELECT user_id, balance FROM users WHERE balance > 0"),
+            skip_recent_taps=True
+        )
+        corrected += await LeaderboardService._correct(
+            REFERRAL_LEADERBOARD,
+            LeaderboardService._scan("SELECT user_id, referrals FROM users WHERE referrals > 0")
+        )
+        if corrected:
+            logger.info(f"Leaderboard reconcile corrected {corrected} entries")
+
+        # Rendered views may be built from the drifted sets
+        await LeaderboardService.invalidate_cache()
+
+    @staticmethod
+    async def _correct(key: str, batches, skip_recent_taps: bool = False) -> int:
+        """Apply the difference between Postgres and Redis as deltas.
+
+        Deltas leave increments that land during the scan in place, unlike
+        swapping in a rebuilt set. Users who tapped within RECENT_TAP_GRACE
+        may have taps in another process's buffer that Postgres has not
+        seen yet, so their lower Postgres score is not trusted this round.
+        """
+        seen = set()
+        corrected = 0
+
+        async def apply(drift: Dict[int, float]) -> int:
+            drift = {user_id: delta for user_id, delta in drift.items() if abs(delta) > 1e-6}
+            if skip_recent_taps:
+                lowered = [user_id for user_id, delta in drift.items() if delta < 0]
+                cutoff = time.time() - LeaderboardService.RECENT_TAP_GRACE
+                for user_id, tapped in zip(lowered, await RedisManager.get_last_tap_times(lowered)):
+                    if tapped is not None and tapped > cutoff:
+                        del drift[user_id]
+            if drift:
+                await RedisManager.adjust_leaderboard(key, drift)
+            return len(drift)
+
+        async for batch in batches:
+            if not batch:
+                continue
+            user_ids = [user_id for user_id, _ in batch]
+            seen.update(user_ids)
+            scores = await RedisManager.get_leaderboard_scores(key, user_ids)
+            corrected += await apply({
+                user_id: float(score) - (current or 0.0)
+                for (user_id, score), current in zip(batch, scores)
+            })
+
+        # Ranked in Redis but no longer (or never) above zero in Postgres
+        stale = {}
+        async for member, current in RedisManager.iter_leaderboard(key):
+            if int(member) not in seen:
+                stale[int(member)] = -current
+                if len(stale) >= LeaderboardService.RECONCILE_BATCH_SIZE:
+                    corrected += await apply(stale)
+                    stale = {}
+        corrected += await apply(stale)
+        return corrected
+
+    @staticmethod
+    def start_reconciler():
+        LeaderboardService._reconciler = PeriodicTask(
+            "leaderboard-reconcile",
+            config.leaderboard_reconcile_interval,
+            LeaderboardService.reconcile
+        )
+        # Run once right away so a fresh Redis gets a full index
+        LeaderboardService._reconciler.start(run_now=True)
+
+    @staticmethod
+    async def stop_reconciler():
+        if LeaderboardService._reconciler:
+            await LeaderboardService._reconciler.stop()
+            LeaderboardService._reconciler = None
+
+    @staticmethod
+    def _today() -> date:
+        return datetime.now(timezone.utc).date()
+
+    @staticmethod
+    def _day_key(day: date) -> str:
+        return f"lb:taps:day:{day:%Y%m%d}"
+
+    @staticmethod
+    def _week_index(day: date) -> int:
+        return (day - date.fromisoformat(config.season_epoch)).days // 7
+
+    @staticmethod
+    def _week_days(week: int) -> List[date]:
+        start = date.fromisoformat(config.season_epoch) + timedelta(weeks=week)
+        return [start + timedelta(days=i) for i in range(7)]
+
+    @staticmethod
+    async def _window_key(window: str) -> str:
+        """Sorted-set key holding the given window, building unions as needed"""
+        if window not in LeaderboardService.WINDOWS:
+            raise ValueError(f"Unknown leaderboard window: {window}")
+
+        today = LeaderboardService._today()
+        if window == 'daily':
+            return LeaderboardService._day_key(today)
+
+        week = LeaderboardService._week_index(today)
+        if window == 'weekly':
+            return await LeaderboardService._week_key(week, today)
+
+        season = week // config.season_weeks
+        key = f"lb:taps:season:{season}"
+        if not await RedisManager.exists(key):
+            week_keys = [
+                await LeaderboardService._week_key(w, today)
+                for w in range(season * config.season_weeks, week + 1)
+            ]
+            await RedisManager.union_leaderboards(key, week_keys, LeaderboardService.WINDOW_CACHE_TTL)
+        return key
+
+    @staticmethod
+    async def _week_key(week: int, today: date) -> str:
+        days = LeaderboardService._week_days(week)
+        day_keys = [LeaderboardService._day_key(d) for d in days if d <= today]
+
+        if days[-1] >= today:
+            # Current week: short-lived union that picks up new taps
+            key = f"lb:taps:week:{week}:partial"
+            ttl = LeaderboardService.WINDOW_CACHE_TTL
+        else:
+            # Completed week: build once and keep for the rest of the season
+            key = f"lb:taps:week:{week}"
+            ttl = LeaderboardService.DAY_BUCKET_TTL
+
+        if not await RedisManager.exists(key):
+            await RedisManager.union_leaderboards(key, day_keys, ttl)
+        return key
+
+    @staticmethod
+    def _refresh_in_flight() -> asyncio.Task:
+        """Join the refresh already running in this process, or start one"""
+        task = LeaderboardService._snapshot_refresh
+        if task is None or task.done():
+            task = asyncio.create_task(LeaderboardService._refresh_or_wait())
+            LeaderboardService._snapshot_refresh = task
+        return task
+
+    @staticmethod
+    async def _refresh_or_wait() -> str:
+        try:
+            text = await LeaderboardService.refresh_snapshot()
+            if text is not None:
+                return text
+
+            # Another process holds the lock; wait for it to publish
+            deadline = asyncio.get_running_loop().time() + LeaderboardService.SNAPSHOT_WAIT
+            while asyncio.get_running_loop().time() < deadline:
+                await asyncio.sleep(0.1)
+                text, _ = await LeaderboardService._read_snapshot()
+                if text is not None:
+                    return text
+        except Exception as e:
+            logger.error(f"Leaderboard snapshot refresh failed: {e}")
+
+        # Last resort: render for this caller without publishing
+        return LeaderboardService._render_snapshot(
+            await LeaderboardService.get_top_users(10),
+            await LeaderboardService.get_top_referrers(10)
+        )
+
+    @staticmethod
+    async def _read_snapshot() -> Tuple[Optional[str], bool]:
+        """Return (text, is_fresh) for the current snapshot"""
+        name = LeaderboardService.SNAPSHOT_NAME
+        text, fresh = await LeaderboardService.cache.get_many([name, f"{name}:fresh"])
+        return text, fresh is not None
+
+    @staticmethod
+    def _render_snapshot(top_balance: List[Dict], top_referrals: List[Dict]) -> str:
+        text = "🏆 Leaderboard\n\n"
+
+        # Balance rankings
+        text += "💰 Top Players by Balance:\n"
+        for i, player in enumerate(top_balance, 1):
+            name = player['username'] or player['first_name']
+            text += f"{i}. {name}: {player['balance']:.2f} AUG\n"
+
+        text += "\n👥 Top Players by Referrals:\n"
+        for i, player in enumerate(top_referrals, 1):
+            name = player['username'] or player['first_name']
+            text += f"{i}. {name}: {player['referrals']} referrals\n"
+
+        return text
+
+    @staticmethod
+    async def _scan(query: str):
+        """Stream (id, score) rows in batches through a server-side cursor"""
+        async with Database.acquire() as conn:
+            async with conn.transaction():
+                batch = []
+                async for row in conn.cursor(query, prefetch=LeaderboardService.RECONCILE_BATCH_SIZE):
+                    batch.append((row[0], row[1]))
+                    if len(batch) >= LeaderboardService.RECONCILE_BATCH_SIZE:
+                        yield batch
+                        batch = []
+                yield batch
+
+    @staticmethod
+    async def _with_names(entries: list, score_field: str) -> List[Dict]:
+        """Attach display names to (user_id, score) pairs with one primary-key lookup"""
+        if not entries:
+            return []
+
+        user_ids = [int(member) for member, _ in entries]
+        rows = await Database.read().fetch(LEADERBOARD_NAMES, user_ids)
+        names = {row['user_id']: row for row in rows}
+
+        result = []
+        for user_id, (_, score) in zip(user_ids, entries):
+            row = names.get(user_id)
+            result.append({
+                'user_id': user_id,
+                'username': row['username'] if row else None,
+                'first_name': row['first_name'] if row else None,
+                score_field: score
+            })
+        return result
 
     @staticmethod
     async def invalidate_cache():
-        """Invalidate all leaderboard caches"""
-        keys = await RedisManager.get_redis().keys("leaderboard:*")
-        if keys:
-            await RedisManager.get_redis().delete(*keys) 
\ No newline at end of file
+        """Invalidate all leaderboard caches with a single version bump"""
+        await LeaderboardService.cache.invalidate()
+        await LeaderboardService.snapshot_l1.invalidate()
@@ -0,0 +1,75 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from ..db.connection import Database
+from ..db.write_buffer import TapWriteBuffer
+from ..utils.redis_manager import RedisManager
+from .upgrade_catalog import UpgradeCatalog
+from .upgrade_service import UpgradeService
+
+# User counters, today's rollup and upgrade levels in one round trip
+PROFILE_QUERY = Database.register(
+    "profile",
+    """
+    WITH today AS (
+        SELECT amount FROM tap_rollups_daily
+        WHERE user_id = $1 AND day = $2
+    ), levels AS (
+        SELECT json_object_agg(upgrade_id, level) AS levels
+        FROM user_upgrades
+        WHERE user_id = $1 AND level > 0
+    )
+    SELECT u.balance,
+           u.referrals as referral_count,
+           u.lifetime_earned as total_earned,
+           COALESCE((SELECT amount FROM today), 0) as earned_today,
+           (SELECT levels FROM levels) as upgrade_levels
+    FROM users u
+    WHERE u.user_id = $1
+    """
+)
+
+class ProfileService:
+    @staticmethod
+    async def get_profile(user_id: int, readonly: bool = True) -> Optional[Dict]:
+        """Everything the profile screen shows, or None for unknown users.
+
+        Reads from the replica by default; pass readonly=False when the
+        result will be cached, so a lagging replica can't pin a profile
+        from before the write that invalidated it.
+        """
+        today = datetime.now(timezone.utc).date()
+        route = Database.read() if readonly else Database.write()
+        row, effects, energy_state = await asyncio.gather(
+            route.fetchrow(PROFILE_QUERY, user_id, today),
+            UpgradeService.get_effects(user_id),
+            RedisManager.get_energy_state(user_id)
+        )
+        if not row:
+            return None
+
+        # Upgrade names and effects come from the in-memory catalog
+        levels = json.loads(row['upgrade_levels']) if row['upgrade_levels'] else {}
+        upgrades = []
+        for upgrade_id, level in sorted((int(k), v) for k, v in levels.items()):
+            upgrade = UpgradeCatalog.get(upgrade_id)
+            if upgrade:
+                upgrades.append({
+                    'name': upgrade.name,
+                    'level': level,
+                    'effect_type': upgrade.effect_type,
+                    'effect': upgrade.effect(level)
+                })
+
+        # Include taps that are still waiting to be flushed
+        pending = TapWriteBuffer.pending_balance(user_id)
+        return {
+            'balance': row['balance'] + pending,
+            'earned_today': row['earned_today'] + pending,
+            'total_earned': row['total_earned'] + pending,
+            'referral_count': row['referral_count'],
+            'energy': energy_state.current() if energy_state else effects.max_energy,
+            'max_energy': effects.max_energy,
+            'upgrades': upgrades
+        }
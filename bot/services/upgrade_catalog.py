@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+from ..db.connection import Database
+from ..utils.redis_manager import RedisManager
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class CatalogUpgrade:
+    """One row of the upgrades table with its per-level tables precomputed"""
+    id: int
+    name: str
+    description: str
+    effect_type: str
+    effect_value: float
+    max_level: int
+    costs: Tuple[Decimal, ...]  # costs[level] buys level + 1
+    effects: Tuple[float, ...]  # effects[level] is the total effect at that level
+
+    def cost(self, level: int) -> Optional[Decimal]:
+        """Price of the next level, or None at max level"""
+        return self.costs[level] if level < self.max_level else None
+
+    def effect(self, level: int) -> float:
+        return self.effects[min(level, self.max_level)]
+
+class UpgradeCatalog:
+    """In-memory copy of the static upgrades table.
+
+    Loaded once at startup and reloaded on SIGHUP, so shop views and
+    purchase pricing never query the catalog. A SIGHUP to any process
+    reloads every process through a pub/sub channel.
+    """
+    CHANNEL = "upgrade_catalog:reload"
+    _upgrades: Dict[int, CatalogUpgrade] = {}
+    _listener: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def load(cls):
+        rows = await Database.fetch("SELECT * FROM upgrades ORDER BY id")
+
+        upgrades = {}
+        for row in rows:
+            base_cost = Decimal(row['base_cost'])
+            multiplier = Decimal(row['cost_multiplier'])
+            effect_value = float(row['effect_value'])
+            max_level = row['max_level']
+
+            upgrades[row['id']] = CatalogUpgrade(
+                id=row['id'],
+                name=row['name'],
+                description=row['description'],
+                effect_type=row['effect_type'],
+                effect_value=effect_value,
+                max_level=max_level,
+                costs=tuple(base_cost * multiplier ** level for level in range(max_level)),
+                effects=tuple(effect_value * level for level in range(max_level + 1))
+            )
+
+        # Swap in one assignment so readers never see a half-built catalog
+        cls._upgrades = upgrades
+        logger.info(f"Loaded {len(upgrades)} upgrades into the catalog")
+
+    @classmethod
+    async def reload(cls):
+        """Reload the catalog, keeping the old one if the reload fails"""
+        try:
+            await cls.load()
+        except Exception as e:
+            logger.error(f"Upgrade catalog reload failed: {e}")
+
+    @classmethod
+    async def reload_everywhere(cls):
+        """Reload here, then tell the other bot processes to reload too"""
+        await cls.reload()
+        try:
+            await RedisManager.publish(cls.CHANNEL, {})
+        except Exception as e:
+            logger.error(f"Could not broadcast upgrade catalog reload: {e}")
+
+    @classmethod
+    def start_listener(cls):
+        """Reload whenever another process broadcasts a catalog reload"""
+        if cls._listener is None or cls._listener.done():
+            cls._listener = RedisManager.subscribe(cls.CHANNEL, lambda message: cls.reload())
+
+    @classmethod
+    async def stop_listener(cls):
+        await RedisManager.unsubscribe(cls._listener)
+        cls._listener = None
+
+    @classmethod
+    def get(cls, upgrade_id: int) -> Optional[CatalogUpgrade]:
+        return cls._upgrades.get(upgrade_id)
+
+    @classmethod
+    def all(cls) -> List[CatalogUpgrade]:
+        return list(cls._upgrades.values())
@@ -1,130 +1,183 @@
+from dataclasses import asdict, dataclass
+from decimal import Decimal
 from typing import Optional, Dict, List
 from ..db.connection import Database
+from ..db.write_buffer import TapWriteBuffer
+from ..utils.redis_manager import RedisManager
+from ..utils.two_tier_cache import TwoTierCache
+from .leaderboard_service import LeaderboardService
+from .upgrade_catalog import UpgradeCatalog
 from ..config import config
 
+USER_UPGRADE_LEVELS = Database.register(
+    "user_upgrade_levels",
+    "SELECT upgrade_id, level FROM user_upgrades WHERE user_id = $1"
+)
+
+PURCHASE_UPGRADE = Database.register(
+    "purchase_upgrade",
+    "SELECT * FROM purchase_upgrade($1, $2, $3::numeric[])"
+)
+
+@dataclass(frozen=True)
+class UpgradeEffects:
+    """A user's combined upgrade effects, precomputed for the tap path"""
+    tap_multiplier: float
+    max_energy: int
+    energy_regen: float
+    referral_bonus: float
+
+    @classmethod
+    def from_totals(cls, totals: Dict[str, float]) -> "UpgradeEffects":
+        """Build from the summed effect of each effect_type"""
+        return cls(
+            tap_multiplier=totals.get('tap_multiplier') or 1.0,
+            max_energy=config.max_energy + int(totals.get('max_energy', 0)),
+            energy_regen=config.energy_regen_rate + totals.get('energy_regen', 0),
+            referral_bonus=totals.get('referral_bonus', 0.0)
+        )
+
+    @classmethod
+    def from_redis(cls, data: Dict[str, str]) -> "UpgradeEffects":
+        return cls(
+            tap_multiplier=float(data['tap_multiplier']),
+            max_energy=int(data['max_energy']),
+            energy_regen=float(data['energy_regen']),
+            referral_bonus=float(data['referral_bonus'])
+        )
+
+@dataclass(frozen=True)
+class PurchaseResult:
+    """Outcome of a purchase: ok, no_user, not_found, max_level or insufficient_funds"""
+    status: str
+    name: Optional[str] = None
+    level: Optional[int] = None
+    cost: Optional[Decimal] = None
+    balance: Optional[Decimal] = None
+
+    @property
+    def success(self) -> bool:
+        return self.status == 'ok'
+
 class UpgradeService:
-    UPGRADE_TYPES = {
-        'tap_power': {
-            'name': 'Tap Power',
-            'base_cost': 100,
-            'cost_multiplier': 1.5,
-            'max_level': 10
-        },
-        'energy_capacity': {
-            'name': 'Energy Capacity',
-            'base_cost': 200,
-            'cost_multiplier': 2.0,
-            'max_level': 5
-        }
-    }
+    EFFECTS_CACHE_SIZE = 10000  # users kept in the in-process LRU
+    EFFECTS_LOCAL_TTL = 60  # seconds before re-checking Redis
+    EFFECTS_REDIS_TTL = 86400  # 1 day
 
-    @staticmethod
-    async def get_upgrade_cost(upgrade_type: str, current_level: int) -> int:
-        if upgrade_type not in UpgradeService.UPGRADE_TYPES:
-            return 0
+    # L1 only: the Redis copy lives in the user state hash
+    _effects_cache = TwoTierCache("upgrade_effects", EFFECTS_CACHE_SIZE, EFFECTS_LOCAL_TTL)
 
-        upgrade_info = UpgradeService.UPGRADE_TYPES[upgrade_type]
-        base_cost = upgrade_info['base_cost']
-        multiplier = upgrade_info['cost_multiplier']
-        
-        return int(base_cost * (multiplier ** current_level))
+    @staticmethod
+    def get_upgrade_cost(upgrade_id: int, current_level: int) -> Optional[Decimal]:
+        """Price of the next level from the catalog, or None if unavailable"""
+        upgrade = UpgradeCatalog.get(upgrade_id)
+        return upgrade.cost(current_level) if upgrade else None
 
     @staticmethod
-    async def get_user_upgrades(user_id: int) -> Dict[str, int]:
-        upgrades = await Database.fetch(
-            "SELECT upgrade_type, level FROM user_upgrades WHERE user_id = $1",
-            user_id
-        )
-        return {row['upgrade_type']: row['level'] for row in upgrades}
+    async def get_user_upgrades(user_id: int, readonly: bool = False) -> Dict[int, int]:
+        """Get the user's level for each upgrade id they own"""
+        route = Database.read() if readonly else Database.write()
+        upgrades = await route.fetch(USER_UPGRADE_LEVELS, user_id)
+        return {row['upgrade_id']: row['level'] for row in upgrades}
 
     @staticmethod
-    async def can_upgrade(user_id: int, upgrade_type: str) -> bool:
-        if upgrade_type not in UpgradeService.UPGRADE_TYPES:
-            return False
-
-        current_level = await Database.fetchval(
-            """
-            SELECT level FROM user_upgrades 
-            WHERE user_id = $1 AND upgrade_type = $2
-            """,
-            user_id, upgrade_type
-        ) or 0
-
-        if current_level >= UpgradeService.UPGRADE_TYPES[upgrade_type]['max_level']:
-            return False
-
-        cost = await UpgradeService.get_upgrade_cost(upgrade_type, current_level)
-        user_balance = await Database.fetchval(
-            "SELECT balance FROM users WHERE user_id = $1",
-            user_id
+    async def purchase_upgrade(user_id: int, upgrade_id: int, tax_rate: float = 0.0) -> PurchaseResult:
+        """Buy the next level of an upgrade.
+
+        The balance check, debit and level bump run in the purchase_upgrade
+        SQL function under a lock on the buyer's row, so concurrent clicks
+        can never overspend.
+        """
+        upgrade = UpgradeCatalog.get(upgrade_id)
+        if not upgrade:
+            return PurchaseResult(status='not_found')
+
+        # Make sure buffered taps count towards the balance being spent
+        await TapWriteBuffer.flush_user(user_id)
+
+        costs = upgrade.costs
+        if tax_rate:
+            costs = [cost * (1 + Decimal(str(tax_rate))) for cost in costs]
+
+        row = await Database.fetchrow(PURCHASE_UPGRADE, user_id, upgrade_id, list(costs))
+        result = PurchaseResult(
+            status=row['result'],
+            name=upgrade.name,
+            level=row['new_level'],
+            cost=row['price'],
+            balance=row['new_balance']
         )
 
-        return user_balance >= cost
-
-    @staticmethod
-    async def purchase_upgrade(user_id: int, upgrade_type: str) -> bool:
-        if not await UpgradeService.can_upgrade(user_id, upgrade_type):
-            return False
-
-        current_level = await Database.fetchval(
-            """
-            SELECT level FROM user_upgrades 
-            WHERE user_id = $1 AND upgrade_type = $2
-            """,
-            user_id, upgrade_type
-        ) or 0
-
-        cost = await UpgradeService.get_upgrade_cost(upgrade_type, current_level)
-        tax = int(cost * (config.game.tax_percent / 100))
-        total_cost = cost + tax
-
-        # Start transaction
-        async with Database.get_pool().acquire() as conn:
-            async with conn.transaction():
-                # Check balance again (in case it changed)
-                user_balance = await conn.fetchval(
-                    "SELECT balance FROM users WHERE user_id = $1",
-                    user_id
-                )
-
-                if user_balance < total_cost:
-                    return False
-
-                # Update user balance
-                await conn.execute(
-                    "UPDATE users SET balance = balance - $1 WHERE user_id = $2",
-                    total_cost, user_id
-                )
-
-                # Update or insert upgrade
-                await conn.execute(
-                    """
-                    INSERT INTO user_upgrades (user_id, upgrade_type, level)
-                    VALUES ($1, $2, 1)
-                    ON CONFLICT (user_id, upgrade_type) 
-                    DO UPDATE SET level = user_upgrades.level + 1
-                    """,
-                    user_id, upgrade_type
-                )
-
-        return True
+        if result.success:
+            await UpgradeService.refresh_effects(user_id)
+            await RedisManager.invalidate_profile(user_id)
+            await LeaderboardService.record_balance_change(user_id, -result.cost)
+        return result
 
     @staticmethod
-    async def get_upgrade_info(user_id: int) -> List[Dict]:
-        user_upgrades = await UpgradeService.get_user_upgrades(user_id)
+    async def get_upgrade_info(user_id: int, readonly: bool = False) -> List[Dict]:
+        user_upgrades = await UpgradeService.get_user_upgrades(user_id, readonly)
         result = []
 
-        for upgrade_type, info in UpgradeService.UPGRADE_TYPES.items():
-            current_level = user_upgrades.get(upgrade_type, 0)
-            next_cost = await UpgradeService.get_upgrade_cost(upgrade_type, current_level)
-            
+        for upgrade in UpgradeCatalog.all():
+            current_level = user_upgrades.get(upgrade.id, 0)
             result.append({
-                'type': upgrade_type,
-                'name': info['name'],
+                'id': upgrade.id,
+                'name': upgrade.name,
+                'description': upgrade.description,
+                'effect_type': upgrade.effect_type,
+                'effect_value': upgrade.effect_value,
                 'current_level': current_level,
-                'max_level': info['max_level'],
-                'next_cost': next_cost,
-                'can_upgrade': current_level < info['max_level']
+                'max_level': upgrade.max_level,
+                'next_cost': upgrade.cost(current_level),
+                'can_upgrade': current_level < upgrade.max_level
             })
 
-        return result 
\ No newline at end of file
+        return result
+
+    @staticmethod
+    async def get_effects(user_id: int) -> UpgradeEffects:
+        """Get a user's upgrade effects from the LRU, then Redis, then Postgres"""
+        return await UpgradeService._effects_cache.get(
+            user_id, lambda: UpgradeService._load_effects(user_id)
+        )
+
+    @staticmethod
+    async def _load_effects(user_id: int) -> UpgradeEffects:
+        data = await RedisManager.get_upgrade_effects(user_id)
+        if data:
+            return UpgradeEffects.from_redis(data)
+        # A cold load changes nothing, so other processes' copies stay valid
+        return await UpgradeService._build_effects(user_id)
+
+    @staticmethod
+    async def _build_effects(user_id: int) -> UpgradeEffects:
+        """Compute a user's effects from Postgres and store them in Redis"""
+        totals: Dict[str, float] = {}
+        for upgrade_id, level in (await UpgradeService.get_user_upgrades(user_id)).items():
+            upgrade = UpgradeCatalog.get(upgrade_id)
+            if not upgrade or level <= 0:
+                continue
+            if upgrade.effect_type == 'tap_multiplier':
+                # Tap rewards have always summed owned multipliers regardless of level
+                effect = upgrade.effect_value
+            else:
+                effect = upgrade.effect(level)
+            totals[upgrade.effect_type] = totals.get(upgrade.effect_type, 0) + effect
+        effects = UpgradeEffects.from_totals(totals)
+
+        await RedisManager.set_upgrade_effects(
+            user_id, asdict(effects), UpgradeService.EFFECTS_REDIS_TTL
+        )
+        return effects
+
+    @staticmethod
+    async def refresh_effects(user_id: int) -> UpgradeEffects:
+        """Rebuild a user's effects after a purchase commits.
+
+        Other bot processes are told to drop their cached copy.
+        """
+        effects = await UpgradeService._build_effects(user_id)
+        await UpgradeService._effects_cache.invalidate(user_id)
+        UpgradeService._effects_cache.set_local(user_id, effects)
+        return effects
@@ -1,10 +1,61 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional, Tuple, List, Dict
 from ..db.connection import Database
 from ..utils.redis_manager import RedisManager
 from ..config import config
+from ..utils.energy import EnergyState
+from .upgrade_service import UpgradeService
+from .leaderboard_service import LeaderboardService
+
+REFERRALS_FIRST_PAGE = Database.register(
+    "referrals_first_page",
+    """
+    SELECT r.referred_id as user_id, u.username, u.first_name, r.created_at
+    FROM referrals r
+    JOIN users u ON u.user_id = r.referred_id
+    WHERE r.referrer_id = $1
+    ORDER BY r.created_at DESC, r.referred_id DESC
+    LIMIT $2
+    """
+)
+
+REFERRALS_NEXT_PAGE = Database.register(
+    "referrals_next_page",
+    """
+    SELECT r.referred_id as user_id, u.username, u.first_name, r.created_at
+    FROM referrals r
+    JOIN users u ON u.user_id = r.referred_id
+    WHERE r.referrer_id = $1
+      AND (r.created_at, r.referred_id) < ($2, $3)
+    ORDER BY r.created_at DESC, r.referred_id DESC
+    LIMIT $4
+    """
+)
+
+USER_EXISTS = Database.register(
+    "user_exists",
+    "SELECT EXISTS (SELECT 1 FROM users WHERE user_id = $1)"
+)
 
 class UserService:
+    # Users known to have a users row, so hot paths skip the lookup
+    _known_users: "OrderedDict[int, None]" = OrderedDict()
+    KNOWN_USERS_MAX = 100_000
+
+    @classmethod
+    async def is_registered(cls, user_id: int) -> bool:
+        """Whether the user has run /start; only positive answers are cached"""
+        if user_id in cls._known_users:
+            cls._known_users.move_to_end(user_id)
+            return True
+        if not await Database.fetchval(USER_EXISTS, user_id):
+            return False
+        cls._known_users[user_id] = None
+        if len(cls._known_users) > cls.KNOWN_USERS_MAX:
+            cls._known_users.popitem(last=False)
+        return True
+
     @staticmethod
     async def get_or_create_user(user_id: int, username: Optional[str] = None) -> dict:
         user = await Database.fetchrow(
@@ -28,18 +79,28 @@ class UserService:
         return dict(user) if user else None
 
     @staticmethod
-    async def get_referrals(user_id: int) -> List[Dict]:
-        """Get all users referred by this user"""
-        referrals = await Database.fetch(
-            """
-            SELECT user_id, username, balance, created_at
-            FROM users
-            WHERE invited_by = $1
-            ORDER BY created_at DESC
-            """,
-            user_id
-        )
-        return [dict(ref) for ref in referrals]
+    async def get_referrals_page(
+        user_id: int,
+        cursor: Optional[Tuple[datetime, int]] = None,
+        limit: int = 10
+    ) -> Tuple[List[Dict], Optional[Tuple[datetime, int]]]:
+        """Get one page of referred users, newest first.
+
+        `cursor` is the (created_at, user_id) of the last row already shown.
+        Returns the page and the cursor for the next one, or None at the end.
+        """
+        if cursor is None:
+            rows = await Database.read().fetch(REFERRALS_FIRST_PAGE, user_id, limit + 1)
+        else:
+            rows = await Database.read().fetch(
+                REFERRALS_NEXT_PAGE, user_id, cursor[0], cursor[1], limit + 1
+            )
+
+        page = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = (page[-1]['created_at'], page[-1]['user_id'])
+        return page, next_cursor
 
     @staticmethod
     async def get_referral_stats(user_id: int) -> Dict:
@@ -47,11 +108,15 @@ class UserService:
         stats = await Database.fetchrow(
             """
             SELECT 
-                COUNT(*) as total_referrals,
-                SUM(CASE WHEN created_at > NOW() - INTERVAL '24 hours' THEN 1 ELSE 0 END) as new_referrals_24h,
-                SUM(CASE WHEN created_at > NOW() - INTERVAL '7 days' THEN 1 ELSE 0 END) as new_referrals_7d
-            FROM users
-            WHERE invited_by = $1
+                u.referrals as total_referrals,
+                (SELECT COUNT(*) FROM referrals r
+                 WHERE r.referrer_id = u.user_id
+                   AND r.created_at > NOW() - INTERVAL '24 hours') as new_referrals_24h,
+                (SELECT COUNT(*) FROM referrals r
+                 WHERE r.referrer_id = u.user_id
+                   AND r.created_at > NOW() - INTERVAL '7 days') as new_referrals_7d
+            FROM users u
+            WHERE u.user_id = $1
             """,
             user_id
         )
@@ -66,23 +131,25 @@ class UserService:
         """Get total earnings from referrals"""
         earnings = await Database.fetchrow(
             """
-            SELECT 
-                SUM(reward_amount) as total_earnings,
-                COUNT(*) as total_rewards
-            FROM referral_rewards
-            WHERE referrer_id = $1
+            SELECT referral_earnings as total_earnings, referrals as total_referrals
+            FROM users
+            WHERE user_id = $1
             """,
             user_id
         )
         return dict(earnings) if earnings else {
             'total_earnings': 0,
-            'total_rewards': 0
+            'total_referrals': 0
         }
 
     @staticmethod
     async def update_energy(user_id: int, energy: int) -> None:
         await Database.execute(
-            "UPDATE users SET energy = $1 WHERE user_id = $2",
+            """
+            UPDATE users 
+            SET energy = $1, energy_updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = $2
+            """,
             energy, user_id
         )
 
@@ -92,32 +159,27 @@ class UserService:
             "UPDATE users SET balance = balance + $1 WHERE user_id = $2",
             amount, user_id
         )
+        await LeaderboardService.record_balance_change(user_id, amount)
 
     @staticmethod
-    async def get_energy_info(user_id: int) -> Tuple[int, datetime]:
+    async def get_energy_state(user_id: int) -> Optional[EnergyState]:
         user = await Database.fetchrow(
-            "SELECT energy, last_tap_time FROM users WHERE user_id = $1",
+            """
+            SELECT energy, energy_updated_at, energy_regen_rate, max_energy
+            FROM users WHERE user_id = $1
+            """,
             user_id
         )
-        if not user:
-            return 0, datetime.now()
-
-        last_tap = user['last_tap_time'] or datetime.now()
-        current_energy = user['energy']
-
-        # Calculate regenerated energy
-        time_diff = datetime.now() - last_tap
-        regen_minutes = int(time_diff.total_seconds() / 60)
-        regen_energy = min(
-            regen_minutes // config.game.energy_regen_minutes,
-            config.game.max_energy - current_energy
-        )
+        return EnergyState.from_row(user) if user else None
 
-        if regen_energy > 0:
-            current_energy = min(current_energy + regen_energy, config.game.max_energy)
-            await UserService.update_energy(user_id, current_energy)
+    @staticmethod
+    async def get_energy_info(user_id: int) -> Tuple[int, datetime]:
+        """Return (current energy, last state change) without writing anything"""
+        state = await UserService.get_energy_state(user_id)
+        if not state:
+            return 0, datetime.now()
 
-        return current_energy, last_tap
+        return state.current(), state.row_timestamp()
 
     @staticmethod
     async def can_tap(user_id: int) -> bool:
@@ -127,36 +189,34 @@ class UserService:
     @staticmethod
     async def process_tap(user_id: int) -> Tuple[int, int]:
         """Process a tap and return (reward, remaining_energy)"""
-        if not await UserService.can_tap(user_id):
+        state = await UserService.get_energy_state(user_id)
+        if not state or state.current() <= 0:
             return 0, 0
+        state = state.spend()
 
-        # Get user's tap power upgrade
-        tap_power = await Database.fetchval(
-            """
-            SELECT level FROM user_upgrades 
-            WHERE user_id = $1 AND upgrade_type = 'tap_power'
-            """,
-            user_id
-        ) or 0
+        # Get user's cached upgrade effects
+        effects = await UpgradeService.get_effects(user_id)
 
         # Calculate reward
-        base_reward = config.game.base_tap_reward
-        bonus = min(tap_power, config.game.max_bonus_reward)
-        total_reward = base_reward + bonus
+        total_reward = config.base_tap_reward * effects.tap_multiplier
+        referrer_id = None
+        referral_reward = 0
 
         # Start transaction
-        async with Database.get_pool().acquire() as conn:
+        async with Database.acquire() as conn:
             async with conn.transaction():
                 # Update user state
                 await conn.execute(
                     """
                     UPDATE users 
-                    SET energy = energy - 1,
-                        balance = balance + $1,
+                    SET energy = $1,
+                        energy_updated_at = $2,
+                        balance = balance + $3,
+                        lifetime_earned = lifetime_earned + $3,
                         last_tap_time = CURRENT_TIMESTAMP
-                    WHERE user_id = $2
+                    WHERE user_id = $4
                     """,
-                    total_reward, user_id
+                    state.energy_at, state.row_timestamp(), total_reward, user_id
                 )
 
                 # Process referral bonus if applicable
@@ -176,7 +236,8 @@ class UserService:
                         await conn.execute(
                             """
                             UPDATE users 
-                            SET balance = balance + $1
+                            SET balance = balance + $1,
+                                referral_earnings = referral_earnings + $1
                             WHERE user_id = $2
                             """,
                             referral_reward, referrer_id
@@ -192,31 +253,54 @@ class UserService:
                             referrer_id, user_id, referral_reward, total_reward
                         )
 
-        # Get remaining energy
-        energy, _ = await UserService.get_energy_info(user_id)
+        await LeaderboardService.record_tap(user_id, total_reward)
+        if referral_reward:
+            await RedisManager.invalidate_profile(referrer_id)
+            await LeaderboardService.record_balance_change(referrer_id, referral_reward)
 
-        return total_reward, energy
+        return total_reward, state.energy_at
 
     @staticmethod
-    async def process_referral(inviter_id: int, new_user_id: int) -> None:
-        """Process a new referral"""
-        await Database.execute(
-            """
-            UPDATE users 
-            SET referrals = referrals + 1
-            WHERE user_id = $1
-            """,
-            inviter_id
-        )
+    async def process_referral(inviter_id: int, new_user_id: int, bonus: float) -> bool:
+        """Record a new referral, bump the inviter's counters and pay the signup bonus.
 
-        await Database.execute(
+        Everything happens in one statement, so the referrals row and the
+        counters can never disagree. Returns False if the inviter does not
+        exist or the referral was already recorded.
+        """
+        credited = await Database.fetchval(
             """
-            UPDATE users 
-            SET invited_by = $1
-            WHERE user_id = $2
+            WITH referral AS (
+                INSERT INTO referrals (referrer_id, referred_id)
+                SELECT $1, $2
+                WHERE EXISTS (SELECT 1 FROM users WHERE user_id = $1)
+                ON CONFLICT DO NOTHING
+                RETURNING referrer_id, referred_id
+            ), referred AS (
+                UPDATE users
+                SET invited_by = referral.referrer_id
+                FROM referral
+                WHERE users.user_id = referral.referred_id
+            ), inviter AS (
+                UPDATE users
+                SET referrals = referrals + 1,
+                    referral_earnings = referral_earnings + $3,
+                    balance = balance + $3
+                FROM referral
+                WHERE users.user_id = referral.referrer_id
+                RETURNING users.user_id
+            )
+            SELECT COUNT(*) FROM inviter
             """,
-            inviter_id, new_user_id
+            inviter_id, new_user_id, bonus
         )
+        if not credited:
+            return False
+
+        await RedisManager.invalidate_profile(inviter_id)
+        await LeaderboardService.record_referral(inviter_id)
+        await LeaderboardService.record_balance_change(inviter_id, bonus)
+        return True
 
     @staticmethod
     async def get_referral_bonus(user_id: int, referrer_id: int) -> int:
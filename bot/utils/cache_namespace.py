@@ -0,0 +1,72 @@
+from typing import Iterable, List, Optional, Tuple
+from bot.utils.redis_manager import RedisManager
+
+# Both scripts resolve the namespace's current version and the entry keys in
+# one round trip. Entry keys are derived inside the script, so this assumes a
+# single (non-cluster) Redis, like the rest of the bot.
+#
+# KEYS: version counter
+# ARGV: key prefix, then entry names
+GET_SCRIPT = """
+local prefix = ARGV[1] .. ':v' .. (redis.call('GET', KEYS[1]) or '0') .. ':'
+local values = {}
+for i = 2, #ARGV do
+    values[i - 1] = redis.call('GET', prefix .. ARGV[i])
+end
+return values
+"""
+
+# ARGV: key prefix, then (name, value, ttl) triples
+SET_SCRIPT = """
+local prefix = ARGV[1] .. ':v' .. (redis.call('GET', KEYS[1]) or '0') .. ':'
+for i = 2, #ARGV, 3 do
+    redis.call('SET', prefix .. ARGV[i], ARGV[i + 1], 'EX', ARGV[i + 2])
+end
+return 1
+"""
+
+class CacheNamespace:
+    """A family of Redis cache entries that can be invalidated as a whole in O(1).
+
+    Entries live under cache:{name}:v{version}:{key}. Invalidating bumps the
+    version, so readers immediately miss and the old generation ages out
+    through its TTL instead of being scanned for and deleted.
+    """
+
+    def __init__(self, name: str, ttl: int):
+        self.name = name
+        self.ttl = ttl
+        self.prefix = f"cache:{name}"
+        self.version_key = f"cache:{name}:version"
+        self._scripts = None
+
+    async def _get_scripts(self):
+        redis = await RedisManager.get_redis()
+        # Re-register after RedisManager reconnects with a new client
+        if self._scripts is None or self._scripts[0] is not redis:
+            self._scripts = (redis, redis.register_script(GET_SCRIPT), redis.register_script(SET_SCRIPT))
+        return self._scripts
+
+    async def get(self, key: str) -> Optional[str]:
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: Iterable[str]) -> List[Optional[str]]:
+        _, get_script, _ = await self._get_scripts()
+        values = await get_script(keys=[self.version_key], args=[self.prefix, *keys])
+        return [value or None for value in values]
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None):
+        await self.set_many([(key, value, ttl)])
+
+    async def set_many(self, entries: Iterable[Tuple[str, str, Optional[int]]]):
+        """Store (key, value, ttl) entries in the current version; ttl defaults to the namespace's"""
+        _, _, set_script = await self._get_scripts()
+        args = [self.prefix]
+        for key, value, ttl in entries:
+            args.extend((key, value, ttl or self.ttl))
+        await set_script(keys=[self.version_key], args=args)
+
+    async def invalidate(self):
+        """Drop every entry at once by moving readers to a new version"""
+        redis = await RedisManager.get_redis()
+        await redis.incr(self.version_key)
@@ -0,0 +1,93 @@
+import math
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from typing import Mapping, Optional
+
+# Lua twin of EnergyState.settle, shared by the Redis scripts so both paths
+# regenerate energy with exactly the same formula.
+SETTLE_ENERGY_LUA = """
+local function settle_energy(energy, stamp, rate, cap, now)
+    if energy >= cap then
+        return cap, now
+    end
+    local gained = math.floor((now - stamp) * rate / 60)
+    if gained < 0 then
+        gained = 0
+    end
+    if energy + gained >= cap then
+        return cap, now
+    end
+    if gained > 0 then
+        stamp = stamp + gained * 60 / rate
+    end
+    return energy + gained, stamp
+end
+"""
+
+@dataclass(frozen=True)
+class EnergyState:
+    """Energy stored as a point-in-time value plus the rules to regenerate it.
+
+    Current energy is derived on read from `energy_at` at `timestamp` (unix
+    seconds), gaining `regen_rate` points per minute up to `cap`, so idle users
+    never need a background write.
+    """
+    energy_at: int
+    timestamp: float
+    regen_rate: float
+    cap: int
+
+    @classmethod
+    def full(cls, cap: int, regen_rate: float, now: Optional[float] = None) -> "EnergyState":
+        return cls(cap, time.time() if now is None else now, regen_rate, cap)
+
+    def settle(self, now: Optional[float] = None) -> "EnergyState":
+        """Fold regenerated energy into `energy_at`, keeping partial progress"""
+        now = time.time() if now is None else now
+        if self.energy_at >= self.cap:
+            return replace(self, energy_at=self.cap, timestamp=now)
+
+        gained = max(0, math.floor((now - self.timestamp) * self.regen_rate / 60))
+        if self.energy_at + gained >= self.cap:
+            return replace(self, energy_at=self.cap, timestamp=now)
+        if gained == 0:
+            return self
+
+        # Advance the stamp only by the time that produced whole points
+        return replace(
+            self,
+            energy_at=self.energy_at + gained,
+            timestamp=self.timestamp + gained * 60 / self.regen_rate
+        )
+
+    def current(self, now: Optional[float] = None) -> int:
+        return self.settle(now).energy_at
+
+    def spend(self, amount: int = 1, now: Optional[float] = None) -> "EnergyState":
+        settled = self.settle(now)
+        return replace(settled, energy_at=settled.energy_at - amount)
+
+    def with_limits(self, regen_rate: float, cap: int, now: Optional[float] = None) -> "EnergyState":
+        """Apply new upgrade-driven limits without losing energy earned so far"""
+        return replace(self.settle(now), regen_rate=regen_rate, cap=cap)
+
+    def to_redis(self) -> dict:
+        return {"e": self.energy_at, "t": self.timestamp, "r": self.regen_rate, "c": self.cap}
+
+    @classmethod
+    def from_redis(cls, data: Mapping[str, str]) -> Optional["EnergyState"]:
+        if not data:
+            return None
+        return cls(int(data["e"]), float(data["t"]), float(data["r"]), int(data["c"]))
+
+    @classmethod
+    def from_row(cls, row: Mapping) -> "EnergyState":
+        """Build from a users row with energy, energy_updated_at, energy_regen_rate and max_energy"""
+        updated_at = row["energy_updated_at"]
+        timestamp = updated_at.replace(tzinfo=timezone.utc).timestamp() if updated_at else time.time()
+        return cls(row["energy"], timestamp, row["energy_regen_rate"], row["max_energy"])
+
+    def row_timestamp(self) -> datetime:
+        """`timestamp` as a naive UTC datetime for the users table"""
+        return datetime.fromtimestamp(self.timestamp, timezone.utc).replace(tzinfo=None)
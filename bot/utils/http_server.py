@@ -0,0 +1,123 @@
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (status, body, content type)
+Response = Tuple[int, bytes, str]
+# (method, headers with lower-cased names, body) -> response
+Route = Callable[[str, Dict[str, str], bytes], Awaitable[Response]]
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable"
+}
+
+def json_response(status: int, payload) -> Response:
+    return status, json.dumps(payload, default=str).encode(), "application/json"
+
+class HttpServer:
+    """Minimal HTTP/1.1 server on asyncio streams for the webhook and health checks.
+
+    Supports exact-path routes, Content-Length bodies and keep-alive, which
+    is all Telegram's webhook delivery and a load balancer probe need.
+    """
+    MAX_BODY = 1024 * 1024
+    IDLE_TIMEOUT = 75  # seconds a keep-alive connection may sit unused
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.routes: Dict[str, Route] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+
+    def route(self, path: str, handler: Route):
+        self.routes[path] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        # Closing the listener leaves keep-alive connections open; end them too
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), self.IDLE_TIMEOUT)
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > self.MAX_BODY:
+                    await self._respond(writer, (413, b"", "text/plain"), keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                response = await self._dispatch(method, target.split("?", 1)[0], headers, body)
+                keep_alive = (
+                    headers.get("connection", "").lower() != "close"
+                    and version.strip() == "HTTP/1.1"
+                )
+                await self._respond(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass  # Idle, truncated or malformed request; just drop the connection
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+
+    async def _dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        handler = self.routes.get(path)
+        if handler is None:
+            return 404, b"", "text/plain"
+        try:
+            return await handler(method, headers, body)
+        except Exception as e:
+            logger.error(f"HTTP handler for {path} failed: {e}")
+            return 500, b"", "text/plain"
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+        status, body, content_type = response
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
@@ -0,0 +1,51 @@
+import bisect
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+# Upper bounds in milliseconds; the last bucket catches everything slower
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+class Histogram:
+    """Fixed-bucket latency histogram, cheap enough to update on every query"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts: List[int] = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket holding the p-th percentile (0-100)"""
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.buckets[-1]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99)
+        }
+
+@dataclass
+class QueryStats:
+    """Per-query counters kept by the Database layer"""
+    latency_ms: Histogram = field(default_factory=Histogram)
+    rows: int = 0
+    errors: int = 0
+
+    def summary(self) -> Dict[str, float]:
+        return {**self.latency_ms.summary(), 'total_ms': self.latency_ms.total, 'rows': self.rows, 'errors': self.errors}
@@ -0,0 +1,98 @@
+"""One-time move of per-user Redis string keys into the u:{id} state hash.
+
+    python -m bot.utils.migrate_user_state
+
+Covers both the original energy:{id} counters and the later energy_state
+hashes, and drops the original all-time "leaderboard" sorted set, which
+lb:balance replaced. Safe to re-run and to run while the bot is up: fields
+already present in u:{id} are newer than the legacy keys and are never
+overwritten.
+"""
+import asyncio
+import logging
+import time
+from typing import List
+from bot.config import config
+from bot.utils.energy import EnergyState
+from bot.utils.redis_manager import RedisManager
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+# Rebuilt from Postgres by the leaderboard reconciler under lb:balance
+LEGACY_LEADERBOARD = "leaderboard"
+
+# Legacy key prefix -> hash field it moves to; hashes move field by field,
+# ENERGY converts a bare energy count into the regeneration state, None
+# means the key is only dropped
+ENERGY = "energy"
+LEGACY_KEYS = {
+    "energy": ENERGY,  # original plain counter, no TTL
+    "energy_state": "*",
+    "last_tap": "lt",
+    "daily_claim": None,  # claims are decided by users.last_claim_day
+    "tap_count": None,  # one-minute rate window, rebuilt on the next tap
+    "upgrade_effects": None  # rebuilt from Postgres on the next lookup
+}
+
+async def migrate_batch(redis, prefix: str, keys: List[str]):
+    field = LEGACY_KEYS[prefix]
+    if field is None:
+        await redis.delete(*keys)
+        return
+
+    read = redis.pipeline(transaction=False)
+    for key in keys:
+        if field == "*":
+            read.hgetall(key)
+        else:
+            read.get(key)
+    values = await read.execute()
+
+    now = time.time()
+    write = redis.pipeline(transaction=False)
+    for key, value in zip(keys, values):
+        if not value:
+            continue
+        user_key = RedisManager.user_key(int(key.split(":", 1)[1]))
+        if field == "*":
+            mapping = value
+        elif field == ENERGY:
+            # The old counter has no timestamp; regeneration starts from now
+            energy = min(int(value), config.max_energy)
+            mapping = EnergyState(energy, now, config.energy_regen_rate, config.max_energy).to_redis()
+        else:
+            mapping = {field: value}
+        for name, item in mapping.items():
+            write.hsetnx(user_key, name, item)
+        write.expire(user_key, config.user_state_ttl)
+    write.delete(*keys)
+    await write.execute()
+
+async def migrate():
+    redis = await RedisManager.get_redis()
+    try:
+        for prefix in LEGACY_KEYS:
+            moved = 0
+            batch = []
+            async for key in redis.scan_iter(match=f"{prefix}:*", count=BATCH_SIZE):
+                batch.append(key)
+                if len(batch) >= BATCH_SIZE:
+                    await migrate_batch(redis, prefix, batch)
+                    moved += len(batch)
+                    batch = []
+            if batch:
+                await migrate_batch(redis, prefix, batch)
+                moved += len(batch)
+            logger.info(f"Migrated {moved} {prefix} keys")
+
+        if await redis.type(LEGACY_LEADERBOARD) == "zset":
+            await redis.delete(LEGACY_LEADERBOARD)
+            logger.info(f"Dropped the legacy {LEGACY_LEADERBOARD} sorted set")
+    finally:
+        await RedisManager.close()
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    asyncio.run(migrate())
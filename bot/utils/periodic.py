@@ -0,0 +1,42 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+class PeriodicTask:
+    """Runs a coroutine function every `interval` seconds in the background"""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable[None]]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, run_now: bool = False):
+        if not self.running:
+            self._task = asyncio.create_task(self._run(run_now), name=self.name)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self, run_now: bool):
+        if not run_now:
+            await asyncio.sleep(self.interval)
+        while True:
+            try:
+                await self.func()
+            except Exception as e:
+                logger.error(f"Periodic task {self.name} failed: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+
+# Rate limit algorithms as Lua functions over fields of a hash, shared by the
+# generic limiter script and the tap admission script so both enforce limits
+# with the same arithmetic. Each returns (allowed, retry_after); retry_after
+# is a string because Redis truncates Lua numbers to integers.
+#
+# token bucket: `limit` tokens, refilled continuously over `period` seconds.
+#   fields <p>tk (tokens left) and <p>ts (last refill)
+# sliding window: at most `limit` hits in any `period` seconds, estimated from
+#   the current and previous fixed windows weighted by their overlap.
+#   fields <p>w (window index), <p>c (current count) and <p>p (previous count)
+RATE_LIMIT_LUA = """
+local function take_token(key, p, limit, period, now)
+    local data = redis.call('HMGET', key, p .. 'tk', p .. 'ts')
+    local rate = limit / period
+    local tokens = tonumber(data[1]) or limit
+    local stamp = tonumber(data[2]) or now
+    if now > stamp then
+        tokens = math.min(limit, tokens + (now - stamp) * rate)
+    end
+    if tokens < 1 then
+        return 0, tostring((1 - tokens) / rate)
+    end
+    redis.call('HSET', key, p .. 'tk', tostring(tokens - 1), p .. 'ts', tostring(now))
+    return 1, '0'
+end
+
+local function hit_window(key, p, limit, period, now)
+    local data = redis.call('HMGET', key, p .. 'w', p .. 'c', p .. 'p')
+    local current = math.floor(now / period)
+    local index = tonumber(data[1])
+    local count = tonumber(data[2]) or 0
+    local previous = tonumber(data[3]) or 0
+    if index ~= current then
+        previous = (index == current - 1) and count or 0
+        count = 0
+    end
+    local elapsed = (now - current * period) / period
+    if previous * (1 - elapsed) + count + 1 > limit then
+        -- Wait until the previous window's weight has decayed enough, or for the next window
+        local retry = 1 - elapsed
+        if previous > 0 and limit - count - 1 >= 0 then
+            retry = math.min(retry, 1 - (limit - count - 1) / previous - elapsed)
+        end
+        return 0, tostring(math.max(retry, 0) * period)
+    end
+    redis.call('HSET', key, p .. 'w', current, p .. 'c', count + 1, p .. 'p', previous)
+    return 1, '0'
+end
+
+local function hit_limit(algorithm, key, p, limit, period, now)
+    if algorithm == 'token_bucket' then
+        return take_token(key, p, limit, period, now)
+    end
+    return hit_window(key, p, limit, period, now)
+end
+"""
+
+ALGORITHMS = ("token_bucket", "sliding_window")
+
+@dataclass(frozen=True)
+class RateLimit:
+    """`limit` requests per `period` seconds, enforced by `algorithm`"""
+    algorithm: str
+    limit: float
+    period: float
+
+    @classmethod
+    def parse(cls, spec: str) -> "RateLimit":
+        """Parse "algorithm:limit:period", e.g. "token_bucket:5:5" """
+        algorithm, limit, period = spec.split(":")
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        return cls(algorithm, float(limit), float(period))
+
+@dataclass(frozen=True)
+class RateDecision:
+    """Outcome of a rate limit check"""
+    allowed: bool
+    retry_after: float = 0.0
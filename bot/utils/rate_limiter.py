@@ -0,0 +1,62 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+from bot.config import config
+from bot.utils.rate_limit import RateDecision, RateLimit
+from bot.utils.redis_manager import RedisManager
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Per-action rate limits, enforced atomically in Redis.
+
+    A rejection is remembered in-process until its retry_after passes, so a
+    client hammering the bot is turned away without another Redis call,
+    let alone a Postgres one.
+    """
+    PREFILTER_SIZE = 100000  # (action, user) rejections remembered locally
+
+    _limits: Dict[str, RateLimit] = {}
+    _blocked: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+
+    @classmethod
+    def limit_for(cls, action: str) -> RateLimit:
+        if action not in cls._limits:
+            cls._limits[action] = RateLimit.parse(config.rate_limits[action])
+        return cls._limits[action]
+
+    @classmethod
+    def blocked_for(cls, action: str, user_id: int) -> float:
+        """Seconds left on a remembered rejection, or 0 if the user may try Redis"""
+        if not config.rate_limit_prefilter:
+            return 0.0
+        until = cls._blocked.get((action, user_id))
+        if until is None:
+            return 0.0
+        remaining = until - time.monotonic()
+        if remaining <= 0:
+            del cls._blocked[(action, user_id)]
+            return 0.0
+        return remaining
+
+    @classmethod
+    def remember(cls, action: str, user_id: int, decision: RateDecision):
+        """Record a Redis rejection so repeats are refused locally"""
+        if decision.allowed or not config.rate_limit_prefilter:
+            return
+        cls._blocked[(action, user_id)] = time.monotonic() + decision.retry_after
+        cls._blocked.move_to_end((action, user_id))
+        while len(cls._blocked) > cls.PREFILTER_SIZE:
+            cls._blocked.popitem(last=False)
+
+    @classmethod
+    async def hit(cls, action: str, user_id: int) -> RateDecision:
+        """Count one request for `action`; check `allowed` before doing any work"""
+        remaining = cls.blocked_for(action, user_id)
+        if remaining:
+            return RateDecision(False, remaining)
+
+        decision = await RedisManager.hit_rate_limit(user_id, action, cls.limit_for(action), time.time())
+        cls.remember(action, user_id, decision)
+        return decision
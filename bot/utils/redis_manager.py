@@ -1,85 +1,400 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import date
+from typing import Awaitable, Callable, Dict, Iterable, Optional
 import aioredis
 from bot.config import config
+from bot.utils.energy import EnergyState, SETTLE_ENERGY_LUA
+from bot.utils.rate_limit import RATE_LIMIT_LUA, RateDecision, RateLimit
+
+# A user's hot state lives in one hash, u:{id}, whose TTL is pushed back on
+# every write so inactive users age out of Redis on their own:
+#   e, t, r, c      energy regeneration state (see bot.utils.energy)
+#   lt              last admitted tap, unix seconds
+#   rl:{action}:*   rate limit state per action (see bot.utils.rate_limit)
+#   tap_multiplier, max_energy, energy_regen, referral_bonus
+#                   cached upgrade effects, stale after fx_exp
+ENERGY_FIELDS = ("e", "t", "r", "c")
+EFFECT_FIELDS = ("tap_multiplier", "max_energy", "energy_regen", "referral_bonus", "fx_exp")
+
+# Checks energy and the tap rate limit, then spends one energy point and
+# stamps the tap time. Runs atomically so concurrent taps from the same user
+# cannot both pass the checks. Energy is kept as a compact regeneration state
+# (see bot.utils.energy) and settled on every call. An admitted tap also drops
+# the user's cached profile.
+#
+# KEYS: user state hash, profile
+# ARGV: max_energy, regen_rate, rate algorithm, rate limit, rate period, now, state_ttl
+TAP_ADMISSION_SCRIPT = SETTLE_ENERGY_LUA + RATE_LIMIT_LUA + """
+local cap = tonumber(ARGV[1])
+local now = tonumber(ARGV[6])
+
+local state = redis.call('HMGET', KEYS[1], 'e', 't', 'r')
+local energy, stamp = cap, now
+if state[1] then
+    energy, stamp = settle_energy(tonumber(state[1]), tonumber(state[2]), tonumber(state[3]), cap, now)
+end
+if energy <= 0 then
+    return {'no_energy', energy, '0'}
+end
+
+local allowed, retry_after = hit_limit(ARGV[3], KEYS[1], 'rl:tap:', tonumber(ARGV[4]), tonumber(ARGV[5]), now)
+if allowed == 0 then
+    return {'rate_limited', energy, retry_after}
+end
+
+energy = energy - 1
+redis.call('HSET', KEYS[1], 'e', energy, 't', tostring(stamp), 'r', ARGV[2], 'c', ARGV[1], 'lt', ARGV[6])
+redis.call('EXPIRE', KEYS[1], ARGV[7])
+redis.call('DEL', KEYS[2])
+return {'ok', energy, '0'}
+"""
+
+# Generic per-action limit on the user state hash.
+# KEYS: user state hash
+# ARGV: algorithm, field prefix, limit, period, now, state_ttl
+RATE_LIMIT_SCRIPT = RATE_LIMIT_LUA + """
+local allowed, retry_after = hit_limit(ARGV[1], KEYS[1], ARGV[2], tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5]))
+if allowed == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[6])
+end
+return {allowed, retry_after}
+"""
+
+# Starts a daily claim unless one is already marked for that day. Returns the
+# existing marker ("pending" or "claimed:<streak>"), or false after placing a
+# short-lived "pending" marker for the caller.
+#
+# KEYS: daily claim marker
+# ARGV: pending ttl
+BEGIN_DAILY_CLAIM_SCRIPT = """
+local existing = redis.call('GET', KEYS[1])
+if existing then
+    return existing
+end
+redis.call('SET', KEYS[1], 'pending', 'EX', ARGV[1])
+return false
+"""
+
+logger = logging.getLogger(__name__)
+
+BALANCE_LEADERBOARD = "lb:balance"
+REFERRAL_LEADERBOARD = "lb:referrals"
+
+@dataclass
+class TapVerdict:
+    """Outcome of a tap admission check"""
+    status: str
+    energy: int
+    retry_after: float = 0.0
+
+    @property
+    def allowed(self) -> bool:
+        return self.status == "ok"
 
 class RedisManager:
     _redis = None
+    # Tags this process's broadcasts so its own subscribers can skip them
+    _origin = uuid.uuid4().hex
+    _tap_script = None
+    _rate_limit_script = None
+    _daily_claim_script = None
 
     @classmethod
     async def get_redis(cls):
         if cls._redis is None:
-            cls._redis = await aioredis.from_url(
+            # Bounded pool: callers wait for a free connection instead of opening more
+            pool = aioredis.BlockingConnectionPool.from_url(
                 config.redis_url,
+                max_connections=config.redis_max_connections,
+                timeout=config.redis_pool_timeout,
                 encoding="utf-8",
                 decode_responses=True
             )
+            cls._redis = aioredis.Redis(connection_pool=pool)
         return cls._redis
 
     @classmethod
     async def close(cls):
         if cls._redis:
             await cls._redis.close()
+            await cls._redis.connection_pool.disconnect()
             cls._redis = None
+            cls._tap_script = None
+            cls._rate_limit_script = None
+            cls._daily_claim_script = None
+
+    @classmethod
+    async def publish(cls, channel: str, message: Dict):
+        """Send a JSON message to every other bot process subscribed to `channel`"""
+        redis = await cls.get_redis()
+        await redis.publish(channel, json.dumps({**message, 'origin': cls._origin}))
+
+    @classmethod
+    def subscribe(cls, channel: str, handler: Callable[[Dict], Awaitable[None]]) -> asyncio.Task:
+        """Run `handler` on each message other processes publish to `channel`.
+
+        Listens in a background task until unsubscribe(); after a connection
+        error it resubscribes, and messages sent in between are lost.
+        """
+        return asyncio.create_task(cls._listen(channel, handler), name=f"subscribe:{channel}")
+
+    @staticmethod
+    async def unsubscribe(task: Optional[asyncio.Task]):
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    @classmethod
+    async def _listen(cls, channel: str, handler: Callable[[Dict], Awaitable[None]]):
+        while True:
+            pubsub = None
+            try:
+                redis = await cls.get_redis()
+                pubsub = redis.pubsub()
+                await pubsub.subscribe(channel)
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    data = json.loads(message['data'])
+                    if data.pop('origin', None) != cls._origin:
+                        await handler(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Subscription to {channel} failed, resubscribing: {e}")
+                await asyncio.sleep(1)
+            finally:
+                if pubsub is not None:
+                    await pubsub.close()
+
+    @classmethod
+    async def admit_tap(
+        cls,
+        user_id: int,
+        max_energy: int,
+        regen_rate: float,
+        rate_limit: RateLimit,
+        now: float
+    ) -> TapVerdict:
+        """Atomically check and spend one tap in a single round trip"""
+        redis = await cls.get_redis()
+        if cls._tap_script is None:
+            cls._tap_script = redis.register_script(TAP_ADMISSION_SCRIPT)
+        status, energy, retry_after = await cls._tap_script(
+            keys=[cls.user_key(user_id), f"profile:{user_id}"],
+            args=[
+                max_energy, regen_rate,
+                rate_limit.algorithm, rate_limit.limit, rate_limit.period,
+                now, config.user_state_ttl
+            ]
+        )
+        return TapVerdict(status, int(energy), float(retry_after))
+
+    @classmethod
+    async def hit_rate_limit(cls, user_id: int, action: str, rate_limit: RateLimit, now: float) -> RateDecision:
+        """Count one `action` against the user's limit, atomically"""
+        redis = await cls.get_redis()
+        if cls._rate_limit_script is None:
+            cls._rate_limit_script = redis.register_script(RATE_LIMIT_SCRIPT)
+        allowed, retry_after = await cls._rate_limit_script(
+            keys=[cls.user_key(user_id)],
+            args=[
+                rate_limit.algorithm, f"rl:{action}:", rate_limit.limit, rate_limit.period,
+                now, config.user_state_ttl
+            ]
+        )
+        return RateDecision(bool(int(allowed)), float(retry_after))
+
+    @staticmethod
+    def user_key(user_id: int) -> str:
+        return f"u:{user_id}"
+
+    @classmethod
+    async def get_user_state(cls, user_id: int, fields: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """Read some or all of a user's hot state in one call; missing fields are left out"""
+        redis = await cls.get_redis()
+        key = cls.user_key(user_id)
+        if fields is None:
+            return await redis.hgetall(key)
+        fields = list(fields)
+        values = await redis.hmget(key, fields)
+        return {field: value for field, value in zip(fields, values) if value is not None}
+
+    @classmethod
+    async def set_user_state(cls, user_id: int, mapping: Dict):
+        """Write several fields at once and push back the inactivity TTL"""
+        redis = await cls.get_redis()
+        key = cls.user_key(user_id)
+        pipe = redis.pipeline()
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, config.user_state_ttl)
+        await pipe.execute()
+
+    @classmethod
+    async def get_energy_state(cls, user_id: int) -> Optional[EnergyState]:
+        return EnergyState.from_redis(await cls.get_user_state(user_id, ENERGY_FIELDS))
+
+    @classmethod
+    async def set_energy_state(cls, user_id: int, state: EnergyState):
+        await cls.set_user_state(user_id, state.to_redis())
 
     @classmethod
-    async def get_user_energy(cls, user_id: int) -> int:
+    async def get_cached_profile(cls, user_id: int) -> Optional[str]:
         redis = await cls.get_redis()
-        key = f"energy:{user_id}"
-        energy = await redis.get(key)
-        return int(energy) if energy else None
+        return await redis.get(f"profile:{user_id}")
 
     @classmethod
-    async def set_user_energy(cls, user_id: int, energy: int, expire: int = None):
+    async def set_cached_profile(cls, user_id: int, text: str, ttl: int):
         redis = await cls.get_redis()
-        key = f"energy:{user_id}"
-        if expire:
-            await redis.set(key, energy, ex=expire)
-        else:
-            await redis.set(key, energy)
+        await redis.set(f"profile:{user_id}", text, ex=ttl)
 
     @classmethod
-    async def get_last_tap_time(cls, user_id: int) -> float:
+    async def invalidate_profile(cls, *user_ids: int):
+        """Drop cached profiles after a balance, upgrade or referral change"""
         redis = await cls.get_redis()
-        key = f"last_tap:{user_id}"
-        timestamp = await redis.get(key)
+        await redis.delete(*(f"profile:{user_id}" for user_id in user_ids))
+
+    @classmethod
+    async def get_upgrade_effects(cls, user_id: int) -> dict:
+        """Cached effects, or {} if missing or stale"""
+        data = await cls.get_user_state(user_id, EFFECT_FIELDS)
+        if len(data) < len(EFFECT_FIELDS) or float(data.pop("fx_exp")) < time.time():
+            return {}
+        return data
+
+    @classmethod
+    async def set_upgrade_effects(cls, user_id: int, effects: dict, expire: int):
+        await cls.set_user_state(user_id, {**effects, "fx_exp": time.time() + expire})
+
+    @classmethod
+    async def get_last_tap_time(cls, user_id: int) -> Optional[float]:
+        timestamp = (await cls.get_user_state(user_id, ("lt",))).get("lt")
         return float(timestamp) if timestamp else None
 
     @classmethod
     async def set_last_tap_time(cls, user_id: int, timestamp: float):
+        await cls.set_user_state(user_id, {"lt": timestamp})
+
+    @staticmethod
+    def daily_claim_key(user_id: int, day: date) -> str:
+        return f"daily:{user_id}:{day:%Y%m%d}"
+
+    @classmethod
+    async def begin_daily_claim(cls, user_id: int, day: date, pending_ttl: int) -> Optional[str]:
+        """Existing marker for the day, or None once this caller holds the pending marker"""
         redis = await cls.get_redis()
-        key = f"last_tap:{user_id}"
-        await redis.set(key, timestamp)
+        if cls._daily_claim_script is None:
+            cls._daily_claim_script = redis.register_script(BEGIN_DAILY_CLAIM_SCRIPT)
+        return await cls._daily_claim_script(keys=[cls.daily_claim_key(user_id, day)], args=[pending_ttl])
 
     @classmethod
-    async def get_last_daily_claim(cls, user_id: int) -> float:
+    async def finish_daily_claim(cls, user_id: int, day: date, streak: int, ttl: int):
+        """Mark the day as claimed so repeats are rejected without Postgres"""
         redis = await cls.get_redis()
-        key = f"daily_claim:{user_id}"
-        timestamp = await redis.get(key)
-        return float(timestamp) if timestamp else None
+        await redis.set(cls.daily_claim_key(user_id, day), f"claimed:{streak}", ex=ttl)
+
+    @classmethod
+    async def abort_daily_claim(cls, user_id: int, day: date):
+        redis = await cls.get_redis()
+        await redis.delete(cls.daily_claim_key(user_id, day))
+
+    @classmethod
+    async def get_leaderboard(cls, key: str = BALANCE_LEADERBOARD, start: int = 0, stop: int = 9) -> list:
+        redis = await cls.get_redis()
+        return await redis.zrevrange(key, start, stop, withscores=True)
+
+    @classmethod
+    async def get_leaderboard_rank(cls, user_id: int, key: str = BALANCE_LEADERBOARD) -> Optional[int]:
+        """Zero-based rank of a user, or None if they are not ranked"""
+        redis = await cls.get_redis()
+        return await redis.zrevrank(key, str(user_id))
 
     @classmethod
-    async def set_last_daily_claim(cls, user_id: int, timestamp: float):
+    async def get_leaderboard_ranks(cls, user_id: int, keys: list) -> list:
+        """Zero-based ranks of a user on several leaderboards in one round trip"""
         redis = await cls.get_redis()
-        key = f"daily_claim:{user_id}"
-        await redis.set(key, timestamp)
+        pipe = redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.zrevrank(key, str(user_id))
+        return await pipe.execute()
 
     @classmethod
-    async def increment_tap_count(cls, user_id: int, window: int = 60) -> int:
+    async def incr_leaderboard(cls, user_id: int, amount: float, key: str = BALANCE_LEADERBOARD):
+        redis = await cls.get_redis()
+        await redis.zincrby(key, float(amount), str(user_id))
+
+    @classmethod
+    async def record_tap_score(cls, user_id: int, amount: float, bucket_key: str, bucket_ttl: int):
+        """Add a tap reward to the all-time leaderboard and a time bucket in one round trip"""
+        redis = await cls.get_redis()
+        pipe = redis.pipeline(transaction=False)
+        pipe.zincrby(BALANCE_LEADERBOARD, float(amount), str(user_id))
+        pipe.zincrby(bucket_key, float(amount), str(user_id))
+        pipe.expire(bucket_key, bucket_ttl)
+        await pipe.execute()
+
+    @classmethod
+    async def union_leaderboards(cls, dest: str, keys: list, ttl: int):
+        """Materialize the sum of several leaderboards into `dest`, expiring after `ttl`"""
         redis = await cls.get_redis()
-        key = f"tap_count:{user_id}"
         pipe = redis.pipeline()
-        pipe.incr(key)
-        pipe.expire(key, window)
-        results = await pipe.execute()
-        return results[0]
+        pipe.delete(dest)
+        if keys:
+            pipe.zunionstore(dest, keys)
+            pipe.expire(dest, ttl)
+        await pipe.execute()
+
+    @classmethod
+    async def exists(cls, key: str) -> bool:
+        redis = await cls.get_redis()
+        return bool(await redis.exists(key))
+
+    @classmethod
+    async def get_leaderboard_scores(cls, key: str, user_ids: list) -> list:
+        """Scores of several users, None for those not ranked"""
+        redis = await cls.get_redis()
+        pipe = redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zscore(key, str(user_id))
+        return await pipe.execute()
+
+    @classmethod
+    async def iter_leaderboard(cls, key: str):
+        """Every (member, score) of a leaderboard, scanned incrementally"""
+        redis = await cls.get_redis()
+        async for member, score in redis.zscan_iter(key):
+            yield member, score
+
+    @classmethod
+    async def adjust_leaderboard(cls, key: str, deltas: Dict[int, float]):
+        """Add per-user deltas, which keeps increments made meanwhile, then drop emptied entries"""
+        redis = await cls.get_redis()
+        pipe = redis.pipeline(transaction=False)
+        for user_id, delta in deltas.items():
+            pipe.zincrby(key, delta, str(user_id))
+        pipe.zremrangebyscore(key, "-inf", 0)
+        await pipe.execute()
 
     @classmethod
-    async def get_leaderboard(cls) -> list:
+    async def get_last_tap_times(cls, user_ids: list) -> list:
+        """Each user's last admitted tap (unix seconds), None if unknown"""
         redis = await cls.get_redis()
-        key = "leaderboard"
-        return await redis.zrevrange(key, 0, 9, withscores=True)
+        pipe = redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hget(cls.user_key(user_id), "lt")
+        return [float(stamp) if stamp else None for stamp in await pipe.execute()]
 
     @classmethod
-    async def update_leaderboard(cls, user_id: int, score: float):
+    async def lock(cls, name: str, timeout: int):
+        """A non-reentrant Redis lock shared by every bot process"""
         redis = await cls.get_redis()
-        key = "leaderboard"
-        await redis.zadd(key, {str(user_id): score}) 
\ No newline at end of file
+        return redis.lock(f"lock:{name}", timeout=timeout, blocking_timeout=0)
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from bot.utils.redis_manager import RedisManager
+
+logger = logging.getLogger(__name__)
+
+class TwoTierCache:
+    """Bounded in-process LRU with TTL (L1) in front of Redis (L2).
+
+    Reads try L1, then Redis, then the caller's loader. With redis_ttl=None
+    the cache is L1 only and the loader owns the shared copy. invalidate()
+    drops the entry here and in Redis and broadcasts the key over pub/sub so
+    every other bot process drops its L1 copy too. A process that misses a
+    broadcast (e.g. while reconnecting) serves its L1 copy for at most `ttl`.
+    Values stored in Redis must be JSON-serializable.
+    """
+    CHANNEL = "cache:invalidate"
+    _caches: Dict[str, "TwoTierCache"] = {}
+    _listener: Optional[asyncio.Task] = None
+
+    def __init__(self, name: str, max_size: int = 10000, ttl: float = 60.0, redis_ttl: Optional[int] = None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_ttl = redis_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        TwoTierCache._caches[name] = self
+
+    def _redis_key(self, key: str) -> str:
+        return f"tt:{self.name}:{key}"
+
+    def get_local(self, key) -> Optional[Any]:
+        key = str(key)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set_local(self, key, value: Any):
+        key = str(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, key, loader: Optional[Callable[[], Awaitable[Any]]] = None) -> Optional[Any]:
+        """Cached value for `key`, filling both tiers from `loader` on a miss"""
+        value = self.get_local(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.redis_ttl:
+            redis = await RedisManager.get_redis()
+            raw = await redis.get(self._redis_key(key))
+            if raw is not None:
+                self.redis_hits += 1
+                value = json.loads(raw)
+                self.set_local(key, value)
+                return value
+
+        self.misses += 1
+        if loader is None:
+            return None
+        value = await loader()
+        if value is not None:
+            await self.set(key, value)
+        return value
+
+    async def set(self, key, value: Any):
+        self.set_local(key, value)
+        if self.redis_ttl:
+            redis = await RedisManager.get_redis()
+            await redis.set(self._redis_key(key), json.dumps(value), ex=self.redis_ttl)
+
+    async def invalidate(self, key=None):
+        """Drop one key, or the whole L1 when `key` is None, in every process.
+
+        Whole-cache invalidation leaves L2 entries to expire by redis_ttl.
+        """
+        key = None if key is None else str(key)
+        self._drop_local(key)
+        if key is not None and self.redis_ttl:
+            redis = await RedisManager.get_redis()
+            await redis.delete(self._redis_key(key))
+        await RedisManager.publish(TwoTierCache.CHANNEL, {'cache': self.name, 'key': key})
+
+    def _drop_local(self, key: Optional[str]):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.redis_hits) / lookups if lookups else 0.0
+        }
+
+    @classmethod
+    def all_stats(cls) -> Dict[str, Dict[str, float]]:
+        return {name: cache.stats() for name, cache in cls._caches.items()}
+
+    @classmethod
+    async def log_stats(cls):
+        for name, stats in cls.all_stats().items():
+            logger.info(
+                f"cache {name}: {stats['hits']} L1 hits, {stats['redis_hits']} Redis hits, "
+                f"{stats['misses']} misses ({stats['hit_rate']:.0%}), {stats['size']} entries"
+            )
+
+    @classmethod
+    def start_listener(cls):
+        if cls._listener is None or cls._listener.done():
+            cls._listener = RedisManager.subscribe(cls.CHANNEL, cls._handle)
+
+    @classmethod
+    async def stop_listener(cls):
+        await RedisManager.unsubscribe(cls._listener)
+        cls._listener = None
+
+    @classmethod
+    async def _handle(cls, event: Dict):
+        cache = cls._caches.get(event.get('cache'))
+        if cache is not None:
+            cache._drop_local(event.get('key'))
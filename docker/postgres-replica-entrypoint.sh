@@ -0,0 +1,12 @@
+#!/bin/sh
+# Clone the primary on first start, then run as a hot standby
+set -e
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    mkdir -p "$PGDATA"
+    chown postgres:postgres "$PGDATA"
+    chmod 700 "$PGDATA"
+    until pg_isready -h "$PRIMARY_HOST" -U "$PRIMARY_USER"; do sleep 1; done
+    su-exec postgres env PGPASSWORD="$PRIMARY_PASSWORD" \
+        pg_basebackup -h "$PRIMARY_HOST" -U "$PRIMARY_USER" -D "$PGDATA" -R -X stream
+fi
+exec docker-entrypoint.sh postgres
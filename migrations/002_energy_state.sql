@@ -0,0 +1,10 @@
+-- Store energy as a regeneration state: energy at energy_updated_at,
+-- regenerating energy_regen_rate points per minute up to max_energy.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS energy_updated_at TIMESTAMP;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS energy_regen_rate REAL DEFAULT 1;
+
+UPDATE users
+SET energy_updated_at = COALESCE(last_tap_time, CURRENT_TIMESTAMP)
+WHERE energy_updated_at IS NULL;
+
+ALTER TABLE users ALTER COLUMN energy_updated_at SET DEFAULT CURRENT_TIMESTAMP;
@@ -0,0 +1,41 @@
+-- Denormalized referral counters so referral stats are primary-key reads
+ALTER TABLE users ADD COLUMN IF NOT EXISTS referrals INTEGER DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS referral_earnings DECIMAL(20, 8) DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS invited_by BIGINT REFERENCES users(user_id);
+
+-- Backfill counts from the referral graph
+UPDATE users u
+SET referrals = c.referral_count
+FROM (
+    SELECT referrer_id, COUNT(*) as referral_count
+    FROM referrals
+    GROUP BY referrer_id
+) c
+WHERE u.user_id = c.referrer_id;
+
+-- Backfill earnings from the recorded tap-share rewards, which is what the
+-- referral view summed until now. Signup bonuses were paid without a record,
+-- so they are not included; the counter adds them from here on. Databases
+-- built from the migrations alone have no referral_rewards table.
+DO $$
+BEGIN
+    IF to_regclass('referral_rewards') IS NOT NULL THEN
+        UPDATE users u
+        SET referral_earnings = r.earned
+        FROM (
+            SELECT referrer_id, SUM(reward_amount) as earned
+            FROM referral_rewards
+            GROUP BY referrer_id
+        ) r
+        WHERE u.user_id = r.referrer_id;
+    END IF;
+END
+$$;
+
+UPDATE users u
+SET invited_by = r.referrer_id
+FROM referrals r
+WHERE r.referred_id = u.user_id AND u.invited_by IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_users_referrals ON users(referrals DESC);
+CREATE INDEX IF NOT EXISTS idx_users_invited_by ON users(invited_by);
@@ -0,0 +1,3 @@
+-- Supports keyset pagination of a user's referrals, newest first
+CREATE INDEX IF NOT EXISTS idx_referrals_referrer_created
+    ON referrals(referrer_id, created_at DESC, referred_id DESC);
@@ -0,0 +1,69 @@
+-- Buy the next level of an upgrade in one round trip. The buyer's row is
+-- locked first, so concurrent purchases see each other's balance and level.
+CREATE OR REPLACE FUNCTION purchase_upgrade(
+    p_user_id BIGINT,
+    p_upgrade_id INTEGER,
+    p_tax_rate NUMERIC DEFAULT 0
+)
+RETURNS TABLE (
+    result TEXT,
+    upgrade_name VARCHAR,
+    new_level INTEGER,
+    price NUMERIC,
+    new_balance NUMERIC
+)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    v_balance NUMERIC;
+    v_level INTEGER;
+    v_cost NUMERIC;
+    v_upgrade upgrades%ROWTYPE;
+BEGIN
+    SELECT u.balance INTO v_balance
+    FROM users u
+    WHERE u.user_id = p_user_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'no_user'::TEXT, NULL::VARCHAR, NULL::INTEGER, NULL::NUMERIC, NULL::NUMERIC;
+        RETURN;
+    END IF;
+
+    SELECT * INTO v_upgrade FROM upgrades WHERE id = p_upgrade_id;
+
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'not_found'::TEXT, NULL::VARCHAR, NULL::INTEGER, NULL::NUMERIC, v_balance;
+        RETURN;
+    END IF;
+
+    SELECT COALESCE(MAX(uu.level), 0) INTO v_level
+    FROM user_upgrades uu
+    WHERE uu.user_id = p_user_id AND uu.upgrade_id = p_upgrade_id;
+
+    IF v_level >= v_upgrade.max_level THEN
+        RETURN QUERY SELECT 'max_level'::TEXT, v_upgrade.name, v_level, NULL::NUMERIC, v_balance;
+        RETURN;
+    END IF;
+
+    v_cost := v_upgrade.base_cost * power(v_upgrade.cost_multiplier, v_level) * (1 + p_tax_rate);
+
+    IF v_balance < v_cost THEN
+        RETURN QUERY SELECT 'insufficient_funds'::TEXT, v_upgrade.name, v_level, v_cost, v_balance;
+        RETURN;
+    END IF;
+
+    UPDATE users u
+    SET balance = u.balance - v_cost
+    WHERE u.user_id = p_user_id
+    RETURNING u.balance INTO v_balance;
+
+    INSERT INTO user_upgrades (user_id, upgrade_id, level)
+    VALUES (p_user_id, p_upgrade_id, v_level + 1)
+    ON CONFLICT (user_id, upgrade_id)
+    DO UPDATE SET level = EXCLUDED.level, updated_at = CURRENT_TIMESTAMP;
+
+    RETURN QUERY SELECT 'ok'::TEXT, v_upgrade.name, v_level + 1, v_cost, v_balance;
+END;
+$$;
@@ -0,0 +1,63 @@
+-- Price purchases from the caller's precomputed cost table instead of
+-- reading the upgrades catalog. p_costs[n] is the price of level n, so
+-- array_length(p_costs) is the max level.
+DROP FUNCTION IF EXISTS purchase_upgrade(BIGINT, INTEGER, NUMERIC);
+
+CREATE OR REPLACE FUNCTION purchase_upgrade(
+    p_user_id BIGINT,
+    p_upgrade_id INTEGER,
+    p_costs NUMERIC[]
+)
+RETURNS TABLE (
+    result TEXT,
+    new_level INTEGER,
+    price NUMERIC,
+    new_balance NUMERIC
+)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    v_balance NUMERIC;
+    v_level INTEGER;
+    v_cost NUMERIC;
+BEGIN
+    SELECT u.balance INTO v_balance
+    FROM users u
+    WHERE u.user_id = p_user_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'no_user'::TEXT, NULL::INTEGER, NULL::NUMERIC, NULL::NUMERIC;
+        RETURN;
+    END IF;
+
+    SELECT COALESCE(MAX(uu.level), 0) INTO v_level
+    FROM user_upgrades uu
+    WHERE uu.user_id = p_user_id AND uu.upgrade_id = p_upgrade_id;
+
+    IF v_level >= COALESCE(array_length(p_costs, 1), 0) THEN
+        RETURN QUERY SELECT 'max_level'::TEXT, v_level, NULL::NUMERIC, v_balance;
+        RETURN;
+    END IF;
+
+    v_cost := p_costs[v_level + 1];
+
+    IF v_balance < v_cost THEN
+        RETURN QUERY SELECT 'insufficient_funds'::TEXT, v_level, v_cost, v_balance;
+        RETURN;
+    END IF;
+
+    UPDATE users u
+    SET balance = u.balance - v_cost
+    WHERE u.user_id = p_user_id
+    RETURNING u.balance INTO v_balance;
+
+    INSERT INTO user_upgrades (user_id, upgrade_id, level)
+    VALUES (p_user_id, p_upgrade_id, v_level + 1)
+    ON CONFLICT (user_id, upgrade_id)
+    DO UPDATE SET level = EXCLUDED.level, updated_at = CURRENT_TIMESTAMP;
+
+    RETURN QUERY SELECT 'ok'::TEXT, v_level + 1, v_cost, v_balance;
+END;
+$$;
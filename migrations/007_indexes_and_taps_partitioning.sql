@@ -0,0 +1,77 @@
+-- Leaderboard ORDER BY / rank counts and the reconcile scan walk these
+CREATE INDEX IF NOT EXISTS idx_users_balance ON users(balance DESC, user_id);
+CREATE INDEX IF NOT EXISTS idx_users_referrals_rank ON users(referrals DESC, user_id);
+DROP INDEX IF EXISTS idx_users_referrals;
+
+-- Create monthly taps partitions covering p_from through p_to
+CREATE OR REPLACE FUNCTION create_taps_partitions(p_from DATE, p_to DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_from)::date;
+    v_name TEXT;
+    v_created INTEGER := 0;
+BEGIN
+    WHILE v_month <= p_to LOOP
+        v_name := format('taps_%s', to_char(v_month, 'YYYY_MM'));
+        IF to_regclass(v_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF taps FOR VALUES FROM (%L) TO (%L)',
+                v_name, v_month, (v_month + INTERVAL '1 month')::date
+            );
+            v_created := v_created + 1;
+        END IF;
+        v_month := (v_month + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detach (not drop) monthly partitions that end on or before p_before so they
+-- can be archived or dropped without touching the live table
+CREATE OR REPLACE FUNCTION detach_taps_partitions(p_before DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_part RECORD;
+BEGIN
+    FOR v_part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'taps'::regclass
+          AND c.relname ~ '^taps_\d{4}_\d{2}$'
+          AND (to_date(substr(c.relname, 6), 'YYYY_MM') + INTERVAL '1 month')::date <= p_before
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE taps DETACH PARTITION %I', v_part.relname);
+        RETURN NEXT v_part.relname;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rebuild taps as a table range-partitioned by month of created_at
+ALTER TABLE taps RENAME TO taps_legacy;
+ALTER SEQUENCE taps_id_seq RENAME TO taps_legacy_id_seq;
+
+CREATE TABLE taps (
+    id BIGSERIAL,
+    user_id BIGINT NOT NULL REFERENCES users(user_id),
+    amount DECIMAL(20, 8) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+SELECT create_taps_partitions(
+    LEAST(COALESCE((SELECT MIN(created_at) FROM taps_legacy)::date, CURRENT_DATE), CURRENT_DATE),
+    (CURRENT_DATE + INTERVAL '2 months')::date
+);
+
+INSERT INTO taps (id, user_id, amount, created_at)
+SELECT id, user_id, amount, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM taps_legacy
+WHERE user_id IS NOT NULL;
+
+SELECT setval('taps_id_seq', COALESCE((SELECT MAX(id) FROM taps), 0) + 1, false);
+
+DROP TABLE taps_legacy;
+
+CREATE INDEX IF NOT EXISTS idx_taps_user_created ON taps(user_id, created_at);
@@ -0,0 +1,45 @@
+-- Tap earnings kept on the user row so profiles never scan taps
+ALTER TABLE users ADD COLUMN IF NOT EXISTS lifetime_earned DECIMAL(20, 8) DEFAULT 0;
+
+-- Per-user tap totals by hour and by day, upserted on every buffer flush
+CREATE TABLE IF NOT EXISTS tap_rollups_hourly (
+    user_id BIGINT NOT NULL REFERENCES users(user_id),
+    hour TIMESTAMP NOT NULL,
+    taps INTEGER NOT NULL DEFAULT 0,
+    amount DECIMAL(20, 8) NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, hour)
+);
+
+CREATE TABLE IF NOT EXISTS tap_rollups_daily (
+    user_id BIGINT NOT NULL REFERENCES users(user_id),
+    day DATE NOT NULL,
+    taps INTEGER NOT NULL DEFAULT 0,
+    amount DECIMAL(20, 8) NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+
+-- Cross-user analytics read a time range
+CREATE INDEX IF NOT EXISTS idx_tap_rollups_hourly_hour ON tap_rollups_hourly(hour);
+CREATE INDEX IF NOT EXISTS idx_tap_rollups_daily_day ON tap_rollups_daily(day);
+
+-- Backfill from existing taps; run with the bot stopped so no flush lands in between
+INSERT INTO tap_rollups_hourly (user_id, hour, taps, amount)
+SELECT user_id, date_trunc('hour', created_at), COUNT(*), SUM(amount)
+FROM taps
+GROUP BY 1, 2
+ON CONFLICT (user_id, hour) DO NOTHING;
+
+INSERT INTO tap_rollups_daily (user_id, day, taps, amount)
+SELECT user_id, hour::date, SUM(taps), SUM(amount)
+FROM tap_rollups_hourly
+GROUP BY 1, 2
+ON CONFLICT (user_id, day) DO NOTHING;
+
+UPDATE users u
+SET lifetime_earned = d.amount
+FROM (
+    SELECT user_id, SUM(amount) as amount
+    FROM tap_rollups_daily
+    GROUP BY user_id
+) d
+WHERE u.user_id = d.user_id;
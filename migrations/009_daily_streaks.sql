@@ -0,0 +1,28 @@
+-- Streak state on the user row, so a claim is decided by one UPDATE
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_claim_day DATE;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS daily_streak INTEGER NOT NULL DEFAULT 0;
+
+-- Claim history lookups by user, newest first
+CREATE INDEX IF NOT EXISTS idx_daily_claims_user_created ON daily_claims(user_id, created_at DESC);
+DROP INDEX IF EXISTS idx_daily_claims_user_id;
+
+-- Backfill from history: the latest run of consecutive claim days per user
+WITH days AS (
+    SELECT DISTINCT user_id, created_at::date AS day
+    FROM daily_claims
+    WHERE user_id IS NOT NULL AND created_at IS NOT NULL
+), islands AS (
+    SELECT user_id, day,
+           day - (ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY day))::int AS island
+    FROM days
+), streaks AS (
+    SELECT user_id, MAX(day) AS last_day, COUNT(*) AS streak,
+           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY MAX(day) DESC) AS rn
+    FROM islands
+    GROUP BY user_id, island
+)
+UPDATE users u
+SET last_claim_day = s.last_day,
+    daily_streak = s.streak
+FROM streaks s
+WHERE s.user_id = u.user_id AND s.rn = 1;
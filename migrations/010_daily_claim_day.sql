@@ -0,0 +1,13 @@
+-- One claim per user per UTC day, enforced by the database
+ALTER TABLE daily_claims ADD COLUMN IF NOT EXISTS claim_day DATE;
+
+-- Earlier double-paid claims keep a NULL claim_day so history stays intact
+UPDATE daily_claims d
+SET claim_day = d.created_at::date
+WHERE d.claim_day IS NULL
+  AND d.id = (
+      SELECT MIN(id) FROM daily_claims f
+      WHERE f.user_id = d.user_id AND f.created_at::date = d.created_at::date
+  );
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_claims_user_day ON daily_claims(user_id, claim_day);
@@ -0,0 +1,13 @@
+import pytest
+from fakeredis import aioredis as fake_aioredis
+from bot.utils.redis_manager import RedisManager
+
+@pytest.fixture
+async def redis(monkeypatch):
+    """In-memory Redis, with Lua, behind RedisManager"""
+    client = fake_aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(RedisManager, "_redis", client)
+    for script in ("_tap_script", "_rate_limit_script", "_daily_claim_script"):
+        monkeypatch.setattr(RedisManager, script, None)
+    yield client
+    await client.flushall()
@@ -0,0 +1,34 @@
+from bot.utils.cache_namespace import CacheNamespace
+
+async def test_entries_round_trip_in_one_call(redis):
+    cache = CacheNamespace("test", ttl=60)
+    await cache.set_many([("a", "1", None), ("b", "2", 5)])
+
+    assert await cache.get_many(["a", "b", "missing"]) == ["1", "2", None]
+    assert await redis.ttl("cache:test:v0:a") == 60
+    assert await redis.ttl("cache:test:v0:b") == 5
+
+async def test_invalidate_hides_every_entry_without_deleting_them(redis):
+    cache = CacheNamespace("test", ttl=60)
+    await cache.set("a", "old")
+
+    await cache.invalidate()
+
+    assert await cache.get("a") is None
+    # The old generation ages out through its TTL rather than a SCAN
+    assert await redis.get("cache:test:v0:a") == "old"
+
+    await cache.set("a", "new")
+    assert await cache.get("a") == "new"
+    assert await redis.get("cache:test:v1:a") == "new"
+
+async def test_namespaces_invalidate_independently(redis):
+    leaderboard = CacheNamespace("leaderboard", ttl=60)
+    other = CacheNamespace("other", ttl=60)
+    await leaderboard.set("top", "x")
+    await other.set("top", "y")
+
+    await leaderboard.invalidate()
+
+    assert await leaderboard.get("top") is None
+    assert await other.get("top") == "y"
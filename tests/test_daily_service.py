@@ -0,0 +1,142 @@
+import os
+from datetime import date
+from decimal import Decimal
+import asyncpg
+import pytest
+from bot.db.connection import Database
+from bot.services import daily_service
+from bot.services.daily_service import CLAIM_DAILY, DailyService
+from bot.utils.redis_manager import RedisManager
+
+@pytest.fixture
+def rows(monkeypatch):
+    """Answers for CLAIM_DAILY, consumed in order, and the balance changes recorded"""
+    answers = []
+    credited = []
+
+    async def fetchrow(query, *args):
+        assert query == CLAIM_DAILY
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    async def record_balance_change(user_id, amount):
+        credited.append((user_id, amount))
+
+    monkeypatch.setattr(Database, "fetchrow", fetchrow)
+    monkeypatch.setattr(daily_service.LeaderboardService, "record_balance_change", record_balance_change)
+    return answers, credited
+
+def claimed(streak, amount, balance):
+    return {'daily_streak': streak, 'amount': Decimal(amount), 'balance': Decimal(balance), 'current_streak': streak - 1}
+
+async def test_claim_reports_streak_amount_and_balance(redis, rows):
+    answers, credited = rows
+    answers.append(claimed(4, "65", "165"))
+
+    claim = await DailyService.claim_daily(1)
+
+    assert claim.success
+    assert (claim.amount, claim.streak, claim.balance) == (Decimal(65), 4, Decimal(165))
+    assert credited == [(1, Decimal(65))]
+
+async def test_claim_the_database_refuses_is_already_claimed(redis, rows):
+    answers, credited = rows
+    answers.append({'daily_streak': None, 'amount': None, 'balance': None, 'current_streak': 3})
+
+    claim = await DailyService.claim_daily(1)
+
+    assert claim.status == 'already_claimed'
+    assert claim.streak == 3
+    assert credited == []
+
+async def test_unknown_user_leaves_no_marker(redis, rows):
+    answers, _ = rows
+    answers.append(None)
+
+    assert (await DailyService.claim_daily(1)).status == 'no_user'
+    assert await redis.get(RedisManager.daily_claim_key(1, DailyService.today())) is None
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="needs TEST_DATABASE_URL")
+async def test_claim_statement_advances_and_resets_streaks_on_postgres():
+    conn = await asyncpg.connect(os.environ["TEST_DATABASE_URL"])
+    try:
+        # Temporary tables shadow the real ones for this connection only
+        await conn.execute("""
+            CREATE TEMP TABLE users (
+                user_id BIGINT PRIMARY KEY,
+                balance NUMERIC NOT NULL DEFAULT 0,
+                daily_streak INTEGER NOT NULL DEFAULT 0,
+                last_claim_day DATE
+            );
+            CREATE TEMP TABLE daily_claims (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT,
+                claim_day DATE,
+                amount NUMERIC,
+                UNIQUE (user_id, claim_day)
+            );
+            INSERT INTO users (user_id, daily_streak, last_claim_day) VALUES
+                (1, 3, DATE '2024-05-09'),
+                (2, 3, DATE '2024-05-01');
+        """)
+        today = date(2024, 5, 10)
+
+        async def claim(user_id):
+            return await Database.run(
+                conn, 'fetchrow', CLAIM_DAILY, user_id, today, Decimal(50), 7, Decimal("0.1")
+            )
+
+        row = await claim(1)
+        assert (row['daily_streak'], row['amount']) == (4, Decimal(65))
+        row = await claim(1)
+        assert row['amount'] is None and row['current_streak'] == 4
+
+        row = await claim(2)
+        assert (row['daily_streak'], row['amount']) == (1, Decimal(50))
+
+        assert await claim(3) is None
+        assert await conn.fetchval("SELECT COUNT(*) FROM daily_claims") == 2
+    finally:
+        await conn.close()
+
+async def test_second_claim_is_turned_away_by_the_marker(redis, rows):
+    answers, credited = rows
+    answers.append(claimed(2, "55", "155"))
+
+    assert (await DailyService.claim_daily(1)).success
+    again = await DailyService.claim_daily(1)
+
+    # Answered from Redis: the only queued database answer was used up
+    assert again.status == 'already_claimed'
+    assert again.streak == 2
+    assert credited == [(1, Decimal(55))]
+
+async def test_claim_in_flight_is_in_progress(redis, rows):
+    await RedisManager.begin_daily_claim(1, DailyService.today(), DailyService.PENDING_MARKER_TTL)
+
+    assert (await DailyService.claim_daily(1)).status == 'in_progress'
+
+async def test_failed_claim_can_be_retried(redis, rows):
+    answers, _ = rows
+    answers.extend([ConnectionError("database down"), claimed(1, "50", "50")])
+
+    with pytest.raises(ConnectionError):
+        await DailyService.claim_daily(1)
+    assert (await DailyService.claim_daily(1)).success
+
+async def test_claim_already_in_the_log_reports_the_current_streak(redis, rows, monkeypatch):
+    answers, credited = rows
+    answers.append(asyncpg.UniqueViolationError("duplicate key"))
+
+    async def fetchval(query, *args):
+        assert query == daily_service.DAILY_STREAK
+        return 5
+
+    monkeypatch.setattr(Database, "fetchval", fetchval)
+
+    claim = await DailyService.claim_daily(1)
+    assert (claim.status, claim.streak) == ('already_claimed', 5)
+    assert credited == []
+    assert (await DailyService.claim_daily(1)).status == 'already_claimed'
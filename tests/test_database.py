@@ -0,0 +1,62 @@
+import os
+from contextlib import asynccontextmanager
+import asyncpg
+import pytest
+from bot.db.connection import Database
+
+QUERY = Database.register("test_echo", "SELECT $1::int")
+
+class FakeConnection:
+    """Mimics asyncpg: prepared statements die when the connection is released"""
+
+    def __init__(self):
+        self.release_ctr = 0
+        self.calls = []
+
+    async def prepare(self, sql):
+        ctr = self.release_ctr
+        conn = self
+
+        class Statement:
+            async def fetchval(self, *args):
+                if conn.release_ctr != ctr:
+                    raise asyncpg.InterfaceError(
+                        "cannot call PreparedStatement.fetchval(): the underlying "
+                        "connection has been released back to the pool"
+                    )
+                return args[0]
+        return Statement()
+
+    async def fetchval(self, sql, *args):
+        self.calls.append(sql)
+        return args[0]
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+
+    @asynccontextmanager
+    async def acquire(self):
+        try:
+            yield self.conn
+        finally:
+            self.conn.release_ctr += 1
+
+async def test_registered_queries_survive_release_and_reacquire():
+    pool = FakePool()
+    for value in (1, 2):
+        async with Database.acquire(pool) as conn:
+            assert await Database.run(conn, 'fetchval', QUERY, value) == value
+
+    assert pool.conn.calls == ["SELECT $1::int", "SELECT $1::int"]
+    assert Database.stats()['queries'][QUERY]['count'] >= 2
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="needs TEST_DATABASE_URL")
+async def test_registered_queries_survive_release_on_postgres():
+    pool = await asyncpg.create_pool(os.environ["TEST_DATABASE_URL"], min_size=1, max_size=1)
+    try:
+        for value in (1, 2, 3):
+            async with Database.acquire(pool) as conn:
+                assert await Database.run(conn, 'fetchval', QUERY, value) == value
+    finally:
+        await pool.close()
@@ -0,0 +1,40 @@
+import pytest
+from bot.utils.energy import EnergyState, SETTLE_ENERGY_LUA
+
+def test_settle_adds_whole_points_and_keeps_partial_progress():
+    state = EnergyState(energy_at=10, timestamp=0, regen_rate=1, cap=100)
+    settled = state.settle(now=150)  # 2.5 minutes at 1 point per minute
+    assert settled.energy_at == 12
+    assert settled.timestamp == 120
+    assert settled.current(now=180) == 13
+
+def test_settle_caps_energy():
+    state = EnergyState(energy_at=99, timestamp=0, regen_rate=1, cap=100)
+    settled = state.settle(now=600)
+    assert settled.energy_at == 100
+    assert settled.timestamp == 600
+
+def test_settle_ignores_clock_going_backwards():
+    state = EnergyState(energy_at=10, timestamp=100, regen_rate=1, cap=100)
+    assert state.settle(now=50) == state
+
+def test_spend_settles_first():
+    state = EnergyState(energy_at=0, timestamp=0, regen_rate=2, cap=100)
+    assert state.spend(now=60).energy_at == 1
+
+SETTLE_SCRIPT = SETTLE_ENERGY_LUA + """
+local energy, stamp = settle_energy(tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5]))
+return {energy, tostring(stamp)}
+"""
+
+@pytest.mark.parametrize("energy_at, timestamp, regen_rate, cap, now", [
+    (10, 0, 1, 100, 150),
+    (99, 0, 1, 100, 600),
+    (10, 100, 1, 100, 50),
+    (0, 0, 2, 100, 61),
+    (100, 0, 1, 100, 10),
+])
+async def test_lua_settle_matches_python(redis, energy_at, timestamp, regen_rate, cap, now):
+    energy, stamp = await redis.eval(SETTLE_SCRIPT, 0, energy_at, timestamp, regen_rate, cap, now)
+    settled = EnergyState(energy_at, timestamp, regen_rate, cap).settle(now)
+    assert (energy, float(stamp)) == (settled.energy_at, settled.timestamp)
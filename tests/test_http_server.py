@@ -0,0 +1,62 @@
+import asyncio
+import pytest
+from bot.utils.http_server import HttpServer, json_response
+
+@pytest.fixture
+async def server():
+    server = HttpServer("127.0.0.1", 0)
+
+    async def echo(method, headers, body):
+        return json_response(200, {'method': method, 'body': body.decode(), 'token': headers.get('x-token')})
+
+    async def broken(method, headers, body):
+        raise RuntimeError("boom")
+
+    server.route("/echo", echo)
+    server.route("/broken", broken)
+    await server.start()
+    server.port = server._server.sockets[0].getsockname()[1]
+    yield server
+    await server.stop()
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    headers = {}
+    while (line := await reader.readline()) != b"\r\n":
+        name, _, value = line.decode().partition(":")
+        headers[name.lower()] = value.strip()
+    body = await reader.readexactly(int(headers["content-length"]))
+    return int(status_line.split()[1]), headers, body
+
+async def test_routes_requests_over_one_keep_alive_connection(server):
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    writer.write(b"POST /echo?x=1 HTTP/1.1\r\nX-Token: abc\r\nContent-Length: 5\r\n\r\nhello")
+    writer.write(b"GET /missing HTTP/1.1\r\n\r\n")
+    await writer.drain()
+
+    status, headers, body = await read_response(reader)
+    assert status == 200
+    assert headers["connection"] == "keep-alive"
+    assert body == b'{"method": "POST", "body": "hello", "token": "abc"}'
+
+    status, _, _ = await read_response(reader)
+    assert status == 404
+    writer.close()
+
+async def test_handler_errors_become_500(server):
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    writer.write(b"GET /broken HTTP/1.1\r\nConnection: close\r\n\r\n")
+    await writer.drain()
+    status, headers, _ = await read_response(reader)
+    assert status == 500
+    assert headers["connection"] == "close"
+    assert await reader.read() == b""
+    writer.close()
+
+async def test_rejects_oversized_bodies(server):
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    writer.write(f"POST /echo HTTP/1.1\r\nContent-Length: {HttpServer.MAX_BODY + 1}\r\n\r\n".encode())
+    await writer.drain()
+    status, _, _ = await read_response(reader)
+    assert status == 413
+    writer.close()
@@ -0,0 +1,55 @@
+import time
+from bot.services import leaderboard_service
+from bot.services.leaderboard_service import LeaderboardService
+from bot.utils.redis_manager import BALANCE_LEADERBOARD, RedisManager
+
+async def rows(*batches):
+    for batch in batches:
+        yield batch
+
+async def scores(redis):
+    return {int(member): score for member, score in await redis.zrange(BALANCE_LEADERBOARD, 0, -1, withscores=True)}
+
+async def test_correct_brings_redis_in_line_with_postgres(redis):
+    await redis.zadd(BALANCE_LEADERBOARD, {"1": 10, "2": 50, "3": 7})
+
+    corrected = await LeaderboardService._correct(
+        BALANCE_LEADERBOARD, rows([(1, 10), (2, 40)], [(4, 5)])
+    )
+
+    # 2 drifted, 4 was missing and 3 no longer has a balance in Postgres
+    assert corrected == 3
+    assert await scores(redis) == {1: 10, 2: 40, 4: 5}
+
+async def test_correct_keeps_increments_made_during_the_scan(redis):
+    await redis.zadd(BALANCE_LEADERBOARD, {"1": 10})
+
+    async def batches():
+        yield [(1, 12)]
+        # A tap lands after user 1's row was compared
+        await redis.zincrby(BALANCE_LEADERBOARD, 3, "1")
+
+    await LeaderboardService._correct(BALANCE_LEADERBOARD, batches())
+    assert await scores(redis) == {1: 15}
+
+async def test_recent_tappers_are_not_lowered(redis):
+    await redis.zadd(BALANCE_LEADERBOARD, {"1": 20, "2": 20})
+    # User 1 tapped just now; their taps may sit in another process's buffer
+    await redis.hset(RedisManager.user_key(1), "lt", time.time())
+
+    await LeaderboardService._correct(
+        BALANCE_LEADERBOARD, rows([(1, 15), (2, 15)]), skip_recent_taps=True
+    )
+    assert await scores(redis) == {1: 20, 2: 15}
+
+async def test_reconcile_waits_while_taps_cannot_be_written(redis, monkeypatch):
+    async def flush(force=False):
+        return False
+
+    def scan(query):
+        raise AssertionError("should not scan")
+
+    monkeypatch.setattr(leaderboard_service.TapWriteBuffer, "flush", flush)
+    monkeypatch.setattr(LeaderboardService, "_scan", scan)
+
+    await LeaderboardService.reconcile()
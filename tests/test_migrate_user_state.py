@@ -0,0 +1,38 @@
+import pytest
+from bot.config import config
+from bot.utils import migrate_user_state
+from bot.utils.redis_manager import RedisManager
+
+@pytest.fixture
+def keep_connection(monkeypatch):
+    async def close():
+        pass
+    monkeypatch.setattr(RedisManager, "close", close)
+
+async def test_moves_legacy_keys_into_the_user_hash(redis, keep_connection):
+    await redis.set("energy:1", 40)
+    await redis.set("energy:2", 10 ** 6)
+    await redis.hset("energy_state:3", mapping={"e": 5, "t": 100, "r": 1, "c": 100})
+    await redis.set("last_tap:3", 123.5)
+    await redis.set("tap_count:3", 4)
+    await redis.zadd("leaderboard", {"1": 10})
+
+    await migrate_user_state.migrate()
+
+    state = await redis.hgetall("u:1")
+    assert state["e"] == "40"
+    assert state["c"] == str(config.max_energy)
+    assert await redis.hget("u:2", "e") == str(config.max_energy)
+    assert await redis.hgetall("u:3") == {"e": "5", "t": "100", "r": "1", "c": "100", "lt": "123.5"}
+    assert await redis.keys("energy*") == []
+    assert await redis.keys("tap_count*") == []
+    assert not await redis.exists("leaderboard")
+
+async def test_never_overwrites_newer_state(redis, keep_connection):
+    await redis.hset("u:1", mapping={"e": 7, "t": 500, "r": 1, "c": 100})
+    await redis.set("energy:1", 99)
+
+    await migrate_user_state.migrate()
+
+    assert await redis.hget("u:1", "e") == "7"
+    assert not await redis.exists("energy:1")
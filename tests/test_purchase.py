@@ -0,0 +1,78 @@
+from decimal import Decimal
+import pytest
+from bot.db.connection import Database
+from bot.services import upgrade_service
+from bot.services.upgrade_catalog import CatalogUpgrade, UpgradeCatalog
+from bot.services.upgrade_service import PURCHASE_UPGRADE, UpgradeService
+
+POWER = CatalogUpgrade(
+    id=1,
+    name="Tap Power",
+    description="",
+    effect_type="tap_multiplier",
+    effect_value=0.5,
+    max_level=2,
+    costs=(Decimal(100), Decimal(150)),
+    effects=(0.0, 0.5, 1.0)
+)
+
+@pytest.fixture
+def shop(monkeypatch):
+    """Records the purchase call and what happened around it"""
+    calls = []
+    answers = []
+
+    async def flush_user(user_id):
+        calls.append(("flush", user_id))
+
+    async def fetchrow(query, *args):
+        calls.append(("purchase", query, args))
+        return answers.pop(0)
+
+    async def refresh_effects(user_id):
+        calls.append(("effects", user_id))
+
+    async def invalidate_profile(*user_ids):
+        calls.append(("profile", user_ids))
+
+    async def record_balance_change(user_id, amount):
+        calls.append(("leaderboard", user_id, amount))
+
+    monkeypatch.setattr(UpgradeCatalog, "_upgrades", {POWER.id: POWER})
+    monkeypatch.setattr(upgrade_service.TapWriteBuffer, "flush_user", flush_user)
+    monkeypatch.setattr(Database, "fetchrow", fetchrow)
+    monkeypatch.setattr(UpgradeService, "refresh_effects", refresh_effects)
+    monkeypatch.setattr(upgrade_service.RedisManager, "invalidate_profile", invalidate_profile)
+    monkeypatch.setattr(upgrade_service.LeaderboardService, "record_balance_change", record_balance_change)
+    return calls, answers
+
+async def test_purchase_is_one_call_after_flushing_buffered_taps(shop):
+    calls, answers = shop
+    answers.append({'result': 'ok', 'new_level': 1, 'price': Decimal(110), 'new_balance': Decimal(90)})
+
+    result = await UpgradeService.purchase_upgrade(7, 1, tax_rate=0.1)
+
+    assert result.success
+    assert (result.name, result.level, result.cost, result.balance) == ("Tap Power", 1, Decimal(110), Decimal(90))
+    assert calls == [
+        ("flush", 7),
+        ("purchase", PURCHASE_UPGRADE, (7, 1, [Decimal("110.0"), Decimal("165.0")])),
+        ("effects", 7),
+        ("profile", (7,)),
+        ("leaderboard", 7, Decimal(-110))
+    ]
+
+async def test_refused_purchase_changes_nothing_else(shop):
+    calls, answers = shop
+    answers.append({'result': 'insufficient_funds', 'new_level': 0, 'price': Decimal(100), 'new_balance': Decimal(5)})
+
+    result = await UpgradeService.purchase_upgrade(7, 1)
+
+    assert result.status == 'insufficient_funds'
+    assert [call[0] for call in calls] == ["flush", "purchase"]
+
+async def test_unknown_upgrade_never_reaches_the_database(shop):
+    calls, _ = shop
+
+    assert (await UpgradeService.purchase_upgrade(7, 99)).status == 'not_found'
+    assert calls == []
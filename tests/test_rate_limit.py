@@ -0,0 +1,39 @@
+import pytest
+from bot.utils.rate_limit import RateLimit
+from bot.utils.redis_manager import RedisManager
+
+def test_parse():
+    assert RateLimit.parse("token_bucket:5:5") == RateLimit("token_bucket", 5.0, 5.0)
+    assert RateLimit.parse("sliding_window:20:60") == RateLimit("sliding_window", 20.0, 60.0)
+
+@pytest.mark.parametrize("spec", ["leaky_bucket:5:5", "token_bucket:5", "token_bucket:five:5"])
+def test_parse_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        RateLimit.parse(spec)
+
+async def hits(limit: RateLimit, times):
+    return [await RedisManager.hit_rate_limit(1, "test", limit, now) for now in times]
+
+async def test_token_bucket_allows_a_burst_then_refills(redis):
+    limit = RateLimit.parse("token_bucket:3:3")  # 1 per second, bursts of 3
+    decisions = await hits(limit, [100, 100, 100, 100])
+    assert [d.allowed for d in decisions] == [True, True, True, False]
+    assert decisions[-1].retry_after == pytest.approx(1.0)
+
+    later = await hits(limit, [101, 101])
+    assert [d.allowed for d in later] == [True, False]
+
+async def test_sliding_window_weights_the_previous_window(redis):
+    limit = RateLimit.parse("sliding_window:2:60")
+    assert [d.allowed for d in await hits(limit, [10, 20, 30])] == [True, True, False]
+
+    # Half way into the next window the previous two hits still count as one
+    decisions = await hits(limit, [90, 91])
+    assert [d.allowed for d in decisions] == [True, False]
+    assert 0 < decisions[-1].retry_after <= 60
+
+async def test_actions_are_limited_independently(redis):
+    limit = RateLimit.parse("sliding_window:1:60")
+    assert (await RedisManager.hit_rate_limit(1, "shop", limit, 10)).allowed
+    assert (await RedisManager.hit_rate_limit(1, "daily", limit, 10)).allowed
+    assert not (await RedisManager.hit_rate_limit(1, "shop", limit, 11)).allowed
@@ -0,0 +1,72 @@
+import os
+import asyncpg
+import pytest
+from bot.db.connection import Database
+from bot.services.user_service import UserService
+from bot.utils.redis_manager import BALANCE_LEADERBOARD, REFERRAL_LEADERBOARD
+
+@pytest.fixture
+def credited(monkeypatch):
+    """How many inviter rows the referral statement reports it credited"""
+    result = {'count': 1, 'calls': []}
+
+    async def fetchval(query, *args):
+        result['calls'].append(args)
+        return result['count']
+
+    monkeypatch.setattr(Database, "fetchval", fetchval)
+    return result
+
+async def test_referral_updates_counters_and_rankings(redis, credited):
+    await redis.set("profile:1", "cached")
+
+    assert await UserService.process_referral(1, 2, 10.0)
+
+    assert credited['calls'] == [(1, 2, 10.0)]
+    assert await redis.get("profile:1") is None
+    assert await redis.zscore(REFERRAL_LEADERBOARD, "1") == 1
+    assert await redis.zscore(BALANCE_LEADERBOARD, "1") == 10
+
+async def test_repeat_or_unknown_inviter_pays_nothing(redis, credited):
+    credited['count'] = 0
+
+    assert not await UserService.process_referral(1, 2, 10.0)
+
+    assert await redis.zscore(REFERRAL_LEADERBOARD, "1") is None
+    assert await redis.zscore(BALANCE_LEADERBOARD, "1") is None
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="needs TEST_DATABASE_URL")
+async def test_referral_statement_credits_once_on_postgres(redis, monkeypatch):
+    conn = await asyncpg.connect(os.environ["TEST_DATABASE_URL"])
+    try:
+        # Temporary tables shadow the real ones for this connection only
+        await conn.execute("""
+            CREATE TEMP TABLE users (
+                user_id BIGINT PRIMARY KEY,
+                balance NUMERIC NOT NULL DEFAULT 0,
+                referrals INTEGER DEFAULT 0,
+                referral_earnings NUMERIC DEFAULT 0,
+                invited_by BIGINT
+            );
+            CREATE TEMP TABLE referrals (
+                referrer_id BIGINT,
+                referred_id BIGINT,
+                PRIMARY KEY (referrer_id, referred_id)
+            );
+            INSERT INTO users (user_id) VALUES (1), (2);
+        """)
+
+        async def fetchval(query, *args):
+            return await conn.fetchval(query, *args)
+
+        monkeypatch.setattr(Database, "fetchval", fetchval)
+
+        assert await UserService.process_referral(1, 2, 10.0)
+        assert not await UserService.process_referral(1, 2, 10.0)
+        assert not await UserService.process_referral(3, 2, 10.0)
+
+        inviter = await conn.fetchrow("SELECT * FROM users WHERE user_id = 1")
+        assert (inviter['referrals'], inviter['referral_earnings'], inviter['balance']) == (1, 10, 10)
+        assert await conn.fetchval("SELECT invited_by FROM users WHERE user_id = 2") == 1
+    finally:
+        await conn.close()
@@ -0,0 +1,77 @@
+import pytest
+from telegram import Update
+from bot.handlers import tap
+from bot.services.upgrade_service import UpgradeEffects
+from bot.utils.redis_manager import TapVerdict
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.answered = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        self.answered.append(callback_query_id)
+
+USER = {'id': 42, 'is_bot': False, 'first_name': "Ann"}
+MESSAGE = {'message_id': 7, 'date': 0, 'chat': {'id': 42, 'type': "private"}, 'from': USER}
+
+@pytest.fixture
+def taps(monkeypatch):
+    recorded = []
+
+    async def get_effects(user_id):
+        return UpgradeEffects(tap_multiplier=2.0, max_energy=100, energy_regen=1.0, referral_bonus=0.0)
+
+    async def admit_tap(user_id, max_energy, regen_rate, rate_limit, now):
+        return TapVerdict("ok", 99)
+
+    async def is_registered(user_id):
+        return user_id == 42
+
+    async def record_tap(user_id, amount):
+        pass
+
+    monkeypatch.setattr(tap.UpgradeService, "get_effects", get_effects)
+    monkeypatch.setattr(tap.RedisManager, "admit_tap", admit_tap)
+    monkeypatch.setattr(tap.UserService, "is_registered", is_registered)
+    monkeypatch.setattr(tap.LeaderboardService, "record_tap", record_tap)
+    monkeypatch.setattr(tap.TapWriteBuffer, "add_tap", lambda user_id, amount: recorded.append((user_id, amount)))
+    return recorded
+
+async def test_tap_button_goes_through_admission_and_replies_to_its_message(taps):
+    bot = FakeBot()
+    update = Update.de_json({
+        'update_id': 1,
+        'callback_query': {'id': "q1", 'from': USER, 'chat_instance': "c", 'data': "tap", 'message': MESSAGE}
+    }, bot)
+
+    await tap.tap_callback(update, None)
+
+    assert bot.answered == ["q1"]
+    assert taps == [(42, 2.0)]
+    assert len(bot.sent) == 1
+    assert bot.sent[0][0] == 42
+    assert "Energy: 99/100" in bot.sent[0][1]
+
+async def test_tap_command_replies_in_chat(taps):
+    bot = FakeBot()
+    update = Update.de_json({'update_id': 2, 'message': {**MESSAGE, 'text': "/tap"}}, bot)
+
+    await tap.tap_command(update, None)
+
+    assert taps == [(42, 2.0)]
+    assert "+2.00 AUG" in bot.sent[0][1]
+
+async def test_unregistered_users_are_sent_to_start(taps):
+    bot = FakeBot()
+    stranger = {**USER, 'id': 5}
+    message = {**MESSAGE, 'chat': {'id': 5, 'type': "private"}, 'from': stranger, 'text': "/tap"}
+    update = Update.de_json({'update_id': 3, 'message': message}, bot)
+
+    await tap.tap_command(update, None)
+
+    assert taps == []
+    assert "/start" in bot.sent[0][1]
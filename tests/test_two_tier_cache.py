@@ -0,0 +1,91 @@
+import asyncio
+import json
+from collections import OrderedDict
+import pytest
+from bot.services.upgrade_service import UpgradeService
+from bot.utils.redis_manager import RedisManager
+from bot.utils.two_tier_cache import TwoTierCache
+
+@pytest.fixture
+def published(monkeypatch):
+    messages = []
+
+    async def publish(channel, message):
+        messages.append((channel, message))
+
+    monkeypatch.setattr(RedisManager, "publish", publish)
+    return messages
+
+async def test_reads_fall_through_l1_then_redis_then_the_loader(redis):
+    cache = TwoTierCache("test_tiers", redis_ttl=60)
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        return {"v": 1}
+
+    assert await cache.get("k", loader) == {"v": 1}
+    assert await cache.get("k", loader) == {"v": 1}
+    cache._drop_local("k")
+    assert await cache.get("k", loader) == {"v": 1}
+
+    assert len(loads) == 1
+    assert (cache.misses, cache.hits, cache.redis_hits) == (1, 1, 1)
+
+async def test_l1_is_bounded_and_expires():
+    cache = TwoTierCache("test_bounds", max_size=2, ttl=0.05)
+    for key in ("a", "b", "c"):
+        cache.set_local(key, key)
+
+    assert cache.get_local("a") is None
+    assert cache.get_local("c") == "c"
+    await asyncio.sleep(0.06)
+    assert cache.get_local("c") is None
+
+async def test_invalidate_drops_both_tiers_and_broadcasts(redis, published):
+    cache = TwoTierCache("test_invalidate", redis_ttl=60)
+    await cache.set("k", 1)
+
+    await cache.invalidate("k")
+
+    assert cache.get_local("k") is None
+    assert await redis.get("tt:test_invalidate:k") is None
+    assert published == [(TwoTierCache.CHANNEL, {'cache': "test_invalidate", 'key': "k"})]
+
+async def test_broadcasts_from_other_processes_drop_l1_copies(redis):
+    cache = TwoTierCache("test_listen")
+    cache.set_local("k", 1)
+    cache.set_local("own", 1)
+
+    TwoTierCache.start_listener()
+    try:
+        await asyncio.sleep(0.05)
+        # Our own broadcasts are skipped; another process's are applied
+        await RedisManager.publish(TwoTierCache.CHANNEL, {'cache': "test_listen", 'key': "own"})
+        await redis.publish(
+            TwoTierCache.CHANNEL, json.dumps({'cache': "test_listen", 'key': "k", 'origin': "other"})
+        )
+        for _ in range(50):
+            if cache.get_local("k") is None:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await TwoTierCache.stop_listener()
+
+    assert cache.get_local("k") is None
+    assert cache.get_local("own") == 1
+
+async def test_cold_effects_load_does_not_broadcast(redis, published, monkeypatch):
+    monkeypatch.setattr(UpgradeService._effects_cache, "_entries", OrderedDict())
+
+    async def get_user_upgrades(user_id, readonly=False):
+        return {}
+
+    monkeypatch.setattr(UpgradeService, "get_user_upgrades", get_user_upgrades)
+
+    effects = await UpgradeService.get_effects(1)
+    assert effects.tap_multiplier == 1.0
+    assert published == []
+
+    await UpgradeService.refresh_effects(1)
+    assert published == [(TwoTierCache.CHANNEL, {'cache': "upgrade_effects", 'key': "1"})]
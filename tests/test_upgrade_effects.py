@@ -0,0 +1,44 @@
+from decimal import Decimal
+import pytest
+from bot.config import config
+from bot.services.upgrade_catalog import CatalogUpgrade, UpgradeCatalog
+from bot.services.upgrade_service import UpgradeService
+
+def upgrade(upgrade_id, effect_type, effect_value):
+    return CatalogUpgrade(
+        id=upgrade_id,
+        name=effect_type,
+        description="",
+        effect_type=effect_type,
+        effect_value=effect_value,
+        max_level=5,
+        costs=(Decimal(1),) * 5,
+        effects=tuple(effect_value * level for level in range(6))
+    )
+
+@pytest.fixture
+def levels(monkeypatch):
+    owned = {}
+
+    async def get_user_upgrades(user_id, readonly=False):
+        return owned
+
+    monkeypatch.setattr(UpgradeCatalog, "_upgrades", {
+        1: upgrade(1, "tap_multiplier", 1.1),
+        2: upgrade(2, "max_energy", 10)
+    })
+    monkeypatch.setattr(UpgradeService, "get_user_upgrades", get_user_upgrades)
+    return owned
+
+async def test_no_upgrades_keep_the_base_tap_reward(redis, levels):
+    effects = await UpgradeService._build_effects(1)
+    assert effects.tap_multiplier == 1.0
+    assert effects.max_energy == config.max_energy
+
+async def test_tap_multiplier_counts_the_upgrade_once_whatever_its_level(redis, levels):
+    levels.update({1: 3, 2: 2})
+
+    effects = await UpgradeService._build_effects(1)
+
+    assert effects.tap_multiplier == pytest.approx(1.1)
+    assert effects.max_energy == config.max_energy + 20
@@ -0,0 +1,109 @@
+import asyncio
+from telegram import CallbackQuery, Chat, Message, Update, User
+from bot.utils.user_lanes import UserLaneProcessor
+
+class FakeBot:
+    def __init__(self):
+        self.answered = []
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        self.answered.append(callback_query_id)
+
+def callback(user_id: int, data: str, bot=None, update_id: int = 1) -> Update:
+    query = CallbackQuery(str(update_id), User(user_id, "u", False), "chat", data=data)
+    if bot is not None:
+        query.set_bot(bot)
+    return Update(update_id, callback_query=query)
+
+def command(user_id: int, text: str) -> Update:
+    user = User(user_id, "u", False)
+    message = Message(1, None, Chat(user_id, "private"), from_user=user, text=text)
+    return Update(1, message=message)
+
+async def test_same_user_runs_in_order_and_users_run_in_parallel():
+    processor = UserLaneProcessor(64, max_depth=8, tap_depth=8)
+    log = []
+
+    async def work(tag):
+        log.append(("start", tag))
+        await asyncio.sleep(0.01)
+        log.append(("end", tag))
+
+    await asyncio.gather(
+        processor.process_update(callback(1, "buy_a"), work("a1")),
+        processor.process_update(callback(1, "buy_b"), work("a2")),
+        processor.process_update(callback(2, "buy_c"), work("b1")),
+    )
+    assert log.index(("end", "a1")) < log.index(("start", "a2"))
+    assert log.index(("start", "b1")) < log.index(("end", "a1"))
+
+async def test_idle_lanes_are_removed():
+    processor = UserLaneProcessor(64, max_depth=8, tap_depth=2)
+
+    async def work():
+        pass
+
+    await processor.process_update(callback(1, "buy_a"), work())
+    assert processor.stats()['lanes'] == 0
+
+async def test_full_lane_drops_taps_and_answers_the_button():
+    bot = FakeBot()
+    processor = UserLaneProcessor(64, max_depth=8, tap_depth=1)
+    release = asyncio.Event()
+    ran = []
+
+    async def work(tag):
+        ran.append(tag)
+        await release.wait()
+
+    first = asyncio.create_task(processor.process_update(callback(1, "tap", bot, 1), work("first")))
+    await asyncio.sleep(0)
+    await processor.process_update(callback(1, "tap", bot, 2), work("dropped"))
+    await processor.process_update(command(1, "/tap@AugustTapBot"), work("dropped too"))
+    release.set()
+    await first
+    await processor.shutdown()
+
+    assert ran == ["first"]
+    assert bot.answered == ["2"]
+    assert processor.stats()['dropped_taps'] == 2
+    assert processor.stats()['lanes'] == 0
+
+async def test_max_depth_zero_drops_everything_without_leaving_a_lane():
+    processor = UserLaneProcessor(64, max_depth=0, tap_depth=0)
+
+    async def work():
+        raise AssertionError("should have been dropped")
+
+    await processor.process_update(command(1, "/shop"), work())
+    assert processor.stats() == {'lanes': 0, 'queued': 0, 'dropped': 1, 'dropped_taps': 0}
+
+def test_is_tap():
+    assert UserLaneProcessor.is_tap(callback(1, "tap"))
+    assert UserLaneProcessor.is_tap(command(1, "/tap"))
+    assert not UserLaneProcessor.is_tap(callback(1, "buy_x"))
+    assert not UserLaneProcessor.is_tap(command(1, "/tapped"))
+
+async def test_one_users_flood_does_not_block_another_user():
+    processor = UserLaneProcessor(2, max_depth=8, tap_depth=8)
+    release = asyncio.Event()
+    ran = []
+
+    async def work(tag):
+        ran.append(tag)
+        if tag.startswith("flood"):
+            await release.wait()
+
+    flood = [
+        asyncio.create_task(processor.process_update(callback(1, "buy_a", update_id=i), work(f"flood{i}")))
+        for i in range(6)
+    ]
+    await asyncio.sleep(0)
+    # User 1 holds one slot; their queued updates must not take the other
+    await asyncio.wait_for(processor.process_update(callback(2, "buy_b"), work("other")), 1)
+    assert ran == ["flood0", "other"]
+
+    release.set()
+    await asyncio.gather(*flood)
+    assert ran[2:] == [f"flood{i}" for i in range(1, 6)]
+    assert processor.stats()['lanes'] == 0
@@ -0,0 +1,48 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+from bot import main
+from bot.config import config
+
+@pytest.fixture
+def application(monkeypatch):
+    monkeypatch.setattr(config, "webhook_secret", "s3cret")
+    return SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+
+UPDATE = json.dumps({'update_id': 1, 'message': {
+    'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': "private"}, 'text': "/tap"
+}}).encode()
+
+async def test_queues_updates_with_the_right_secret(application):
+    handle = main.webhook_route(application)
+    status, _, _ = await handle("POST", {'x-telegram-bot-api-secret-token': "s3cret"}, UPDATE)
+    assert status == 200
+    assert application.update_queue.get_nowait().update_id == 1
+
+@pytest.mark.parametrize("headers", [{}, {'x-telegram-bot-api-secret-token': "wrong"}])
+async def test_rejects_a_missing_or_wrong_secret(application, headers):
+    handle = main.webhook_route(application)
+    status, _, _ = await handle("POST", headers, UPDATE)
+    assert status == 401
+    assert application.update_queue.empty()
+
+async def test_rejects_everything_when_no_secret_is_configured(application, monkeypatch):
+    monkeypatch.setattr(config, "webhook_secret", None)
+    handle = main.webhook_route(application)
+    status, _, _ = await handle("POST", {'x-telegram-bot-api-secret-token': ""}, UPDATE)
+    assert status == 401
+
+@pytest.mark.parametrize("body", [b"not json", b"[1, 2]", b"42", b'{"message": {}}'])
+async def test_rejects_bodies_that_are_not_updates(application, body):
+    handle = main.webhook_route(application)
+    status, _, _ = await handle("POST", {'x-telegram-bot-api-secret-token': "s3cret"}, body)
+    assert status == 400
+    assert application.update_queue.empty()
+
+async def test_webhook_mode_refuses_to_start_without_a_secret(monkeypatch):
+    monkeypatch.setattr(config, "bot_mode", "webhook")
+    monkeypatch.setattr(config, "webhook_url", "https://bot.example.com")
+    monkeypatch.setattr(config, "webhook_secret", None)
+    with pytest.raises(ValueError, match="WEBHOOK_SECRET"):
+        await main.main()
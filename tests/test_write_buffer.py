@@ -0,0 +1,181 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from decimal import Decimal
+import pytest
+from bot.db.connection import Database
+from bot.db.write_buffer import KNOWN_USERS, TapWriteBuffer
+
+@pytest.fixture(autouse=True)
+def empty_buffer(monkeypatch):
+    monkeypatch.setattr(TapWriteBuffer, "_deltas", TapWriteBuffer._deltas.__class__(Decimal))
+    monkeypatch.setattr(TapWriteBuffer, "_taps", TapWriteBuffer._taps.__class__(list))
+    monkeypatch.setattr(TapWriteBuffer, "_size", 0)
+    monkeypatch.setattr(TapWriteBuffer, "_lock", None)
+    monkeypatch.setattr(TapWriteBuffer, "_failing_since", None)
+    monkeypatch.setattr(TapWriteBuffer, "_retry_at", 0.0)
+    monkeypatch.setattr(TapWriteBuffer, "_backoff", 0.0)
+
+class FakeConn:
+    """Records what a flush would have written"""
+
+    def __init__(self, known_users):
+        self.known_users = known_users
+        self.balances = []
+        self.copied = []
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copied.extend(records)
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = FakeConn(known_users={1, 2})
+
+    @asynccontextmanager
+    async def acquire(pool=None):
+        yield conn
+
+    async def run(c, method, query, *args):
+        if query == KNOWN_USERS:
+            return [user_id for user_id in args[0] if user_id in c.known_users]
+        if method == 'executemany' and query == "tap_flush_balances":
+            c.balances.extend(args[0])
+
+    monkeypatch.setattr(Database, "acquire", acquire)
+    monkeypatch.setattr(Database, "run", run)
+    return conn
+
+def buffered():
+    return {user_id: len(taps) for user_id, taps in TapWriteBuffer._taps.items() if taps}
+
+async def test_flush_writes_balances_and_taps(conn):
+    TapWriteBuffer.add_tap(1, 1.5)
+    TapWriteBuffer.add_tap(2, 1)
+    TapWriteBuffer.add_tap(1, 1.5)
+
+    assert await TapWriteBuffer.flush()
+    assert conn.balances == [(Decimal("3.0"), 1), (Decimal("1"), 2)]
+    assert [record[0] for record in conn.copied] == [1, 1, 2]
+    assert TapWriteBuffer.size() == 0
+    assert TapWriteBuffer.pending_balance(1) == 0
+
+async def test_flush_leaves_out_users_without_a_row(conn):
+    TapWriteBuffer.add_tap(1, 1)
+    TapWriteBuffer.add_tap(99, 1)
+
+    assert await TapWriteBuffer.flush()
+    assert conn.balances == [(Decimal("1"), 1)]
+    assert [record[0] for record in conn.copied] == [1]
+    # The bad user's taps do not come back to block later flushes
+    assert TapWriteBuffer.size() == 0
+
+async def test_failed_flush_requeues_and_backs_off(monkeypatch):
+    async def fail(deltas, taps):
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(TapWriteBuffer, "_write", fail)
+    TapWriteBuffer.add_tap(1, 1)
+    TapWriteBuffer.add_tap(2, 2)
+
+    assert not await TapWriteBuffer.flush()
+    assert buffered() == {1: 1, 2: 1}
+    assert TapWriteBuffer.pending_balance(2) == Decimal("2")
+    assert TapWriteBuffer.size() == 2
+    assert TapWriteBuffer._failing_since is not None
+
+    # Backing off: the next periodic flush does not even try
+    calls = []
+
+    async def record(deltas, taps):
+        calls.append(deltas)
+
+    monkeypatch.setattr(TapWriteBuffer, "_write", record)
+    assert not await TapWriteBuffer.flush()
+    assert calls == []
+
+    # A forced flush (shutdown) ignores the backoff and clears the outage
+    assert await TapWriteBuffer.flush(force=True)
+    assert calls == [{1: Decimal("1"), 2: Decimal("2")}]
+    assert TapWriteBuffer._failing_since is None
+
+async def test_requeue_keeps_older_taps_first(monkeypatch):
+    async def fail(deltas, taps):
+        TapWriteBuffer.add_tap(1, 5)  # arrives while the write is in flight
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(TapWriteBuffer, "_write", fail)
+    TapWriteBuffer.add_tap(1, 1)
+
+    await TapWriteBuffer.flush()
+    assert [amount for amount, _ in TapWriteBuffer._taps[1]] == [Decimal("1"), Decimal("5")]
+    assert TapWriteBuffer.pending_balance(1) == Decimal("6")
+    assert TapWriteBuffer.size() == 2
+
+async def test_cancelled_flush_requeues_the_batch(monkeypatch):
+    started = asyncio.Event()
+
+    async def hang(deltas, taps):
+        started.set()
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(TapWriteBuffer, "_write", hang)
+    TapWriteBuffer.add_tap(1, 1)
+    task = asyncio.create_task(TapWriteBuffer.flush())
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert buffered() == {1: 1}
+    assert TapWriteBuffer.pending_balance(1) == Decimal("1")
+
+async def test_flush_user_writes_only_that_user(conn):
+    TapWriteBuffer.add_tap(1, 1)
+    TapWriteBuffer.add_tap(2, 1)
+
+    await TapWriteBuffer.flush_user(1)
+    assert conn.balances == [(Decimal("1"), 1)]
+    assert buffered() == {2: 1}
+    assert TapWriteBuffer.size() == 1
+
+async def test_failed_flush_user_requeues_and_raises(monkeypatch):
+    async def fail(deltas, taps):
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(TapWriteBuffer, "_write", fail)
+    TapWriteBuffer.add_tap(1, 1)
+
+    with pytest.raises(ConnectionError):
+        await TapWriteBuffer.flush_user(1)
+    assert buffered() == {1: 1}
+    assert TapWriteBuffer.size() == 1
+
+async def test_full_refuses_past_the_pending_cap(monkeypatch):
+    monkeypatch.setattr("bot.config.config.tap_buffer_max_pending", 2)
+    monkeypatch.setattr("bot.config.config.tap_buffer_max_size", 100)
+    TapWriteBuffer.add_tap(1, 1)
+    assert not TapWriteBuffer.full()
+    TapWriteBuffer.add_tap(1, 1)
+    assert TapWriteBuffer.full()
+
+def test_rollups_group_by_hour_and_day():
+    records = [
+        (2, Decimal("1"), datetime(2024, 1, 1, 10, 5)),
+        (1, Decimal("1"), datetime(2024, 1, 1, 10, 59)),
+        (1, Decimal("2"), datetime(2024, 1, 1, 10, 0)),
+        (1, Decimal("4"), datetime(2024, 1, 1, 11, 30)),
+    ]
+    hourly, daily = TapWriteBuffer._rollups(records)
+    assert hourly == [
+        (1, datetime(2024, 1, 1, 10), 2, Decimal("3")),
+        (1, datetime(2024, 1, 1, 11), 1, Decimal("4")),
+        (2, datetime(2024, 1, 1, 10), 1, Decimal("1")),
+    ]
+    assert daily == [
+        (1, datetime(2024, 1, 1).date(), 3, Decimal("7")),
+        (2, datetime(2024, 1, 1).date(), 1, Decimal("1")),
+    ]